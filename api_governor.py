@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+import weakref
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+
+
+# Error codes AWS returns when a caller is over its request rate.
+# CloudFormation's LimitExceededException is an account quota (number of
+# stacks, exports, ...), not a rate, so it is not retried.
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+                        'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+                        'BandwidthLimitExceeded', 'EC2ThrottledException']
+
+# Errors worth retrying as they are: the request never ran, or the service
+# failed while running it
+TRANSIENT_ERROR_CODES = ['RequestTimeout', 'RequestTimeoutException', 'PriorRequestNotComplete', 'InternalError',
+                         'InternalFailure', 'ServiceUnavailable']
+TRANSIENT_STATUS_CODES = [500, 502, 503, 504]
+
+# Starting requests per second for each (account, region, API); every bucket
+# then adapts: RATE_INCREASE more per success, RATE_DECREASE times the rate
+# per throttle (at most once per RATE_DECREASE_INTERVAL seconds, so a burst of
+# throttles from requests already in flight counts once), between MIN_RATE
+# and MAX_RATE_FACTOR times the starting rate
+SERVICE_RATES = {'cloudformation': 5.0, 's3': 50.0, 'ec2': 20.0, 'sts': 10.0}
+DEFAULT_RATE = 10.0
+RATE_INCREASE = 0.1
+RATE_DECREASE = 0.5
+RATE_DECREASE_INTERVAL = 1.0
+MIN_RATE = 0.5
+MAX_RATE_FACTOR = 4.0
+
+# Retries wait a random time up to base * 2 ** attempts (full jitter), at
+# most MAX_RETRY_DELAY seconds
+THROTTLE_BASE_DELAY = 0.5
+TRANSIENT_BASE_DELAY = 0.1
+MAX_RETRY_DELAY = 20.0
+
+
+def get_error_class(error_code=None, status_code=None, caught_exception=None):
+    # 'throttle', 'transient', or None for errors that would fail again
+    if caught_exception is not None:
+        if isinstance(caught_exception, (BotocoreConnectionError, HTTPClientError)):
+            return 'transient'
+        return None
+    if error_code in THROTTLE_ERROR_CODES or status_code == 429:
+        return 'throttle'
+    if error_code in TRANSIENT_ERROR_CODES or status_code in TRANSIENT_STATUS_CODES:
+        return 'transient'
+    return None
+
+
+def get_retry_delay(attempts, error_class):
+    if error_class == 'throttle':
+        base_delay = THROTTLE_BASE_DELAY
+    else:
+        base_delay = TRANSIENT_BASE_DELAY
+    return random.uniform(0, min(MAX_RETRY_DELAY, base_delay * 2 ** attempts))
+
+
+class TokenBucket(object):
+    # Requests per second for one API, shared by every thread calling it,
+    # with additive increase on success and multiplicative decrease on
+    # throttling
+
+    def __init__(self, rate, min_rate=MIN_RATE, max_rate=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * MAX_RATE_FACTOR
+        self.tokens = 1.0
+        self.updated = time.time()
+        self.decreased = 0.0
+
+    def refill(self, now):
+        # Tokens accumulate up to one second's worth
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # Block until a request may be sent
+        while True:
+            with self.lock:
+                self.refill(time.time())
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                delay = (1.0 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def succeeded(self):
+        with self.lock:
+            self.refill(time.time())
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def throttled(self):
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            if now - self.decreased >= RATE_DECREASE_INTERVAL:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+                self.decreased = now
+
+
+class ApiGovernor(object):
+    # Paces and retries the boto3 calls of every client attached to it, via
+    # botocore event hooks. Every attempt waits for a token from the bucket
+    # of its (account, region, API), so parallel threads share one rate per
+    # API; throttles slow the bucket down and successes speed it back up.
+    # Throttling and transient errors are retried with jittered backoff up
+    # to max_attempts attempts, anything else fails straight away.
+
+    def __init__(self, service_rates=None):
+        self.lock = threading.Lock()
+        self.service_rates = dict(SERVICE_RATES)
+        self.service_rates.update(service_rates or {})
+        self.buckets = {}
+        # Clients, not their id()s: a discarded client's id can be reused
+        self.attached = weakref.WeakSet()
+        self.retries = 0
+        self.throttles = 0
+
+    def get_bucket(self, scope, service, operation):
+        key = tuple(scope) + (service, operation)
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(self.service_rates.get(service, DEFAULT_RATE))
+            return self.buckets[key]
+
+    def get_rates(self):
+        # {(scope..., service, operation): current requests per second}
+        with self.lock:
+            return dict([(key, self.buckets[key].rate) for key in self.buckets])
+
+    def attach(self, client, scope, max_attempts):
+        # Register the hooks on a client; safe to call more than once. scope
+        # identifies the account and region the client calls. Clients
+        # without botocore events are not governed.
+        if getattr(client, 'meta', None) is None:
+            return
+        with self.lock:
+            if client in self.attached:
+                return
+            self.attached.add(client)
+
+        def before_call(model, context, **kwargs):
+            context['api_governor_bucket'] = self.get_bucket(scope, model.service_model.service_name, model.name)
+
+        def before_send(request, **kwargs):
+            # Called once per attempt with the prepared request
+            bucket = (getattr(request, 'context', None) or {}).get('api_governor_bucket')
+            if bucket is not None:
+                bucket.acquire()
+
+        def needs_retry(response=None, attempts=None, caught_exception=None, request_dict=None, **kwargs):
+            if request_dict is None:
+                return None
+            bucket = request_dict.get('context', {}).get('api_governor_bucket')
+            if response is not None:
+                error_class = get_error_class(response[1].get('Error', {}).get('Code'), response[0].status_code)
+            else:
+                error_class = get_error_class(caught_exception=caught_exception)
+            if error_class == 'throttle':
+                with self.lock:
+                    self.throttles += 1
+                if bucket is not None:
+                    bucket.throttled()
+            if error_class is None or attempts >= max_attempts:
+                return None
+            with self.lock:
+                self.retries += 1
+            return get_retry_delay(attempts, error_class)
+
+        def after_call(http_response, context, **kwargs):
+            bucket = context.get('api_governor_bucket')
+            if bucket is not None and http_response.status_code < 300:
+                bucket.succeeded()
+
+        events = client.meta.events
+        unique_id = 'api-governor-' + str(id(self)) + '-'
+        events.register('before-call', before_call, unique_id=unique_id + 'before-call')
+        events.register('before-send', before_send, unique_id=unique_id + 'before-send')
+        # Ahead of botocore's own retry handler, which is left with nothing
+        # to retry (see aws_clients.get_client_config)
+        events.register_first('needs-retry', needs_retry, unique_id=unique_id + 'needs-retry')
+        events.register('after-call', after_call, unique_id=unique_id + 'after-call')
@@ -0,0 +1,136 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+from api_governor import ApiGovernor
+from instrumentation import get_run_tracer
+
+
+# Connection pool and retry settings applied to every client. Pool size
+# should cover the number of threads sharing one client (parallel uploads,
+# stack submissions, pollers).
+CLIENT_CONFIG = {'max_pool_connections': 25, 'retry_mode': 'standard', 'max_attempts': 5}
+
+client_lock = threading.Lock()
+sessions = {}
+clients = {}
+# {credential identity: AWS account ID}, from sts get_caller_identity
+account_ids = {}
+# Replaces boto3 client creation when set, e.g. by the benchmark's simulated
+# backend: function(service, credentials) -> client
+client_factory = None
+# Paces and retries the calls of every client (None leaves retries to
+# botocore), see api_governor
+api_governor = ApiGovernor()
+
+
+def set_client_config(max_pool_connections=None, retry_mode=None, max_attempts=None):
+    # Change the pool/retry settings; clients created afterwards use them
+    with client_lock:
+        if max_pool_connections is not None:
+            CLIENT_CONFIG['max_pool_connections'] = max_pool_connections
+        if retry_mode is not None:
+            CLIENT_CONFIG['retry_mode'] = retry_mode
+        if max_attempts is not None:
+            CLIENT_CONFIG['max_attempts'] = max_attempts
+        clients.clear()
+
+
+def set_client_factory(factory):
+    # Route every get_client call through factory (None restores boto3)
+    global client_factory
+    with client_lock:
+        client_factory = factory
+        clients.clear()
+        account_ids.clear()
+
+
+def set_api_governor(governor):
+    # Route every client's calls through governor (None restores botocore's
+    # own retries); clients created afterwards use it
+    global api_governor
+    with client_lock:
+        api_governor = governor
+        clients.clear()
+
+
+def get_client_config():
+    # The governor makes the retries when there is one, up to max_attempts
+    max_attempts = CLIENT_CONFIG['max_attempts']
+    if api_governor is not None:
+        max_attempts = 1
+    return Config(max_pool_connections=CLIENT_CONFIG['max_pool_connections'],
+                  retries={'mode': CLIENT_CONFIG['retry_mode'], 'max_attempts': max_attempts})
+
+
+def get_credentials_identity(credentials):
+    # Key identifying who a credentials dict authenticates as
+    if credentials.get('profile_name') is not None:
+        return ('profile', credentials['profile_name'])
+    return ('keys', credentials['aws_access_key_id'], credentials['aws_session_token'])
+
+
+def get_session(credentials):
+    # One boto3 Session per credential identity. Sessions are not thread safe,
+    # so they are only used under client_lock.
+    identity = get_credentials_identity(credentials)
+    if identity not in sessions:
+        if identity[0] == 'profile':
+            sessions[identity] = boto3.session.Session(profile_name=credentials['profile_name'])
+        else:
+            sessions[identity] = boto3.session.Session(
+                aws_access_key_id=credentials['aws_access_key_id'],
+                aws_secret_access_key=credentials['aws_secret_access_key'],
+                aws_session_token=credentials['aws_session_token'])
+    return sessions[identity]
+
+
+def get_account_id(credentials):
+    # AWS account the credentials belong to, looked up once per credential
+    # identity. The lookup is made outside client_lock, so two threads may
+    # both make it for a new identity; they get the same answer. Until the
+    # account is known the lookup is paced and retried per identity.
+    identity = get_credentials_identity(credentials)
+    with client_lock:
+        if identity in account_ids:
+            return account_ids[identity]
+        if client_factory is not None:
+            sts = client_factory('sts', credentials)
+        else:
+            sts = get_session(credentials).client('sts', region_name=credentials['region_name'],
+                                                  config=get_client_config())
+        if api_governor is not None:
+            api_governor.attach(sts, identity + (credentials['region_name'],), CLIENT_CONFIG['max_attempts'])
+    account_id = sts.get_caller_identity()['Account']
+    with client_lock:
+        account_ids[identity] = account_id
+    return account_id
+
+
+def get_client(service, credentials):
+    # Return the cached client for (service, region, credential identity),
+    # creating it on first use. Clients are thread safe and reuse their
+    # connection pool and loaded service model. Governed clients are paced
+    # per (account ID, region), so a profile and keys for the same account
+    # share one rate.
+    key = (service, credentials['region_name'], get_credentials_identity(credentials))
+    scope = None
+    if api_governor is not None and key not in clients:
+        scope = (get_account_id(credentials), credentials['region_name'])
+    with client_lock:
+        if key not in clients:
+            if client_factory is not None:
+                clients[key] = client_factory(service, credentials)
+            else:
+                session = get_session(credentials)
+                clients[key] = session.client(service, region_name=credentials['region_name'],
+                                              config=get_client_config())
+            if api_governor is not None and scope is not None:
+                api_governor.attach(clients[key], scope, CLIENT_CONFIG['max_attempts'])
+        client = clients[key]
+    # Record API calls when a run trace is active
+    run_tracer = get_run_tracer()
+    if run_tracer is not None:
+        run_tracer.attach(client)
+    return client
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import aws_clients
+import deploy_base
+import deploy_defaults
+import stack_waiter
+from api_governor import ApiGovernor
+from deploy_fleet import deploy_fleet
+from deploy_settings import CF_TEMPLATES_LIST
+from fake_aws import FakeAWS
+from instrumentation import TRACE_REPORT_VARIABLE
+from state_store import close_state_store
+
+
+# Minimal templates with the parameters each default stack is given; only
+# their names and parameter defaults matter to the simulated backend
+BENCHMARK_TEMPLATES = {
+    'base_network.template': ['AvailabilityZoneCount', 'CIDRRange', 'PublicSubnetAZ1', 'PublicSubnetAZ2',
+                              'PublicSubnetAZ3', 'PrivateSubnetAZ1', 'PrivateSubnetAZ2', 'PrivateSubnetAZ3',
+                              'Environment'],
+    's3_vpc.template': ['VPCID', 'RouteTableIdsList'],
+    'route53_internalzone.template': ['VPCID', 'Environment', 'InternalZoneName'],
+    'sns_topic_subscriptions.template': ['SubscriptionEndpoint1', 'SubscriptionEndpoint2', 'SubscriptionEndpoint3',
+                                         'SubscriptionProtocol1', 'SubscriptionProtocol2', 'SubscriptionProtocol3',
+                                         'DisplayName']
+}
+
+# Regions benchmark environments are spread over
+BENCHMARK_REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1']
+
+
+def write_benchmark_templates(cf_directory):
+    for cf_template in CF_TEMPLATES_LIST:
+        template = {'AWSTemplateFormatVersion': '2010-09-09',
+                    'Parameters': dict([(key, {'Type': 'String', 'Default': ''})
+                                        for key in BENCHMARK_TEMPLATES[cf_template]]),
+                    'Resources': {'Resource': {'Type': 'AWS::CloudFormation::WaitConditionHandle'}}}
+        with open(os.path.join(cf_directory, cf_template), 'w') as f:
+            json.dump(template, f, indent=2)
+
+
+def get_benchmark_manifest(environment_count):
+    # One account per environment, spread over the benchmark regions
+    manifest = []
+    for position in range(environment_count):
+        ddi = str(900000 + position)
+        manifest.append({'ddi': ddi, 'account_name': 'Benchmark ' + ddi,
+                         'region': BENCHMARK_REGIONS[position % len(BENCHMARK_REGIONS)],
+                         'profile': 'benchmark-' + ddi, 'sns_endpoint_1': 'ops@example.com'})
+    return manifest
+
+
+def get_benchmark_run_spec(cf_directory, ddi):
+    # Run spec for the deploy scripts' non-interactive runs, one account
+    # (and profile) per script so their stacks do not collide
+    return {'Script': {'TemplateDirectory': cf_directory},
+            'Account': {'ddi': ddi, 'accountname': 'Benchmark ' + ddi},
+            'Credentials': {'Profile': 'benchmark-' + ddi},
+            'SNS Topic Subscriptions': {'DisplayName': 'Benchmark ' + ddi, 'SubscriptionEndpoint1': 'ops@example.com'}}
+
+
+def start_backend(latency, stack_duration, throttle_rate, failure_rate, seed):
+    # A fresh simulated backend behind aws_clients, its clients paced and
+    # retried by a fresh API governor
+    backend = FakeAWS(latency=latency, stack_duration=stack_duration, throttle_rate=throttle_rate,
+                      failure_rate=failure_rate, seed=seed)
+    aws_clients.set_api_governor(ApiGovernor())
+    aws_clients.set_client_factory(backend.client)
+    return backend
+
+
+def run_benchmark(environment_count, latency, stack_duration, throttle_rate, failure_rate, workers, seed=None):
+    # Deploy environment_count environments against a fresh simulated
+    # backend and return wall time, API call counts and peak memory
+    backend = start_backend(latency, stack_duration, throttle_rate, failure_rate, seed)
+    work_directory = tempfile.mkdtemp(prefix='faws-benchmark-')
+    cf_directory = os.path.join(work_directory, 'templates')
+    os.mkdir(cf_directory)
+    write_benchmark_templates(cf_directory)
+    # Journals and the state store are kept with the rest of the run
+    journal_directory = os.path.join(work_directory, 'journals')
+    state_file = os.path.join(work_directory, 'state.db')
+    original_directory = os.getcwd()
+    # Key pair files are written to the working directory
+    os.chdir(work_directory)
+    tracemalloc.start()
+    start_time = time.time()
+    try:
+        fleet_results = deploy_fleet(get_benchmark_manifest(environment_count), cf_directory, workers,
+                                     per_account=1, per_region=workers, journal_directory=journal_directory,
+                                     state_file=state_file)
+        wall_seconds = time.time() - start_time
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        os.chdir(original_directory)
+        close_state_store(state_file)
+        shutil.rmtree(work_directory)
+        aws_clients.set_client_factory(None)
+
+    failed = len([fleet_result for fleet_result in fleet_results
+                  if fleet_result['error'] is not None or fleet_result['results']['stack_failures']])
+    return {'environments': environment_count, 'wall_seconds': wall_seconds,
+            'api_calls': backend.get_total_calls(), 'throttles': backend.throttle_count,
+            'call_counts': dict(backend.call_counts), 'peak_memory_mb': peak_bytes / 1048576.0,
+            'failed_environments': failed}
+
+
+def run_script(script_main, argv):
+    # Run a deploy script's main() with its output captured; returns whether
+    # it finished without exiting on an error or reporting a failed stack
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            script_main(argv)
+        except SystemExit as e:
+            if e.code not in [None, 0]:
+                return False
+    return ' Failed: ' not in output.getvalue()
+
+
+def run_script_benchmark(latency, stack_duration, throttle_rate, failure_rate, seed=None):
+    # Run deploy_defaults.py and deploy_base.py (bucket and key, then every
+    # default stack) end to end from run specs, as an unattended run would,
+    # against a fresh simulated backend. Returns wall time and API calls per
+    # script.
+    backend = start_backend(latency, stack_duration, throttle_rate, failure_rate, seed)
+    work_directory = tempfile.mkdtemp(prefix='faws-benchmark-')
+    cf_directory = os.path.join(work_directory, 'templates')
+    os.mkdir(cf_directory)
+    write_benchmark_templates(cf_directory)
+    journal_directory = os.path.join(work_directory, 'journals')
+    state_file = os.path.join(work_directory, 'state.db')
+    scripts = []
+    for ddi, script_name, script_main, script_arguments in [
+            ('899998', 'deploy_defaults.py', deploy_defaults.main,
+             ['--journal-directory', journal_directory, '--state-file', state_file]),
+            ('899999', 'deploy_base.py --action 1', deploy_base.main, ['--action', '1']),
+            ('899999', 'deploy_base.py --action 3', deploy_base.main, ['--action', '3', '--state-file', state_file])]:
+        spec_file = os.path.join(work_directory, ddi + '.json')
+        with open(spec_file, 'w') as f:
+            json.dump(get_benchmark_run_spec(cf_directory, ddi), f)
+        scripts.append((script_name, script_main, ['--spec', spec_file, '--non-interactive'] + script_arguments))
+
+    original_directory = os.getcwd()
+    # Key pair and parameters files are written to the working directory
+    os.chdir(work_directory)
+    script_results = []
+    try:
+        for script_name, script_main, argv in scripts:
+            call_count = backend.get_total_calls()
+            throttle_count = backend.throttle_count
+            start_time = time.time()
+            succeeded = run_script(script_main, argv)
+            script_results.append({'script': script_name, 'wall_seconds': time.time() - start_time,
+                                   'api_calls': backend.get_total_calls() - call_count,
+                                   'throttles': backend.throttle_count - throttle_count, 'succeeded': succeeded})
+    finally:
+        os.chdir(original_directory)
+        close_state_store(state_file)
+        shutil.rmtree(work_directory)
+        aws_clients.set_client_factory(None)
+    return script_results
+
+
+def print_benchmark_results(benchmark_results):
+    rows = [['Environments', 'Seconds', 'API Calls', 'Calls/Env', 'Throttles', 'Peak MB', 'Failed']]
+    for result in benchmark_results:
+        rows.append([str(result['environments']), '%.2f' % result['wall_seconds'], str(result['api_calls']),
+                     '%.1f' % (result['api_calls'] / float(result['environments'])), str(result['throttles']),
+                     '%.1f' % result['peak_memory_mb'], str(result['failed_environments'])])
+    widths = [max([len(row[column]) for row in rows]) for column in range(len(rows[0]))]
+    print('\nBenchmark Results: ')
+    for row in rows:
+        print('  '.join([row[column].rjust(widths[column]) for column in range(len(row))]))
+
+    print('\nAPI Calls (' + str(benchmark_results[-1]['environments']) + ' environments): ')
+    call_counts = benchmark_results[-1]['call_counts']
+    for operation in sorted(call_counts, key=lambda operation: -call_counts[operation]):
+        print(' ' + operation + ': ' + str(call_counts[operation]))
+
+
+def print_script_results(script_results):
+    rows = [['Script', 'Seconds', 'API Calls', 'Throttles', 'Succeeded']]
+    for result in script_results:
+        rows.append([result['script'], '%.2f' % result['wall_seconds'], str(result['api_calls']),
+                     str(result['throttles']), str(result['succeeded'])])
+    widths = [max([len(row[column]) for row in rows]) for column in range(len(rows[0]))]
+    print('\nScript Results: ')
+    for row in rows:
+        print('  '.join([row[0].ljust(widths[0])] +
+                        [row[column].rjust(widths[column]) for column in range(1, len(row))]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the deploy pipeline against a simulated AWS backend.')
+    parser.add_argument('--environments', type=int, nargs='+', default=[1, 10, 100],
+                        help='Environment counts to run (1 10 100)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per API call (0.02)')
+    parser.add_argument('--stack-duration', type=float, default=1.0, help='Seconds to build a stack (1.0)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of calls throttled (0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of stacks that fail (0)')
+    parser.add_argument('--workers', type=int, default=10, help='Environments deployed at once (10)')
+    parser.add_argument('--poll-delay', type=float, default=0.2, help='First stack poll interval (0.2)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for repeatable runs')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    # The simulated stacks finish in about a second, so poll accordingly and
+    # never write a run report for benchmark runs
+    stack_waiter.POLL_INITIAL_DELAY = args.poll_delay
+    stack_waiter.POLL_MAX_DELAY = max(args.poll_delay, args.stack_duration)
+    os.environ.pop(TRACE_REPORT_VARIABLE, None)
+
+    benchmark_results = []
+    for environment_count in args.environments:
+        print('Running ' + str(environment_count) + ' environment(s)...')
+        benchmark_results.append(run_benchmark(environment_count, args.latency, args.stack_duration,
+                                               args.throttle_rate, args.failure_rate, args.workers, args.seed))
+    print_benchmark_results(benchmark_results)
+
+    # The deploy scripts' own entry points, run unattended from run specs
+    print('\nRunning the deploy scripts...')
+    script_results = run_script_benchmark(args.latency, args.stack_duration, args.throttle_rate, args.failure_rate,
+                                          args.seed)
+    print_script_results(script_results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environments': benchmark_results, 'scripts': script_results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
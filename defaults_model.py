@@ -0,0 +1,215 @@
+import json
+import os
+import re
+import threading
+
+
+DEFAULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'defaults')
+
+# A 'Section:Name' reference to a setting or an upstream stack output
+REFERENCE_PATTERN = re.compile(r'^([A-Za-z0-9]+):([A-Za-z0-9]+)$')
+# A trailing '(if ...)' condition on an entry
+CONDITION_PATTERN = re.compile(r'\s*\((if [^)]*)\)\s*$')
+
+# The script default of entries whose defaults file value is a list of
+# choices or an example for operators: (section key, name) -> default
+DEFAULT_VALUES = {
+    ('VPCParameters', 'Region'): 'us-east-1',
+    ('BaseNetwork', 'AvailabilityZoneCount'): '2',
+    ('SNSTopicSubscriptions', 'DisplayName'): '',
+    ('SNSTopicSubscriptions', 'SubscriptionEndpoint1'): '',
+    ('SNSTopicSubscriptions', 'SubscriptionProtocol1'): 'email',
+    ('SNSTopicSubscriptions', 'SubscriptionEndpoint2'): '',
+    ('SNSTopicSubscriptions', 'SubscriptionProtocol2'): 'email',
+    ('SNSTopicSubscriptions', 'SubscriptionEndpoint3'): '',
+    ('SNSTopicSubscriptions', 'SubscriptionProtocol3'): 'email'
+}
+
+defaults_model_lock = threading.Lock()
+# defaults file -> (modification time, DefaultsModel)
+defaults_models = {}
+
+
+def get_stack_key(name):
+    # Normalize a defaults section or stack name ('Base Network',
+    # 'S3-VPC-Endpoint') to the key used in references ('BaseNetwork')
+    return name.replace(' ', '').replace('-', '')
+
+
+class DefaultsParameter(object):
+    # One 'Name = value' entry. default is a string or None, allowed_values
+    # the strings a [list] value allows, and references the (section key,
+    # name) pairs a 'Section:Name' value points to.
+    __slots__ = ('name', 'default', 'allowed_values', 'references', 'condition')
+
+    def __init__(self, name, default=None, allowed_values=None, references=None, condition=None):
+        self.name = name
+        self.default = default
+        self.allowed_values = allowed_values
+        self.references = references or []
+        self.condition = condition
+
+
+class DefaultsExport(object):
+    # An output the stack exports; with a condition only when it holds
+    __slots__ = ('name', 'condition')
+
+    def __init__(self, name, condition=None):
+        self.name = name
+        self.condition = condition
+
+
+class DefaultsSection(object):
+    # A top-level section. Entries directly under it are settings; a section
+    # with a Parameters block is a stack, with its parameters and exports.
+    __slots__ = ('name', 'key', 'settings', 'parameters', 'exports', 'stack')
+
+    def __init__(self, name):
+        self.name = name
+        self.key = get_stack_key(name)
+        self.settings = []
+        self.parameters = []
+        self.exports = []
+        self.stack = False
+
+    def get_parameter(self, name):
+        # A setting or stack parameter by name, None if there is none
+        for parameter in self.settings + self.parameters:
+            if parameter.name == name:
+                return parameter
+        return None
+
+    def get_export(self, name):
+        for export in self.exports:
+            if export.name == name:
+                return export
+        return None
+
+
+class DefaultsModel(object):
+    # Every section of the defaults file, in file order
+
+    __slots__ = ('sections', 'section_keys')
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.section_keys = dict([(section.key, section) for section in sections])
+
+    def get_section(self, name):
+        # By name or key; 'VPC' also finds 'VPC Parameters', as references
+        # write it
+        key = get_stack_key(name)
+        return self.section_keys.get(key) or self.section_keys.get(key + 'Parameters')
+
+    def get_parameter(self, section_name, name):
+        section = self.get_section(section_name)
+        if section is None:
+            return None
+        return section.get_parameter(name)
+
+    def get_stacks(self):
+        return [section for section in self.sections if section.stack]
+
+    def get_stack_dependencies(self):
+        # {stack key: set(upstream stack keys)} from the references between
+        # stacks; references to settings sections (VPC:Environment) are not
+        # dependencies
+        stack_dependencies = {}
+        for section in self.get_stacks():
+            stack_dependencies[section.key] = set()
+            for parameter in section.parameters:
+                for reference_key, reference_name in parameter.references:
+                    reference_section = self.get_section(reference_key)
+                    if reference_section is not None and reference_section.stack and \
+                            reference_section.key != section.key:
+                        stack_dependencies[section.key].add(reference_section.key)
+        return stack_dependencies
+
+
+def parse_condition(condition):
+    # (name, value) of an 'if Name = value' condition, None for any other
+    # ('if applicable')
+    match = re.match(r'^if\s+([A-Za-z0-9]+)\s*=\s*(.+)$', condition or '')
+    if match is None:
+        return None
+    return match.group(1), match.group(2).strip().strip('"')
+
+
+def parse_defaults_value(name, value, condition=None):
+    # '"text"' and bare text are defaults, '[a, b]' allowed values and
+    # 'Section:Name, ...' references
+    value = value.strip()
+    if value == '':
+        return DefaultsParameter(name, condition=condition)
+    if value.startswith('"') and value.endswith('"') and len(value) > 1:
+        return DefaultsParameter(name, value[1:-1], condition=condition)
+    if value.startswith('[') and value.endswith(']'):
+        try:
+            allowed_values = [str(allowed) for allowed in json.loads(value)]
+        except ValueError:
+            raise ValueError('"' + value + '" is not a list of values')
+        return DefaultsParameter(name, allowed_values=allowed_values, condition=condition)
+    references = []
+    for element in value.split(','):
+        match = REFERENCE_PATTERN.match(element.strip())
+        if match is None:
+            return DefaultsParameter(name, value, condition=condition)
+        references.append((match.group(1), match.group(2)))
+    return DefaultsParameter(name, references=references, condition=condition)
+
+
+def parse_defaults(defaults_body):
+    # Parse the defaults file format into a DefaultsModel. Raises ValueError
+    # naming the line of anything it cannot read.
+    sections = []
+    section = None
+    block = None
+    for line_number, line in enumerate(defaults_body.splitlines(), 1):
+        stripped = line.strip()
+        if stripped == '':
+            continue
+        try:
+            if not line[0].isspace():
+                if not stripped.endswith(':'):
+                    raise ValueError('expected a section name ending with ":"')
+                section = DefaultsSection(stripped[:-1])
+                sections.append(section)
+                block = None
+                continue
+            if section is None:
+                raise ValueError('entry outside of a section')
+            if stripped in ['Parameters:', 'Exports:', 'Export:']:
+                block = stripped[:-1].rstrip('s')
+                if block == 'Parameter':
+                    section.stack = True
+                continue
+            condition = None
+            match = CONDITION_PATTERN.search(stripped)
+            if match is not None:
+                condition = match.group(1)
+                stripped = stripped[:match.start()]
+            if block == 'Export':
+                section.exports.append(DefaultsExport(stripped, condition))
+                continue
+            if '=' not in stripped:
+                raise ValueError('expected "Name = value"')
+            name, value = stripped.split('=', 1)
+            parameter = parse_defaults_value(name.strip().rstrip(':').strip(), value, condition)
+            parameter.default = DEFAULT_VALUES.get((section.key, parameter.name), parameter.default)
+            if block == 'Parameter':
+                section.parameters.append(parameter)
+            else:
+                section.settings.append(parameter)
+        except ValueError as e:
+            raise ValueError('defaults line ' + str(line_number) + ': ' + str(e))
+    return DefaultsModel(sections)
+
+
+def get_defaults_model(defaults_file=DEFAULTS_FILE):
+    # The parsed defaults file, parsed again only when the file changes
+    modified_time = os.path.getmtime(defaults_file)
+    with defaults_model_lock:
+        if defaults_models.get(defaults_file, (None, None))[0] != modified_time:
+            with open(defaults_file) as f:
+                defaults_models[defaults_file] = (modified_time, parse_defaults(f.read()))
+        return defaults_models[defaults_file][1]
@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+
+# asyncio deploy engine (Python 3.7+). Every environment is a coroutine
+# instead of a thread; the blocking boto3 calls are offloaded to one shared
+# thread pool, and a semaphore caps how many are in flight at once, so one
+# process can drive hundreds of environments while stack waits cost nothing
+# but a shared poll per region.
+
+import sys
+import argparse
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from deploy_fleet import read_manifest, get_fleet_settings, print_fleet_summary
+from deploy_pipeline import EnvironmentPipeline
+from instrumentation import start_run_trace_from_environment, write_run_report
+from run_journal import JOURNAL_DIRECTORY, RunJournal, get_journal_file
+from stack_graph import get_stack_order
+from stack_poller import StackPoller, POLL_MAX_ATTEMPTS
+from stack_waiter import STACK_SUCCESS_STATUSES, get_backoff_delays, get_stack_terminal
+from state_store import STATE_STORE_FILE, get_state_store
+
+
+class AsyncAWS(object):
+    # Runs blocking AWS calls on a shared thread pool, at most max_concurrency
+    # at a time
+
+    def __init__(self, max_concurrency=50):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(self, function, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(function, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncStackPoller(StackPoller):
+    # StackPoller for coroutines: one task per account and region makes a
+    # single describe_stacks pass per tick (offloaded to the shared thread
+    # pool) for every stack being waited on, with StackPoller's retries,
+    # timeout and missing stack handling
+
+    def __init__(self, aws, cf, initial_delay=None, max_delay=None, max_attempts=POLL_MAX_ATTEMPTS):
+        StackPoller.__init__(self, cf, initial_delay=initial_delay, max_delay=max_delay, max_attempts=max_attempts)
+        self.aws = aws
+        # Set after every poll, then replaced
+        self.polled = asyncio.Event()
+
+    def start(self):
+        self.thread = asyncio.ensure_future(self.run())
+
+    def set_polled(self):
+        polled = self.polled
+        self.polled = asyncio.Event()
+        polled.set()
+
+    async def run(self):
+        delays = get_backoff_delays(self.initial_delay, self.max_delay)
+        attempts = 0
+        while True:
+            with self.condition:
+                if not self.watched:
+                    self.thread = None
+                    return
+            listed_stacks = {}
+            sequence = self.start_poll()
+            try:
+                if await self.aws.call(self.poll, listed_stacks, sequence):
+                    delays = get_backoff_delays(self.initial_delay, self.max_delay)
+                attempts = 0
+            except Exception as e:
+                attempts += 1
+                retry_delay = self.get_poll_retry_delay(e, attempts)
+                if retry_delay is not None:
+                    await asyncio.sleep(retry_delay)
+                    continue
+                attempts = 0
+                self.fail_waiters(e, listed_stacks, sequence)
+            self.set_polled()
+            await asyncio.sleep(next(delays))
+
+    async def wait(self, stack_name, success_statuses=None, timeout=None, missing_status=None):
+        # StackPoller.wait as a coroutine
+        if success_statuses is None:
+            success_statuses = STACK_SUCCESS_STATUSES
+
+        start_time = time.time()
+        waiter = self.watch(stack_name, missing_status)
+        timed_out = False
+        try:
+            while True:
+                with self.condition:
+                    if waiter['error'] is not None:
+                        raise waiter['error']
+                    stack = self.stacks.get(stack_name)
+                    if stack is not None and get_stack_terminal(stack['StackStatus']):
+                        stack_status = stack['StackStatus']
+                        break
+                    if timeout is not None and time.time() - start_time > timeout:
+                        timed_out = True
+                        stack_status = stack['StackStatus'] if stack is not None else 'UNKNOWN'
+                        break
+                try:
+                    await asyncio.wait_for(self.polled.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.unwatch(stack_name, waiter)
+        return await self.aws.call(self.get_wait_result, stack_name, stack_status, success_statuses, timed_out,
+                                   missing_status)
+
+
+def get_async_stack_poller(aws, cf, stack_pollers=None):
+    # The poller shared by every environment using cf (get_client hands out
+    # one client per account and region), from stack_pollers when given
+    if stack_pollers is None:
+        return AsyncStackPoller(aws, cf)
+    if cf not in stack_pollers:
+        stack_pollers[cf] = AsyncStackPoller(aws, cf)
+    return stack_pollers[cf]
+
+
+async def deploy_stack_graph_async(stack_deploy_dict, stack_dependencies):
+    # deploy_stack_graph for coroutines: stack_deploy_dict maps stack key ->
+    # coroutine function(stack_results). Returns (stack_results,
+    # stack_failures); stacks downstream of a failure are skipped.
+    stack_keys = list(stack_deploy_dict)
+    # Validates the graph before anything is submitted
+    get_stack_order(stack_keys, stack_dependencies)
+
+    stack_results = {}
+    stack_failures = {}
+    tasks = {}
+
+    async def deploy_stack(key):
+        upstream_keys = set(stack_dependencies.get(key, set())) & set(stack_keys)
+        if upstream_keys:
+            await asyncio.wait([tasks[upstream] for upstream in upstream_keys])
+        failed = upstream_keys & set(stack_failures)
+        if failed:
+            stack_failures[key] = 'Skipped, depends on failed stack ' + ', '.join(sorted(failed))
+            return
+        try:
+            stack_results[key] = await stack_deploy_dict[key](dict(stack_results))
+        except Exception as e:
+            stack_failures[key] = str(e)
+
+    for key in stack_keys:
+        tasks[key] = asyncio.ensure_future(deploy_stack(key))
+    await asyncio.gather(*tasks.values())
+    return stack_results, stack_failures
+
+
+async def deploy_environment_async(aws, settings, journal=None, stack_pollers=None, state_store=None):
+    # deploy_pipeline.deploy_environment as a coroutine: the same
+    # EnvironmentPipeline steps, offloaded to the shared thread pool, with
+    # stacks waited on through the account and region's shared poller.
+    # Returns the same dict.
+    pipeline = EnvironmentPipeline(settings, journal, state_store=state_store)
+    dry_run_results = await aws.call(pipeline.start)
+    if dry_run_results is not None:
+        return dry_run_results
+    await aws.call(pipeline.upload_templates)
+    stack_poller = get_async_stack_poller(aws, pipeline.cf, stack_pollers)
+
+    def get_deploy_function(key):
+        async def deploy_stack(stack_results):
+            stack_result, prepared_stack = await aws.call(pipeline.start_stack, key, stack_results)
+            if prepared_stack is None:
+                return stack_result
+            stack_name = prepared_stack['StackName']
+            try:
+                stack_wait_result = await stack_poller.wait(stack_name, **pipeline.get_stack_wait(prepared_stack))
+            finally:
+                await aws.call(pipeline.unfollow_stack, prepared_stack)
+            return await aws.call(pipeline.finish_stack, key, prepared_stack, stack_wait_result,
+                                  stack_poller.get_stack(stack_name))
+        return deploy_stack
+
+    stack_results, stack_failures = await deploy_stack_graph_async(
+        dict([(key, get_deploy_function(key)) for key in pipeline.stack_keys]), pipeline.stack_dependencies)
+    return await aws.call(pipeline.finish, stack_results, stack_failures)
+
+
+async def deploy_fleet_async(manifest, cf_directory, max_concurrency=50, per_account=1, per_region=5,
+                             incremental=False, use_imports=False, events_file=None, resume=False,
+                             journal_directory=None, state_file=None):
+    # deploy_fleet.deploy_fleet on one event loop: every entry runs as a
+    # coroutine, holding a per-account and a per-region slot, and is
+    # journaled (picking up from its journal with resume). Entries in the
+    # same account and region share one stack poller. Returns the same
+    # results.
+    aws = AsyncAWS(max_concurrency)
+    state_store = get_state_store(state_file)
+    stack_pollers = {}
+    account_slots = {}
+    region_slots = {}
+    for entry in manifest:
+        account_slots.setdefault(entry['ddi'], asyncio.Semaphore(per_account))
+        region_slots.setdefault(entry['region'], asyncio.Semaphore(per_region))
+
+    async def deploy_entry(entry):
+        async with account_slots[entry['ddi']]:
+            async with region_slots[entry['region']]:
+                start_time = time.time()
+                try:
+                    settings = get_fleet_settings(entry, cf_directory, incremental, use_imports, events_file)
+                    environment_results = await deploy_environment_async(
+                        aws, settings, RunJournal(get_journal_file(settings, journal_directory), resume),
+                        stack_pollers, state_store)
+                    error = None
+                except Exception as e:
+                    environment_results = None
+                    error = str(e)
+                return {'entry': entry, 'results': environment_results, 'error': error,
+                        'duration': time.time() - start_time}
+
+    try:
+        return await asyncio.gather(*[deploy_entry(entry) for entry in manifest])
+    finally:
+        aws.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Deploy the default stacks into every account in a manifest '
+                                                 'from one asyncio event loop.')
+    parser.add_argument('manifest', help='CSV or JSON manifest of ddi, account_name, region, profile')
+    parser.add_argument('--cf-directory', required=True, help='CloudFormation template directory path')
+    parser.add_argument('--concurrency', type=int, default=50, help='AWS calls in flight at once (50)')
+    parser.add_argument('--per-account', type=int, default=1, help='Environments per account at once (1)')
+    parser.add_argument('--per-region', type=int, default=5, help='Environments per region at once (5)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update existing stacks through change sets, skipping unchanged stacks')
+    parser.add_argument('--use-imports', action='store_true',
+                        help='Upload templates that import upstream stack outputs with Fn::ImportValue')
+    parser.add_argument('--events-json', help='Append every stack event to this file as JSON lines')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted rollout, skipping the completed steps of every entry')
+    parser.add_argument('--journal-directory',
+                        help='Directory of the run journals (' + JOURNAL_DIRECTORY + ')')
+    parser.add_argument('--state-file', help='State database (' + STATE_STORE_FILE + ')')
+    args = parser.parse_args(argv)
+
+    # Record API call timings when FAWS_TRACE_REPORT is set
+    trace_report_file = start_run_trace_from_environment()
+    manifest = read_manifest(args.manifest)
+    events_file = None
+    if args.events_json:
+        events_file = open(args.events_json, 'a')
+    try:
+        fleet_results = asyncio.run(deploy_fleet_async(manifest, args.cf_directory, args.concurrency,
+                                                       args.per_account, args.per_region, args.incremental,
+                                                       args.use_imports, events_file, args.resume,
+                                                       args.journal_directory, args.state_file))
+    finally:
+        if events_file is not None:
+            events_file.close()
+    print_fleet_summary(fleet_results)
+    write_run_report(trace_report_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
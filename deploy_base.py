@@ -1,133 +1,20 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
 import sys
 import os
-import boto3
-import time
-
-
-def set_credentials(region=''):
-    # Get environment variables and set as variables to create auth client
-    # request
-    aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
-    aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    aws_session_token = os.environ.get('AWS_SESSION_TOKEN')
-    region_name = os.environ.get('AWS_DEFAULT_REGION')
-
-    if region_name is None:
-        region_name = region
-
-    # If any of the Access Credentials were not provided, set them on the
-    # command line
-    if aws_access_key_id is None or aws_secret_access_key is None or aws_session_token is None:
-        print('\nAWS Credentials: ')
-    if aws_access_key_id is None:
-        aws_access_key_id = raw_input('AWS_ACCESS_KEY_ID: ')
-    if aws_secret_access_key is None:
-        aws_secret_access_key = raw_input('AWS_SECRET_ACCESS_KEY: ')
-    if aws_session_token is None:
-        aws_session_token = raw_input('AWS_SESSION_TOKEN: ')
-
-    credentials = {'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key,
-                   'aws_session_token': aws_session_token, 'region_name': region_name}
-
-    return credentials
-
-
-def set_s3_client(credentials):
-    # Create S3 client
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=credentials['aws_access_key_id'],
-        aws_secret_access_key=credentials['aws_secret_access_key'],
-        aws_session_token=credentials['aws_session_token'],
-        region_name=credentials['region_name']
-    )
-    return s3
-
-
-def set_cf_client(credentials):
-    # Create CloudFormation client
-    cf = boto3.client(
-        'cloudformation',
-        aws_access_key_id=credentials['aws_access_key_id'],
-        aws_secret_access_key=credentials['aws_secret_access_key'],
-        aws_session_token=credentials['aws_session_token'],
-        region_name=credentials['region_name']
-    )
-    return cf
-
-
-def set_ec2_client(credentials):
-    # Create EC2 client
-    ec2 = boto3.client(
-        'ec2',
-        aws_access_key_id=credentials['aws_access_key_id'],
-        aws_secret_access_key=credentials['aws_secret_access_key'],
-        aws_session_token=credentials['aws_session_token'],
-        region_name=credentials['region_name']
-    )
-    return ec2
-
-
-def set_s3_bucket_name(ddi, raw_account_name):
-    # Convert raw_account_name to s3-formatted bucket name
-    account_name = raw_account_name.replace(' ', '-').lower()
-    s3_bucket_name = ddi + '-' + account_name + '-cf-templates'
-    return s3_bucket_name
-
-
-def set_ec2_key_name(raw_account_name, environment, region):
-    # Convert raw_account_name to ec2 key name
-    account_name = raw_account_name.replace(' ', '-').lower()
-    environment = environment.lower()
-    ec2_key_name = region + '-' + environment + '-' + account_name
-    return ec2_key_name
-
-
-def set_sns_topic_name(raw_sns_topic_name):
-    sns_topic_name = raw_sns_topic_name.replace(' ', '-').lower()
-    return sns_topic_name
-
-
-def create_s3_bucket(s3, s3_bucket_name, region):
-    buckets = s3.list_buckets()['Buckets']
-    bucket_exists = False
-    for element in buckets:
-        if s3_bucket_name in element['Name']:
-            bucket_exists = True
-    if bucket_exists is False:
-        s3.create_bucket(Bucket=s3_bucket_name, ACL='private',
-                         CreateBucketConfiguration={'LocationConstraint': region})
-        s3.put_bucket_versioning(Bucket=s3_bucket_name, VersioningConfiguration={'Status': 'Enabled'})
-        s3.put_bucket_lifecycle(
-            Bucket=s3_bucket_name,
-            LifecycleConfiguration={
-                'Rules': [
-                    {
-                        'ID': 'DeletePreviousVersions',
-                        'Prefix': '',
-                        'Status': 'Enabled',
-                        'NoncurrentVersionExpiration': {
-                            'NoncurrentDays': 365
-                        }
-                    }
-                ]
-            }
-        )
-
-
-def upload_s3_object(s3, s3_bucket_name, environment, cf_directory, cf_templates_list):
-    for i, cf_file in enumerate(cf_templates_list):
-        s3.upload_file(cf_directory + '/' + cf_file,
-                       s3_bucket_name, environment.lower() + '/' + cf_file)
-
-
-def get_bucket_url(s3_bucket_name, environment):
-    bucket_url = 'https://s3.amazonaws.com/' + \
-        s3_bucket_name + '/' + environment.lower()
-
-    return bucket_url
+import argparse
+from deploy_settings import set_credentials, set_s3_client, set_cf_client, set_ec2_client, set_s3_bucket_name, \
+    set_ec2_key_name, get_bucket_url
+from instrumentation import trace_phase, start_run_trace, start_run_trace_from_environment, write_run_report, \
+    TRACE_REPORT_VARIABLE
+from run_spec import add_run_spec_arguments, get_run_settings, prompt_setting, get_spec_defaults, get_setting_prompt
+from parameter_files import PARAMETER_FILE_FORMATS, get_parameter_settings, create_parameters_files, \
+    print_parameters_files
+from deploy_pipeline import EnvironmentPipeline, create_s3_bucket, upload_s3_object, create_ec2_key_pair, \
+    write_key_file, print_stack_resources, deploy_stacks
+from stack_registry import STACK_REGISTRY, STACK_REGISTRY_KEYS
+from preflight import run_preflight, print_preflight_results
+from state_store import STATE_STORE_FILE, get_state_store
 
 
 def get_cf_template_url(bucket_url, cf_object):
@@ -136,59 +23,6 @@ def get_cf_template_url(bucket_url, cf_object):
     return cf_template_url
 
 
-def get_cf_stack_outputs(cf, stack_name):
-    stack_description = cf.describe_stacks(StackName=stack_name)
-    stack_outputs_list = stack_description['Stacks'][0]['Outputs']
-
-    stack_outputs = {}
-    position = 0
-    for element in stack_outputs_list:
-        key = stack_outputs_list[position]['OutputKey']
-        value = stack_outputs_list[position]['OutputValue']
-        stack_outputs.update({key: value})
-        position += 1
-
-    return stack_outputs
-
-
-def get_stack_resources(cf, stack_name):
-    stack_resource_list = cf.list_stack_resources(StackName=stack_name)
-    stack_summaries = stack_resource_list['StackResourceSummaries']
-
-    stack_resources = {}
-    position = 0
-    for element in stack_summaries:
-        key = element['LogicalResourceId']
-        value = element['PhysicalResourceId']
-        stack_resources.update({key: value})
-        position += 1
-
-    return stack_resources
-
-
-def get_stack_complete(cf, stack_name):
-    # Loop until stack is done building, then return True
-    stack_status = ''
-    while stack_status != 'CREATE_COMPLETE':
-        stack_description = cf.describe_stacks(StackName=stack_name)
-        stack_status = stack_description['Stacks'][0]['StackStatus']
-        if stack_status != 'CREATE_COMPLETE':
-            time.sleep(20)
-    return True
-
-
-def get_stack_deployed(cf, stack_name):
-    # Determine if stack is deployed, return value
-    try:
-        cf.describe_stacks(StackName=stack_name)
-    except:
-        stack_deployed = False
-    else:
-        stack_deployed = True
-
-    return stack_deployed
-
-
 def get_cf_directory_templates(cf_directory):
     cf_templates_list = []
     for f in os.listdir(cf_directory):
@@ -210,7 +44,7 @@ def get_template_defaults(cf, **kwargs):
     elif template_url is not None:
         template = cf.get_template_summary(TemplateURL=template_url)
     elif template_body is not None:
-        template = cf.get_template_summary(TemplateBodyL=template_body)
+        template = cf.get_template_summary(TemplateBody=template_body)
     else:
         template = None
 
@@ -224,7 +58,7 @@ def get_template_defaults(cf, **kwargs):
             key = element['ParameterKey']
             try:
                 value = element['DefaultValue']
-            except:
+            except KeyError:
                 value = None
             template_defaults.update({key: value})
             position += 1
@@ -234,163 +68,168 @@ def get_template_defaults(cf, **kwargs):
         return None
 
 
-def create_parameters_dict(cf, cf_templates_list, bucket_url):
-    cf_template_url_list = []
-    for element in cf_templates_list:
-        template_url = get_cf_template_url(bucket_url, element)
-        cf_template_url_list.append(template_url)
-
-    cf_parameters_list = []
-    for element in cf_template_url_list:
-        template_defaults = get_template_defaults(cf, template_url=element)
-        cf_parameters_list.append(template_defaults)
-
-    position = 0
-    cf_default_parameters_dict = {}
-    for template in cf_templates_list:
-        # Remove .template extension
-        cf_template_name = template.split('.template')[0]
-        cf_default_parameters_dict[cf_template_name] = cf_parameters_list[position]
-        position += 1
-
-    return cf_default_parameters_dict
-
-
-def print_stack_resources(stack_name, stack_resources_dict):
-    print('\n' + stack_name + ' Resources: ')
-    for key in stack_resources_dict:
-        print(' ' + key + ': ' + stack_resources_dict[key])
-
-
-def create_parameters_json(cf_default_parameters_dict):
-    parameters_json = []
-    new_dict = {}
-    for value in cf_default_parameters_dict:
-        new_dict['ParameterKey'] = value
-        new_dict['ParameterValue'] = cf_default_parameters_dict[value]
-        parameters_json.append(new_dict.copy())
-
-    return parameters_json
-
-
-def create_parameters_files(cf_default_parameters_dict):
-    for stack in cf_default_parameters_dict:
-        template = stack + '.template'
-        parameters_file_json = create_parameters_json(cf_default_parameters_dict[stack])
-        parameters_file_name = template + '.parameters'
-        write_file(parameters_file_name, parameters_file_json)
-
-        print('\nCreated ' + parameters_file_name)
-
-
-def deploy_cf_stack(cf, bucket_url, cf_stack_parameters_dict, parameters_json):
-    cf_template_url = get_cf_template_url(bucket_url, cf_stack_parameters_dict['cf_template'])
-
-    stack_name = cf_stack_parameters_dict['stack_prefix'] + '-' + cf_stack_parameters_dict['cf_stack_name']
-
-    if get_stack_deployed(cf, stack_name) is False:
-        cf.create_stack(
-            StackName=stack_name,
-            TemplateURL=cf_template_url,
-            Parameters=parameters_json,
-            TimeoutInMinutes=30,
-            Capabilities=[
-                'CAPABILITY_IAM',
-            ],
-            OnFailure='ROLLBACK'
-        )
-
-    return stack_name
-
-
-def create_ec2_key_pair(ec2, ec2_key_name):
-    try:
-        key_pair = ec2.create_key_pair(
-            KeyName=ec2_key_name
-        )
-        ec2_key = key_pair['KeyMaterial']
-    except:
-        ec2_key = None
-    return ec2_key
-
-
-def write_file(file_name, file_content):
-    output_file_name = file_name
-    # Opens output file, if file exists it will be overwritten
-    output_file = open(output_file_name, 'w+')
-    file_content = str(file_content)
-    output_file.write(file_content + '\n')
-    output_file.close()
-
-
 def main(argv):
-    print('NOTE: Please run "faws env" and set your environment variables before running this script.')
+    parser = argparse.ArgumentParser(description='Deploy the template bucket, key pair, parameters files '
+                                                 'or default stacks.')
+    add_run_spec_arguments(parser)
+    parser.add_argument('--templates', help='Comma-delimited template file names (every *.template file)')
+    parser.add_argument('--action', choices=['1', '2', '3', '4'], help='Action to run, as numbered in the menu')
+    parser.add_argument('--output-directory', default='.',
+                        help='Directory parameters files are written to (actions 1, 2; .)')
+    parser.add_argument('--format', action='append', choices=sorted(PARAMETER_FILE_FORMATS),
+                        help='Parameters file format (repeatable, actions 1, 2; json)')
+    parser.add_argument('--stack', help='Registry stack deployed by action 4 (' + ', '.join(STACK_REGISTRY_KEYS) + ')')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update existing stacks through change sets, skipping unchanged stacks (actions 3, 4)')
+    parser.add_argument('--tail-events', action='store_true',
+                        help='Print the events of every in-flight stack as they happen (actions 3, 4)')
+    parser.add_argument('--non-interactive', action='store_true',
+                        help='Never prompt; settings not given use their defaults')
+    parser.add_argument('--state-file',
+                        help='State database (actions 3, 4; ' + STATE_STORE_FILE + ')')
+    parser.add_argument('--trace-report', help='Write a run report to this file (overrides ' +
+                        TRACE_REPORT_VARIABLE + ')')
+    args = parser.parse_args(argv)
+    interactive = not args.non_interactive
+    try:
+        run_settings = get_run_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Defaults and prompts for the settings the defaults file gives
+    spec_defaults = get_spec_defaults()
+
+    def prompt(setting, default=None, prompt_text=None):
+        if default is None:
+            default = spec_defaults.get(setting, '')
+        if prompt_text is None:
+            prompt_text = ' ' + get_setting_prompt(setting, default)
+        try:
+            return prompt_setting(run_settings, setting, prompt_text, default, interactive=interactive)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if interactive:
+        print('NOTE: Please run "faws env" and set your environment variables before running this script.')
+    # Record phase and API call timings when --trace-report or
+    # FAWS_TRACE_REPORT is set
+    if args.trace_report:
+        start_run_trace()
+        trace_report_file = args.trace_report
+    else:
+        trace_report_file = start_run_trace_from_environment()
 
-    # Collect Parameters
-    print('Please enter parameters. Leave blank to use (default) values.')
+    # Collect Parameters; anything given by the run spec or flags is not
+    # asked for
+    if interactive:
+        print('Please enter parameters. Leave blank to use (default) values.')
 
     # Script Parameters
-    print('\nScript Parameters: ')
-    cf_directory = raw_input(' CloudFormation Template Directory Path: (my home)')
-    if cf_directory == '':
-        cf_directory = '/Users/matt6757/scripts/cftemplates'
+    if interactive:
+        print('\nScript Parameters: ')
+    cf_directory = prompt('cf_directory', '/Users/matt6757/scripts/cftemplates',
+                          ' CloudFormation Template Directory Path: (my home)')
 
     cf_templates_list = get_cf_directory_templates(cf_directory)
-    cf_templates_list_string = raw_input(
-        'The following templates were found:\n'
-        ' ' + str(cf_templates_list) +
-        '\nPlease hit <enter> if this list is correct, '
-        'otherwise enter a comma-delimited list of file names: ')
-    if cf_templates_list_string is not '':
+    if args.templates is not None:
+        cf_templates_list_string = args.templates
+    elif interactive:
+        cf_templates_list_string = input(
+            'The following templates were found:\n'
+            ' ' + str(cf_templates_list) +
+            '\nPlease hit <enter> if this list is correct, '
+            'otherwise enter a comma-delimited list of file names: ')
+    else:
+        cf_templates_list_string = ''
+    if cf_templates_list_string != '':
         cf_templates_list = cf_templates_list_string.replace(' ', '').split(',')
 
     # Account Parameters
-    print('\nAccount Parameters: ')
-    ddi = raw_input(' Rackspace Account Number: ')
-    raw_account_name = raw_input(' Rackspace Account Name: ')
+    if interactive:
+        print('\nAccount Parameters: ')
+    ddi = prompt('ddi')
+    raw_account_name = prompt('raw_account_name')
     s3_bucket_name = set_s3_bucket_name(ddi, raw_account_name)
 
     # VPC Parameters
-    print('\nVPC Parameters: ')
-    region = raw_input(' Region (us-east-1): ')
-    if region == '':
-        region = 'us-east-1'
-    environment = raw_input(' Environment (Production): ')
-    if environment == '':
-        environment = 'Production'
-    stack_prefix = raw_input(' Stack Prefix (prod): ')
-    if stack_prefix == '':
-        stack_prefix = 'prod'
+    if interactive:
+        print('\nVPC Parameters: ')
+    region = prompt('region')
+    environment = prompt('environment')
+    stack_prefix = prompt('stack_prefix')
 
     # Set AWS Credentials
-    credentials = set_credentials(region)
+    if run_settings.get('profile'):
+        credentials = {'profile_name': run_settings['profile'], 'region_name': region}
+    elif not interactive and None in [os.environ.get(variable) for variable in
+                                      ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']]:
+        parser.error('--profile or the AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_SESSION_TOKEN '
+                     'environment variables are required')
+    else:
+        credentials = set_credentials(region)
 
     # Initialize AWS Clients
     s3 = set_s3_client(credentials)
     cf = set_cf_client(credentials)
     ec2 = set_ec2_client(credentials)
+    bucket_url = get_bucket_url(s3_bucket_name, environment)
 
-    # Determine how the script is being used TODO integrate cmd line args / --help
-    script_action = raw_input('\nSelect an action:\n'
+    # Determine how the script is being used
+    if args.action is not None:
+        script_action = args.action
+    elif interactive:
+        script_action = input('\nSelect an action:\n'
                               ' 1. Deploy Bucket, Key, and Create Parameters Files\n'
                               ' 2. Create Parameters Files\n'
                               ' 3. Deploy Default Stacks\n'
                               ' 4. Deploy Single Stack\n')
-
-    if script_action is '1':
+    else:
+        parser.error('--action is required with --non-interactive')
+
+    def create_parameters(cf_directory, cf_templates_list):
+        # Template defaults (get_template_summary for templates that cannot be
+        # read locally) with the run spec / flag values over them
+        def get_remote_template_defaults(cf_template):
+            return get_template_defaults(cf, template_url=get_cf_template_url(bucket_url, cf_template))
+
+        parameter_settings = get_parameter_settings(dict(run_settings, cf_directory=cf_directory, ddi=ddi,
+                                                         raw_account_name=raw_account_name, region=region,
+                                                         environment=environment, stack_prefix=stack_prefix))
+        with trace_phase('create_parameters_files'):
+            try:
+                parameters_files = create_parameters_files(cf_directory, cf_templates_list, args.output_directory,
+                                                           parameter_settings, args.format or ['json'],
+                                                           get_remote_template_defaults)
+            except ValueError as e:
+                parser.error(str(e))
+        print_parameters_files(parameters_files)
+
+    def preflight(preflight_settings, stack_keys, ec2_key_name=None):
+        # Stop before anything is created if a pre-flight check fails
+        with trace_phase('preflight'):
+            preflight_results = run_preflight(preflight_settings, s3_bucket_name, ec2_key_name, stack_keys)
+        print_preflight_results(preflight_results)
+        if preflight_results['errors']:
+            sys.exit(1)
+
+    if script_action == '1':
+        preflight({'credentials': credentials, 'cf_directory': cf_directory, 'cf_templates_list': cf_templates_list},
+                  [], set_ec2_key_name(raw_account_name, environment, region))
         print('Deploying Bucket, Key, and Creating Parameters Files')
         # Create CloudFormation S3 Bucket & Upload CloudFormation templates
-        create_s3_bucket(s3, s3_bucket_name, region)
-        upload_s3_object(s3, s3_bucket_name, environment,
-                         cf_directory, cf_templates_list)
-        bucket_url = get_bucket_url(s3_bucket_name, environment)
+        with trace_phase('create_s3_bucket'):
+            create_s3_bucket(s3, s3_bucket_name, region)
+        with trace_phase('upload_s3_object'):
+            upload_s3_object(s3, s3_bucket_name, environment,
+                             cf_directory, cf_templates_list)
 
         # Create EC2 Key Pair, output to file
         ec2_key_name = set_ec2_key_name(raw_account_name, environment, region)
-        ec2_key = create_ec2_key_pair(ec2, ec2_key_name)
+        with trace_phase('create_ec2_key_pair'):
+            ec2_key = create_ec2_key_pair(ec2, ec2_key_name)
         if ec2_key is not None:
             ec2_key_file_name = ec2_key_name + '.pem'
-            write_file(ec2_key_file_name, ec2_key)
+            write_key_file(ec2_key_file_name, ec2_key)
 
         if ec2_key is not None:
             print('\nEC2 Key Pair: ')
@@ -401,86 +240,67 @@ def main(argv):
             print('\nEC2 Key "' + ec2_key_name + '" already exists.')
 
         # Create Parameters Files
-        cf_default_parameters_dict = create_parameters_dict(cf, cf_templates_list, bucket_url)
-        create_parameters_files(cf_default_parameters_dict)
+        create_parameters(cf_directory, cf_templates_list)
 
-    if script_action is '2':
+    if script_action == '2':
         print('Creating Parameters Files')
 
         # Create Parameters Files
-        cf_default_parameters_dict = create_parameters_dict(cf, cf_templates_list, bucket_url)
-        create_parameters_files(cf_default_parameters_dict)
-
-    if script_action is '3':
-        # Define Base Network parameters, Deploy Stack
-        base_network_cf_parameters_list = {'stack_prefix': stack_prefix, 'cf_stack_name': 'BaseNetwork',
-                                           'AvailabilityZoneCount': az_count, 'CIDRRange': cidr, 'Environment': environment}
-        base_network_stack_name = deploy_cf_stack(cf, bucket_url, cf_default_parameters_dict['base_network'])
-        # Verify stack build completed, store dictionary of stack resources
-        if get_stack_complete(cf, base_network_stack_name) is True:
-            base_network_stack_resources = get_stack_resources(
-                cf, base_network_stack_name)
-
-        vpcid = base_network_stack_resources['VPCBase']
-        route_table_public = base_network_stack_resources['RouteTablePublic']
-        route_table_private_az1 = base_network_stack_resources['RouteTablePrivateAZ1']
-        route_table_private_az2 = base_network_stack_resources['RouteTablePrivateAZ2']
-        if az_count == 3:
-            route_table_private_az3 = base_network_stack_resources['RouteTablePrivateAZ3']
-        else:
-            route_table_private_az3 = None
-
-        # Define S3 VPC Endpoint parameters, Deploy Stack
-        s3_vpc_endpoint_cf_parameters_list = {
-            'stack_prefix': stack_prefix, 'cf_stack_name': 'S3-VPC-Endpoint', 'VPCID': vpcid,
-            'route_table_public': route_table_public, 'route_table_private_az1': route_table_private_az1,
-            'route_table_private_az2': route_table_private_az2, 'route_table_private_az3': route_table_private_az3
-        }
-        s3_vpc_endpoint_stack_name = deploy_s3_vpc_endpoint_cf_stack(
-            cf, bucket_url, s3_vpc_endpoint_cf_parameters_list)
-
-        # Define Route53 Internal Zone parameters, Deploy Stack
-        route53_internalzone_cf_parameters_list = {
-            'stack_prefix': stack_prefix, 'cf_stack_name': 'Route53-InternalZone', 'VPCID': vpcid,
-            'Environment': environment, 'InternalZoneName': internal_zone_name
-        }
-        route53_internalzone_stack_name = deploy_route53_internalzone_cf_stack(
-            cf, bucket_url, route53_internalzone_cf_parameters_list)
-
-        # Define SNS Topic Subscription parameters, Deploy Stack
-        sns_topic_subscriptions_cf_parameters_list = {
-            'stack_prefix': stack_prefix, 'cf_stack_name': 'SNS-Topic-Subscriptions',
-            'SubscriptionEndpoint1': sns_endpoint_1, 'SubscriptionProtocol1': sns_protocol_1,
-            'SubscriptionEndpoint2': sns_endpoint_2, 'SubscriptionProtocol2': sns_protocol_2,
-            'SubscriptionEndpoint3': sns_endpoint_3, 'SubscriptionProtocol3': sns_protocol_3,
-            'DisplayName': raw_sns_topic_name
-        }
-        sns_topic_subscriptions_stack_name = deploy_sns_topic_subscriptions_cf_stack(
-            cf, bucket_url, sns_topic_subscriptions_cf_parameters_list)
-
-        # Verify stack build completed, store dictionary of stack resources -
-        # these are grouped because they can all deploy at the same time, but
-        # BaseNetwork needs to run first
-        if get_stack_complete(cf, s3_vpc_endpoint_stack_name) is True:
-            s3_vpc_endpoint_stack_resources = get_stack_resources(
-                cf, s3_vpc_endpoint_stack_name)
-        if get_stack_complete(cf, route53_internalzone_stack_name) is True:
-            route53_internalzone_stack_resources = get_stack_resources(
-                cf, route53_internalzone_stack_name)
-        if get_stack_complete(cf, sns_topic_subscriptions_stack_name) is True:
-            sns_topic_subscriptions_stack_resources = get_stack_resources(
-                cf, sns_topic_subscriptions_stack_name)
+        create_parameters(cf_directory, cf_templates_list)
+
+    if script_action in ['3', '4']:
+        # Deploy every default stack, or a single one whose upstream stacks
+        # resolve from the state store
+        stack_keys = None
+        if script_action == '4':
+            if args.stack is not None:
+                stack_key = args.stack
+            elif interactive:
+                stack_key = input(' Stack (' + ', '.join(STACK_REGISTRY_KEYS) + '): ')
+            else:
+                parser.error('--stack is required for action 4 with --non-interactive')
+            if stack_key not in STACK_REGISTRY_KEYS:
+                parser.error('Unknown stack ' + stack_key)
+            stack_keys = [stack_key]
+
+        # Stack Parameters
+        if interactive:
+            print('\nStack Parameters: ')
+        settings = {'cf_directory': cf_directory, 'ddi': ddi, 'region': region, 'stack_prefix': stack_prefix,
+                    'environment': environment, 'incremental': args.incremental,
+                    'az_count': prompt('az_count'),
+                    'cidr': prompt('cidr'),
+                    'internal_zone_name': prompt('internal_zone_name'),
+                    'raw_sns_topic_name': prompt('raw_sns_topic_name', raw_account_name),
+                    'sns_protocol_1': prompt('sns_protocol_1'),
+                    'sns_endpoint_1': prompt('sns_endpoint_1'),
+                    'sns_protocol_2': prompt('sns_protocol_2'),
+                    'sns_endpoint_2': prompt('sns_endpoint_2'),
+                    'sns_protocol_3': prompt('sns_protocol_3'),
+                    'sns_endpoint_3': prompt('sns_endpoint_3')}
+
+        if stack_keys is None:
+            stack_keys = list(STACK_REGISTRY_KEYS)
+        preflight(dict(settings, credentials=credentials, cf_templates_list=[
+            STACK_REGISTRY[key]['cf_template'] for key in stack_keys]), stack_keys)
+
+        # Deploy the stacks the way deploy_defaults.py does, into the bucket
+        # and templates action 1 put in place
+        pipeline = EnvironmentPipeline(dict(settings, credentials=credentials, raw_account_name=raw_account_name,
+                                            tail_events=args.tail_events), stack_keys=stack_keys,
+                                       state_store=get_state_store(args.state_file))
+        pipeline.start_stacks()
+        stack_results, stack_failures = deploy_stacks(pipeline)
 
         # Print Stack Outputs
         print('\nStack Outputs: ')
-        print_stack_resources(base_network_stack_name,
-                              base_network_stack_resources)
-        print_stack_resources(s3_vpc_endpoint_stack_name,
-                              s3_vpc_endpoint_stack_resources)
-        print_stack_resources(route53_internalzone_stack_name,
-                              route53_internalzone_stack_resources)
-        print_stack_resources(sns_topic_subscriptions_stack_name,
-                              sns_topic_subscriptions_stack_resources)
+        for key in STACK_REGISTRY_KEYS:
+            if key in stack_results:
+                print_stack_resources(stack_results[key][0], stack_results[key][1])
+        for key in sorted(stack_failures):
+            print('\n' + key + ' Failed: ' + stack_failures[key])
+
+    write_run_report(trace_report_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from deploy_pipeline import deploy_environment
+from deploy_settings import get_default_settings
+from instrumentation import trace_phase, start_run_trace_from_environment, write_run_report
+from run_journal import JOURNAL_DIRECTORY, RunJournal, get_journal_file
+from state_store import STATE_STORE_FILE, get_state_store
+
+
+# Manifest columns that map straight onto deploy settings; anything
+# not given falls back to the deploy_settings default value
+MANIFEST_SETTINGS = {
+    'ddi': 'ddi', 'account_name': 'raw_account_name', 'region': 'region', 'environment': 'environment',
+    'stack_prefix': 'stack_prefix', 'az_count': 'az_count', 'cidr': 'cidr',
+    'internal_zone_name': 'internal_zone_name', 'sns_topic_name': 'raw_sns_topic_name',
+    'sns_protocol_1': 'sns_protocol_1', 'sns_endpoint_1': 'sns_endpoint_1',
+    'sns_protocol_2': 'sns_protocol_2', 'sns_endpoint_2': 'sns_endpoint_2',
+    'sns_protocol_3': 'sns_protocol_3', 'sns_endpoint_3': 'sns_endpoint_3', 'cf_directory': 'cf_directory'
+}
+
+
+def read_manifest(manifest_file):
+    # Read a fleet manifest: a JSON list of objects, or a CSV file with a
+    # header row. Every entry needs ddi, account_name, region and profile.
+    with open(manifest_file) as f:
+        if manifest_file.endswith('.json'):
+            manifest = json.load(f)
+        else:
+            manifest = [row for row in csv.DictReader(f)]
+
+    for position, entry in enumerate(manifest):
+        for column in ['ddi', 'account_name', 'region', 'profile']:
+            if not entry.get(column):
+                raise ValueError('Manifest entry ' + str(position + 1) + ' is missing ' + column)
+    return manifest
+
+
+def get_fleet_settings(entry, cf_directory, incremental=False, use_imports=False, events_file=None):
+    # Build deploy settings for one manifest entry
+    settings = get_default_settings()
+    settings['cf_directory'] = cf_directory
+    settings['incremental'] = incremental
+    settings['use_imports'] = use_imports
+    settings['events_file'] = events_file
+    for column in MANIFEST_SETTINGS:
+        if entry.get(column):
+            settings[MANIFEST_SETTINGS[column]] = str(entry[column])
+    settings['credentials'] = {'profile_name': entry['profile'], 'region_name': settings['region']}
+    if settings['raw_sns_topic_name'] == '':
+        settings['raw_sns_topic_name'] = settings['raw_account_name']
+    return settings
+
+
+def deploy_fleet(manifest, cf_directory, max_workers=10, per_account=1, per_region=5, incremental=False,
+                 use_imports=False, events_file=None, resume=False, journal_directory=None, state_file=None):
+    # Deploy every manifest entry on a bounded worker pool. An entry also
+    # holds a per-account and a per-region slot while it runs, so one account
+    # or region is never hit by more than per_account / per_region runs.
+    # Every entry is journaled, in journal_directory if given; with resume,
+    # entries pick up from their journal, so finished ones make no AWS calls
+    # at all. Stacks are recorded in the state_file database if given.
+    state_store = get_state_store(state_file)
+    account_slots = {}
+    region_slots = {}
+    for entry in manifest:
+        account_slots.setdefault(entry['ddi'], threading.BoundedSemaphore(per_account))
+        region_slots.setdefault(entry['region'], threading.BoundedSemaphore(per_region))
+
+    def deploy_entry(entry):
+        with account_slots[entry['ddi']]:
+            with region_slots[entry['region']]:
+                start_time = time.time()
+                try:
+                    settings = get_fleet_settings(entry, cf_directory, incremental, use_imports, events_file)
+                    with trace_phase('environment ' + entry['ddi'] + ' ' + entry['region']):
+                        environment_results = deploy_environment(
+                            settings, RunJournal(get_journal_file(settings, journal_directory), resume), state_store)
+                    error = None
+                except Exception as e:
+                    environment_results = None
+                    error = str(e)
+                return {'entry': entry, 'results': environment_results, 'error': error,
+                        'duration': time.time() - start_time}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        fleet_results = list(executor.map(deploy_entry, manifest))
+    finally:
+        executor.shutdown(wait=True)
+
+    return fleet_results
+
+
+def print_fleet_summary(fleet_results):
+    # Print one row per manifest entry
+    rows = [['DDI', 'Account', 'Region', 'Status', 'Minutes', 'Stacks', 'Key Pair']]
+    for fleet_result in fleet_results:
+        entry = fleet_result['entry']
+        environment_results = fleet_result['results']
+        if fleet_result['error'] is not None:
+            status = 'ERROR: ' + fleet_result['error']
+            stacks = '-'
+            key_pair = '-'
+        else:
+            status = 'FAILED' if environment_results['stack_failures'] else 'OK'
+            stacks = str(len(environment_results['stack_results'])) + ' ok / ' + \
+                str(len(environment_results['stack_failures'])) + ' failed'
+            if environment_results['ec2_key_file_name'] is not None:
+                key_pair = environment_results['ec2_key_file_name']
+            else:
+                key_pair = 'exists'
+        rows.append([entry['ddi'], entry['account_name'], entry['region'], status,
+                     '%.1f' % (fleet_result['duration'] / 60.0), stacks, key_pair])
+
+    widths = [max([len(row[column]) for row in rows]) for column in range(len(rows[0]))]
+    print('\nFleet Summary: ')
+    for row in rows:
+        print('  '.join([row[column].ljust(widths[column]) for column in range(len(row))]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Deploy the default stacks into every account in a manifest.')
+    parser.add_argument('manifest', help='CSV or JSON manifest of ddi, account_name, region, profile')
+    parser.add_argument('--cf-directory', required=True, help='CloudFormation template directory path')
+    parser.add_argument('--workers', type=int, default=10, help='Environments deployed at once (10)')
+    parser.add_argument('--per-account', type=int, default=1, help='Environments per account at once (1)')
+    parser.add_argument('--per-region', type=int, default=5, help='Environments per region at once (5)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update existing stacks through change sets, skipping unchanged stacks')
+    parser.add_argument('--use-imports', action='store_true',
+                        help='Upload templates that import upstream stack outputs with Fn::ImportValue')
+    parser.add_argument('--events-json', help='Append every stack event to this file as JSON lines')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted rollout, skipping the completed steps of every entry')
+    parser.add_argument('--journal-directory',
+                        help='Directory of the run journals (' + JOURNAL_DIRECTORY + ')')
+    parser.add_argument('--state-file', help='State database (' + STATE_STORE_FILE + ')')
+    args = parser.parse_args(argv)
+
+    # Record phase and API call timings when FAWS_TRACE_REPORT is set
+    trace_report_file = start_run_trace_from_environment()
+    manifest = read_manifest(args.manifest)
+    events_file = None
+    if args.events_json:
+        events_file = open(args.events_json, 'a')
+    try:
+        fleet_results = deploy_fleet(manifest, args.cf_directory, args.workers, args.per_account, args.per_region,
+                                     args.incremental, args.use_imports, events_file, args.resume,
+                                     args.journal_directory, args.state_file)
+    finally:
+        if events_file is not None:
+            events_file.close()
+    print_fleet_summary(fleet_results)
+    write_run_report(trace_report_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
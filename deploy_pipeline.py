@@ -0,0 +1,348 @@
+import os
+import shutil
+import tempfile
+
+from botocore.exceptions import ClientError
+
+from deploy_settings import set_s3_client, set_cf_client, set_ec2_client, set_s3_bucket_name, set_ec2_key_name, \
+    get_bucket_url
+from exports_resolver import write_import_templates
+from instrumentation import trace_phase
+from preflight import run_preflight, print_preflight_results, format_preflight_errors
+from run_journal import run_step, get_journal_settings
+from s3_templates import setup_template_bucket, upload_templates
+from stack_events import StackEventTailer
+from stack_graph import deploy_stack_graph, get_stack_dependencies, get_template_stack_dependencies, \
+    merge_stack_dependencies, get_stack_order
+from stack_poller import StackPoller
+from stack_registry import STACK_REGISTRY_KEYS, get_registry_dependencies, get_registry_templates, \
+    get_registry_stack_names, get_import_templates, prepare_registry_stack, submit_stack, record_registry_stack
+from stack_waiter import STACK_SUCCESS_STATUSES, STACK_STABLE_STATUSES
+
+
+def create_s3_bucket(s3, s3_bucket_name, region, dry_run=False):
+    # Create the bucket with versioning and lifecycle, only changing what
+    # differs. With dry_run, print what would change without changing it.
+    bucket_changes = setup_template_bucket(s3, s3_bucket_name, region, dry_run)
+    if dry_run:
+        print('\nS3 Bucket "' + s3_bucket_name + '" changes: ')
+        for change in bucket_changes:
+            print(' ' + change)
+        if not bucket_changes:
+            print(' None')
+    return bucket_changes
+
+
+def upload_s3_object(s3, s3_bucket_name, environment, cf_directory, cf_templates_list):
+    # Upload templates in parallel, skipping any that are unchanged in S3 so
+    # re-runs do not create new object versions
+    return upload_templates(s3, s3_bucket_name, environment.lower(), cf_directory, cf_templates_list)
+
+
+def upload_import_s3_objects(s3, s3_bucket_name, environment, cf_directory, cf_templates_list, settings):
+    # Upload the templates with every parameter that comes from an upstream
+    # stack output rewritten into Fn::ImportValue, so the stacks resolve
+    # their inputs server side; the other templates are uploaded as they are
+    import_templates = get_import_templates(settings)
+    import_templates = dict([(cf_template, import_templates[cf_template]) for cf_template in import_templates
+                             if cf_template in cf_templates_list])
+    import_directory = tempfile.mkdtemp()
+    try:
+        write_import_templates(cf_directory, import_directory, import_templates)
+        upload_s3_object(s3, s3_bucket_name, environment, import_directory, sorted(import_templates))
+    finally:
+        shutil.rmtree(import_directory)
+    return upload_s3_object(s3, s3_bucket_name, environment, cf_directory,
+                            [cf_template for cf_template in cf_templates_list if cf_template not in import_templates])
+
+
+def print_stack_resources(stack_name, stack_resources_dict):
+    print('\n' + stack_name + ' Resources: ')
+    for key in stack_resources_dict:
+        print(' ' + key + ': ' + stack_resources_dict[key])
+
+
+def create_ec2_key_pair(ec2, ec2_key_name):
+    try:
+        key_pair = ec2.create_key_pair(
+            KeyName=ec2_key_name
+        )
+        ec2_key = key_pair['KeyMaterial']
+    except ClientError as e:
+        # An existing key pair is kept; anything else is an error
+        if e.response['Error']['Code'] != 'InvalidKeyPair.Duplicate':
+            raise
+        ec2_key = None
+    return ec2_key
+
+
+def write_key_file(file_name, file_content):
+    # Private keys are only readable by their owner and are on disk before
+    # this returns; an existing file is overwritten
+    file_descriptor = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(file_name, 0o600)
+    with os.fdopen(file_descriptor, 'w') as output_file:
+        output_file.write(file_content + '\n')
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+
+def create_ec2_key_file(ec2, ec2_key_name):
+    # Create the key pair and write its private key to <key name>.pem
+    # straight away, as AWS only returns it once. Returns (key, file name),
+    # both None if the key pair already exists.
+    ec2_key = create_ec2_key_pair(ec2, ec2_key_name)
+    if ec2_key is None:
+        return None, None
+    ec2_key_file_name = ec2_key_name + '.pem'
+    write_key_file(ec2_key_file_name, ec2_key)
+    return ec2_key, ec2_key_file_name
+
+
+def read_key_file(file_name):
+    # The key written by an earlier, interrupted run, None if it is gone
+    if file_name is None or not os.path.isfile(file_name):
+        return None
+    with open(file_name) as f:
+        return f.read().rstrip('\n')
+
+
+# Longest wait for one stack. CloudFormation times a create out after 30
+# minutes itself (TimeoutInMinutes); an update has no limit.
+STACK_WAIT_TIMEOUT = 60 * 60
+
+
+class EnvironmentPipeline(object):
+    # The steps of one environment run, in order: start (clients, journal,
+    # pre-flight checks and the stack graph), upload_templates (bucket and
+    # templates), start_stack / finish_stack for every stack in dependency
+    # order, and finish (key pair). deploy_environment and deploy_async drive
+    # the same steps and only differ in how they run the blocking calls and
+    # wait for stacks. Every completed step is recorded in journal (a
+    # RunJournal), when given, and steps it already has are skipped, so an
+    # interrupted run picks up where it stopped. Stacks are recorded in
+    # state_store, the shared one if None.
+
+    def __init__(self, settings, journal=None, stack_keys=None, state_store=None):
+        self.settings = settings
+        self.journal = journal
+        self.state_store = state_store
+        if settings.get('dry_run'):
+            self.journal = None
+        self.s3_bucket_name = set_s3_bucket_name(settings['ddi'], settings['raw_account_name'])
+        self.ec2_key_name = set_ec2_key_name(settings['raw_account_name'], settings['environment'],
+                                             settings['region'])
+        self.bucket_url = get_bucket_url(self.s3_bucket_name, settings['environment'])
+        self.stack_keys = list(stack_keys or STACK_REGISTRY_KEYS)
+        self.s3 = None
+        self.cf = None
+        self.ec2 = None
+        self.preflight_results = None
+        self.stack_dependencies = None
+        self.event_tailer = None
+
+    def start(self):
+        # Create the clients, check the settings against the journal, run the
+        # pre-flight checks and build the stack graph. Returns the results of
+        # a dry run, after printing them, else None. Raises RuntimeError if a
+        # check failed.
+        settings = self.settings
+        journal = self.journal
+        self.create_clients()
+
+        if journal is not None:
+            journal_settings = get_journal_settings(settings)
+            if not journal.has_step('settings'):
+                journal.record_step('settings', journal_settings)
+            elif journal.get_step('settings') != journal_settings:
+                raise RuntimeError('The settings differ from the run journaled in ' + journal.journal_file +
+                                   '; run again without resuming')
+
+        # Check credentials, bucket, templates, parameters, subnets,
+        # availability zones, key pair and stack names all at once, so a run
+        # that cannot work stops before anything is created
+        if journal is not None and journal.has_step('preflight'):
+            self.preflight_results = journal.get_step('preflight')
+        else:
+            with trace_phase('preflight'):
+                self.preflight_results = run_preflight(settings, self.s3_bucket_name, self.ec2_key_name)
+
+        self.stack_dependencies = self.get_stack_dependencies()
+
+        if settings.get('dry_run'):
+            # Report what would change, without changing anything
+            print_preflight_results(self.preflight_results)
+            create_s3_bucket(self.s3, self.s3_bucket_name, settings['region'], dry_run=True)
+            print('\nStacks (deployed in this order, each line in parallel): ')
+            for stack_level in get_stack_order(self.stack_keys, self.stack_dependencies):
+                print(' ' + ', '.join(stack_level))
+            return {'stack_results': {}, 'stack_failures': {}, 'ec2_key_name': self.ec2_key_name, 'ec2_key': None,
+                    'ec2_key_file_name': None, 'dry_run': True}
+        if self.preflight_results['errors']:
+            raise RuntimeError(format_preflight_errors(self.preflight_results))
+        if journal is not None and not journal.has_step('preflight'):
+            journal.record_step('preflight', self.preflight_results)
+
+        self.event_tailer = self.get_event_tailer()
+        return None
+
+    def start_stacks(self):
+        # Only what start_stack / finish_stack need: the clients, the stack
+        # graph and the event tailer. For deploying stacks into an environment
+        # whose bucket and templates are already in place, once the caller
+        # has run its own pre-flight checks.
+        self.create_clients()
+        self.stack_dependencies = self.get_stack_dependencies()
+        self.event_tailer = self.get_event_tailer()
+
+    def create_clients(self):
+        credentials = self.settings['credentials']
+        self.s3 = set_s3_client(credentials)
+        self.cf = set_cf_client(credentials)
+        self.ec2 = set_ec2_client(credentials)
+
+    def get_stack_dependencies(self):
+        # Dependencies come from the defaults file, the stack registry and any
+        # Fn::ImportValue references between the local templates
+        settings = self.settings
+        template_dependencies = get_template_stack_dependencies(settings['cf_directory'], get_registry_templates(),
+                                                                get_registry_stack_names(settings['stack_prefix']))
+        return merge_stack_dependencies(get_stack_dependencies(), get_registry_dependencies(), template_dependencies)
+
+    def get_event_tailer(self):
+        # In-flight stack events go to the console and / or
+        # settings['events_file']
+        settings = self.settings
+        if not settings.get('tail_events') and settings.get('events_file') is None:
+            return None
+        return StackEventTailer(self.cf, settings.get('tail_events'), settings.get('events_file'),
+                                settings['ddi'] + '/' + settings['region'])
+
+    def upload_templates(self):
+        # Create CloudFormation S3 Bucket & Upload CloudFormation templates
+        settings = self.settings
+        with trace_phase('create_s3_bucket'):
+            run_step(self.journal, 'create_s3_bucket', create_s3_bucket, self.s3, self.s3_bucket_name,
+                     settings['region'])
+        with trace_phase('upload_s3_object'):
+            if settings.get('use_imports'):
+                run_step(self.journal, 'upload_s3_object', upload_import_s3_objects, self.s3, self.s3_bucket_name,
+                         settings['environment'], settings['cf_directory'], settings['cf_templates_list'], settings)
+            else:
+                run_step(self.journal, 'upload_s3_object', upload_s3_object, self.s3, self.s3_bucket_name,
+                         settings['environment'], settings['cf_directory'], settings['cf_templates_list'])
+
+    def start_stack(self, key, stack_results):
+        # Submit one stack through the registry's single submission path.
+        # Returns (stack result, None) for a stack the journal has as
+        # deployed or that is unchanged, else (None, prepared stack) to wait
+        # on with get_stack_wait and hand to finish_stack. A stack still in
+        # progress from an interrupted run is only waited on.
+        journal = self.journal
+        if journal is not None and journal.has_step('stack ' + key):
+            return tuple(journal.get_step('stack ' + key)), None
+        prepared_stack = prepare_registry_stack(self.cf, self.bucket_url, key, self.settings, stack_results,
+                                                state_store=self.state_store)
+        if prepared_stack['Skip'] is not None:
+            return self.record_stack(key, prepared_stack['Skip']), None
+
+        stack_name = prepared_stack['StackName']
+        if self.event_tailer is not None:
+            self.event_tailer.follow(stack_name)
+        try:
+            prepared_stack['Started'] = submit_stack(self.cf, stack_name, prepared_stack['TemplateURL'],
+                                                     prepared_stack['Parameters'],
+                                                     self.settings.get('incremental', False))
+        except Exception:
+            self.unfollow_stack(prepared_stack)
+            raise
+        return None, prepared_stack
+
+    def get_stack_wait(self, prepared_stack):
+        # Keyword arguments for StackPoller.wait / AsyncStackPoller.wait. Only
+        # an update this run started can fail by rolling back, and a stack
+        # that is no longer listed was deleted.
+        success_statuses = STACK_STABLE_STATUSES
+        if prepared_stack['Started']:
+            success_statuses = STACK_SUCCESS_STATUSES
+        return {'success_statuses': success_statuses, 'timeout': STACK_WAIT_TIMEOUT,
+                'missing_status': 'DELETE_COMPLETE'}
+
+    def unfollow_stack(self, prepared_stack):
+        # Write the stack's last events once its wait is over
+        if self.event_tailer is not None:
+            self.event_tailer.unfollow(prepared_stack['StackName'])
+
+    def finish_stack(self, key, prepared_stack, stack_wait_result, stack=None):
+        # Record a stack once its wait is over and return (stack name,
+        # {logical id: physical id}). stack is the poller's description of
+        # it. Raises RuntimeError describing the failing resource if the
+        # stack failed.
+        return self.record_stack(key, record_registry_stack(self.cf, prepared_stack, self.settings,
+                                                            prepared_stack['Started'], stack_wait_result, stack,
+                                                            self.state_store))
+
+    def record_stack(self, key, stack_result):
+        if self.journal is not None:
+            self.journal.record_step('stack ' + key, stack_result)
+        return tuple(stack_result)
+
+    def finish(self, stack_results, stack_failures):
+        # Create EC2 Key Pair, output to file, and return the run's results.
+        # Only the file name is journaled; a resumed run reads the key back
+        # from the file.
+        journal = self.journal
+        if journal is not None and journal.has_step('create_ec2_key_pair'):
+            ec2_key_file_name = journal.get_step('create_ec2_key_pair')['ec2_key_file_name']
+            ec2_key = read_key_file(ec2_key_file_name)
+        else:
+            with trace_phase('create_ec2_key_pair'):
+                ec2_key, ec2_key_file_name = create_ec2_key_file(self.ec2, self.ec2_key_name)
+            if journal is not None:
+                journal.record_step('create_ec2_key_pair', {'ec2_key_file_name': ec2_key_file_name})
+        if journal is not None and not stack_failures:
+            journal.record_step('complete')
+
+        return {'stack_results': stack_results, 'stack_failures': stack_failures, 'ec2_key_name': self.ec2_key_name,
+                'ec2_key': ec2_key, 'ec2_key_file_name': ec2_key_file_name, 'dry_run': False,
+                'preflight_warnings': self.preflight_results['warnings']}
+
+
+def deploy_environment(settings, journal=None, state_store=None):
+    # Run the full pipeline for one environment without prompting: bucket,
+    # template upload, default stacks and key pair. Returns a dict of stack
+    # results, stack failures and key pair details. Steps are journaled, see
+    # EnvironmentPipeline.
+    pipeline = EnvironmentPipeline(settings, journal, state_store=state_store)
+    dry_run_results = pipeline.start()
+    if dry_run_results is not None:
+        return dry_run_results
+    pipeline.upload_templates()
+    stack_results, stack_failures = deploy_stacks(pipeline)
+    return pipeline.finish(stack_results, stack_failures)
+
+
+def deploy_stacks(pipeline):
+    # Deploy the pipeline's stacks in dependency order (from the defaults
+    # file and the stack registry) - every stack whose inputs are ready is
+    # started at the same time. One shared describe_stacks poller serves
+    # every in-flight stack. Returns (stack results, stack failures), see
+    # stack_graph.deploy_stack_graph.
+    stack_poller = StackPoller(pipeline.cf)
+
+    def get_deploy_function(key):
+        def deploy_stack(stack_results):
+            stack_result, prepared_stack = pipeline.start_stack(key, stack_results)
+            if prepared_stack is None:
+                return stack_result
+            stack_name = prepared_stack['StackName']
+            try:
+                stack_wait_result = stack_poller.wait(stack_name, **pipeline.get_stack_wait(prepared_stack))
+            finally:
+                pipeline.unfollow_stack(prepared_stack)
+            return pipeline.finish_stack(key, prepared_stack, stack_wait_result, stack_poller.get_stack(stack_name))
+        return deploy_stack
+
+    with trace_phase('deploy_stacks'):
+        return deploy_stack_graph(dict([(key, get_deploy_function(key)) for key in pipeline.stack_keys]),
+                                  pipeline.stack_dependencies)
@@ -0,0 +1,113 @@
+import os
+
+from aws_clients import get_client
+from run_spec import get_spec_defaults
+
+
+def set_credentials(region=''):
+    # Get environment variables and set as variables to create auth client
+    # request
+    aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
+    aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    aws_session_token = os.environ.get('AWS_SESSION_TOKEN')
+    region_name = os.environ.get('AWS_DEFAULT_REGION')
+
+    if region_name is None:
+        region_name = region
+
+    # If any of the Access Credentials were not provided, set them on the
+    # command line
+    if aws_access_key_id is None or aws_secret_access_key is None or aws_session_token is None:
+        print('\nAWS Credentials: ')
+    if aws_access_key_id is None:
+        aws_access_key_id = input('AWS_ACCESS_KEY_ID: ')
+    if aws_secret_access_key is None:
+        aws_secret_access_key = input('AWS_SECRET_ACCESS_KEY: ')
+    if aws_session_token is None:
+        aws_session_token = input('AWS_SESSION_TOKEN: ')
+
+    credentials = {'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key,
+                   'aws_session_token': aws_session_token, 'region_name': region_name}
+
+    return credentials
+
+
+def set_s3_client(credentials):
+    # Create S3 client, shared with every other caller using the same
+    # credentials and region
+    return get_client('s3', credentials)
+
+
+def set_cf_client(credentials):
+    # Create CloudFormation client, shared with every other caller using the
+    # same credentials and region
+    return get_client('cloudformation', credentials)
+
+
+def set_ec2_client(credentials):
+    # Create EC2 client, shared with every other caller using the same
+    # credentials and region
+    return get_client('ec2', credentials)
+
+
+def set_s3_bucket_name(ddi, raw_account_name):
+    # Convert raw_account_name to s3-formatted bucket name
+    account_name = raw_account_name.replace(' ', '-').lower()
+    s3_bucket_name = ddi + '-' + account_name + '-cf-templates'
+    return s3_bucket_name
+
+
+def set_ec2_key_name(raw_account_name, environment, region):
+    # Convert raw_account_name to ec2 key name
+    account_name = raw_account_name.replace(' ', '-').lower()
+    environment = environment.lower()
+    ec2_key_name = region + '-' + environment + '-' + account_name
+    return ec2_key_name
+
+
+def set_sns_topic_name(raw_sns_topic_name):
+    sns_topic_name = raw_sns_topic_name.replace(' ', '-').lower()
+    return sns_topic_name
+
+
+def get_bucket_url(s3_bucket_name, environment):
+    bucket_url = 'https://s3.amazonaws.com/' + \
+        s3_bucket_name + '/' + environment.lower()
+
+    return bucket_url
+
+
+# Templates uploaded for the default stacks, see stack_registry
+CF_TEMPLATES_LIST = ['base_network.template', 's3_vpc.template',
+                     'route53_internalzone.template', 'sns_topic_subscriptions.template']
+
+
+# Settings a run cannot do without
+REQUIRED_SETTINGS = ['cf_directory', 'ddi', 'raw_account_name', 'raw_sns_topic_name']
+
+
+def get_default_settings():
+    # Default values for every setting deploy_environment reads; those the
+    # defaults file gives come from it
+    settings = {'cf_directory': '', 'cf_templates_list': list(CF_TEMPLATES_LIST), 'ddi': '',
+                'raw_account_name': '', 'region': '', 'environment': '', 'stack_prefix': '', 'az_count': '',
+                'cidr': '', 'internal_zone_name': '', 'raw_sns_topic_name': '', 'sns_protocol_1': '',
+                'sns_endpoint_1': '', 'sns_protocol_2': '', 'sns_endpoint_2': '', 'sns_protocol_3': '',
+                'sns_endpoint_3': '', 'credentials': None, 'dry_run': False, 'incremental': False,
+                'use_imports': False, 'tail_events': False, 'events_file': None}
+    settings.update(get_spec_defaults())
+    return settings
+
+
+def get_resume_settings(journal):
+    # The settings of the run recorded in journal, with the journaled
+    # profile or the environment's credentials
+    settings = get_default_settings()
+    journal_settings = dict(journal.get_step('settings'))
+    profile = journal_settings.pop('profile')
+    settings.update(journal_settings)
+    if profile:
+        settings['credentials'] = {'profile_name': profile, 'region_name': settings['region']}
+    else:
+        settings['credentials'] = set_credentials(settings['region'])
+    return settings
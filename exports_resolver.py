@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import threading
+
+from template_analyzer import load_template
+
+
+# Export name of a stack output in the default templates
+EXPORT_NAME_FORMAT = '{stack_name}-{output_key}'
+# A '${Name}' variable in an Fn::Sub string; '${!Literal}' is not one, and
+# '${Resource.Attribute}' never names a parameter
+SUB_VARIABLE_PATTERN = re.compile(r'\$\{([A-Za-z0-9:]+)\}')
+
+resolver_lock = threading.Lock()
+exports_resolvers = {}
+
+
+def get_export_name(stack_name, output_key):
+    return EXPORT_NAME_FORMAT.format(stack_name=stack_name, output_key=output_key)
+
+
+class ExportsResolver(object):
+    # Resolves stack outputs through the region's CloudFormation exports.
+    # All exports are fetched with one paginated list_exports pass and cached;
+    # the cache is only refreshed when a name is missing (e.g. exported by a
+    # stack that completed since), and concurrent misses share one refresh.
+
+    def __init__(self, cf, state_store=None, account=None, region=None):
+        self.cf = cf
+        self.state_store = state_store
+        self.account = account
+        self.region = region
+        self.lock = threading.Lock()
+        self.exports = None
+        self.fetch_count = 0
+
+    def fetch_exports(self):
+        exports = {}
+        paginator = self.cf.get_paginator('list_exports')
+        for page in paginator.paginate():
+            for export in page['Exports']:
+                exports[export['Name']] = export['Value']
+        return exports
+
+    def get_export(self, export_name):
+        # Return the export's value, or None if the region does not have it
+        with self.lock:
+            if self.exports is not None and export_name in self.exports:
+                return self.exports[export_name]
+            fetch_count = self.fetch_count
+        with self.lock:
+            # Another thread may have refreshed while this one waited
+            if self.fetch_count == fetch_count or self.exports is None:
+                self.exports = self.fetch_exports()
+                self.fetch_count += 1
+            return self.exports.get(export_name)
+
+    def invalidate(self):
+        # Drop the cached exports; the next lookup fetches them again
+        with self.lock:
+            self.exports = None
+
+    def resolve(self, stack_name, output_key):
+        # Value of stack_name's output_key: its export, else the output
+        # recorded in the state store. Raises RuntimeError if neither has it.
+        value = self.get_export(get_export_name(stack_name, output_key))
+        if value is None and self.state_store is not None:
+            stored_stack = self.state_store.get_stack(self.account, self.region, stack_name)
+            if stored_stack is not None:
+                value = stored_stack['Outputs'].get(output_key)
+        if value is None:
+            raise RuntimeError(stack_name + ' has no output or export ' + output_key)
+        return value
+
+
+def get_exports_resolver(cf, state_store=None, account=None, region=None):
+    # One shared resolver (and exports cache) per account and region
+    with resolver_lock:
+        key = (account, region, id(cf))
+        if key not in exports_resolvers:
+            exports_resolvers[key] = ExportsResolver(cf, state_store, account, region)
+        return exports_resolvers[key]
+
+
+def get_sub_value(replacement):
+    # Fn::Sub variables are strings, so a list of imports is joined
+    if isinstance(replacement, list):
+        return {'Fn::Join': [',', replacement]}
+    return replacement
+
+
+def replace_sub_refs(sub, replacements):
+    # Fn::Sub argument with every '${parameter}' in replacements given as a
+    # variable holding its replacement. Variables the Sub already defines
+    # shadow parameters of the same name.
+    if isinstance(sub, list):
+        sub_string, variables = sub[0], dict(replace_refs(sub[1], replacements)) if len(sub) > 1 else {}
+    else:
+        sub_string, variables = sub, {}
+    if not isinstance(sub_string, str):
+        return sub
+    for name in SUB_VARIABLE_PATTERN.findall(sub_string):
+        if name in replacements and name not in variables:
+            variables[name] = get_sub_value(replacements[name])
+    if not variables:
+        return sub_string
+    return [sub_string, variables]
+
+
+def replace_refs(node, replacements):
+    # Copy of node with every {'Ref': parameter} (and '${parameter}' in an
+    # Fn::Sub) in replacements swapped for its replacement
+    if isinstance(node, dict):
+        if len(node) == 1 and 'Ref' in node and node['Ref'] in replacements:
+            return replacements[node['Ref']]
+        if len(node) == 1 and 'Fn::Sub' in node:
+            return {'Fn::Sub': replace_sub_refs(node['Fn::Sub'], replacements)}
+        return dict([(key, replace_refs(node[key], replacements)) for key in node])
+    if isinstance(node, list):
+        return [replace_refs(element, replacements) for element in node]
+    return node
+
+
+def rewrite_template_imports(template_body, parameter_exports):
+    # Rewrite a template so the parameters in parameter_exports
+    # ({parameter: export name or list of export names}) import their values
+    # with Fn::ImportValue instead of being passed in. List parameters become
+    # a list of imports. Returns the new template as JSON.
+    template = load_template(template_body)
+    parameters = template.get('Parameters') or {}
+    replacements = {}
+    for parameter_key in parameter_exports:
+        if parameter_key not in parameters:
+            continue
+        export_names = parameter_exports[parameter_key]
+        if isinstance(export_names, list):
+            replacements[parameter_key] = [{'Fn::ImportValue': export_name} for export_name in export_names]
+        else:
+            replacements[parameter_key] = {'Fn::ImportValue': export_names}
+        del parameters[parameter_key]
+    if 'Parameters' in template and not parameters:
+        del template['Parameters']
+    for section in template:
+        if section != 'Parameters':
+            template[section] = replace_refs(template[section], replacements)
+    return json.dumps(template, indent=2)
+
+
+def write_import_templates(cf_directory, output_directory, template_parameter_exports):
+    # Write a rewritten copy of every template in template_parameter_exports
+    # ({template: {parameter: export name(s)}}) to output_directory
+    for cf_template in template_parameter_exports:
+        with open(os.path.join(cf_directory, cf_template)) as f:
+            template_body = rewrite_template_imports(f.read(), template_parameter_exports[cf_template])
+        with open(os.path.join(output_directory, cf_template), 'w') as f:
+            f.write(template_body)
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+
+# Set FAWS_TRACE_REPORT to a file path to record a run report
+TRACE_REPORT_VARIABLE = 'FAWS_TRACE_REPORT'
+
+run_tracer = None
+
+
+class RunTracer(object):
+    # Records every pipeline phase and every boto3 API call (latency,
+    # retries, throttles, bytes moved) made by clients attached to it, via
+    # botocore event hooks
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.phases = []
+        self.calls = []
+        # Held weakly rather than by id(), which a new client may reuse once
+        # an old one is gone
+        self.attached = weakref.WeakSet()
+
+    def attach(self, client):
+        # Register the hooks on a client; safe to call more than once. Clients
+        # without botocore events are not traced.
+        if getattr(client, 'meta', None) is None:
+            return
+        with self.lock:
+            if client in self.attached:
+                return
+            self.attached.add(client)
+        events = client.meta.events
+        events.register('before-call', self.before_call, unique_id='run-tracer-before-call-' + str(id(self)))
+        events.register('before-send', self.before_send, unique_id='run-tracer-before-send-' + str(id(self)))
+        events.register('needs-retry', self.needs_retry, unique_id='run-tracer-needs-retry-' + str(id(self)))
+        events.register('after-call', self.after_call, unique_id='run-tracer-after-call-' + str(id(self)))
+
+    def before_call(self, model, params, context, **kwargs):
+        context['run_trace'] = {'service': model.service_model.service_name, 'operation': model.name,
+                                'start': time.time(), 'thread': threading.current_thread().name,
+                                'attempts': 0, 'retries': 0, 'throttles': 0, 'bytes_sent': 0,
+                                'bytes_received': 0}
+
+    def before_send(self, request, **kwargs):
+        # Called once per attempt with the prepared request
+        call = (getattr(request, 'context', None) or {}).get('run_trace')
+        if call is not None:
+            call['attempts'] += 1
+            content_length = request.headers.get('Content-Length')
+            if content_length is not None:
+                call['bytes_sent'] += int(content_length)
+
+    def needs_retry(self, response=None, request_dict=None, attempts=None, caught_exception=None, **kwargs):
+        if request_dict is None:
+            return None
+        call = request_dict.get('context', {}).get('run_trace')
+        if call is not None and response is not None:
+            error_code = response[1].get('Error', {}).get('Code', '')
+            if 'Throttl' in error_code or error_code in ['RequestLimitExceeded', 'SlowDown']:
+                call['throttles'] += 1
+        return None
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        call = context.get('run_trace')
+        if call is None:
+            return
+        call['duration'] = time.time() - call['start']
+        call['retries'] = max(call['attempts'] - 1, 0)
+        call['status_code'] = http_response.status_code
+        call['error'] = parsed.get('Error', {}).get('Code')
+        content_length = http_response.headers.get('content-length')
+        if content_length is not None:
+            call['bytes_received'] += int(content_length)
+        with self.lock:
+            self.calls.append(call)
+
+    @contextmanager
+    def phase(self, name):
+        phase = {'name': name, 'start': time.time(), 'thread': threading.current_thread().name}
+        try:
+            yield phase
+        finally:
+            phase['duration'] = time.time() - phase['start']
+            with self.lock:
+                self.phases.append(phase)
+
+    def get_records(self):
+        # Copies of the phases and calls recorded so far, safe to read while
+        # other threads keep recording
+        with self.lock:
+            return list(self.phases), list(self.calls)
+
+    def get_summary(self):
+        # Totals per service/operation, slowest first
+        operations = {}
+        for call in self.get_records()[1]:
+            key = call['service'] + ':' + call['operation']
+            summary = operations.setdefault(key, {'operation': key, 'count': 0, 'total_seconds': 0.0,
+                                                  'max_seconds': 0.0, 'retries': 0, 'throttles': 0,
+                                                  'errors': 0, 'bytes_sent': 0, 'bytes_received': 0})
+            summary['count'] += 1
+            summary['total_seconds'] += call['duration']
+            summary['max_seconds'] = max(summary['max_seconds'], call['duration'])
+            summary['retries'] += call['retries']
+            summary['throttles'] += call['throttles']
+            summary['bytes_sent'] += call['bytes_sent']
+            summary['bytes_received'] += call['bytes_received']
+            if call['error']:
+                summary['errors'] += 1
+        return sorted(operations.values(), key=lambda summary: -summary['total_seconds'])
+
+    def get_trace_events(self):
+        # Chrome trace ('X' complete events, microseconds since run start)
+        phases, calls = self.get_records()
+        trace_events = []
+        for phase in phases:
+            trace_events.append({'name': phase['name'], 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': phase['thread'],
+                                 'ts': int((phase['start'] - self.start_time) * 1e6),
+                                 'dur': int(phase['duration'] * 1e6)})
+        for call in calls:
+            trace_events.append({'name': call['service'] + ':' + call['operation'], 'cat': 'api', 'ph': 'X',
+                                 'pid': 1, 'tid': call['thread'], 'ts': int((call['start'] - self.start_time) * 1e6),
+                                 'dur': int(call['duration'] * 1e6),
+                                 'args': {'retries': call['retries'], 'throttles': call['throttles'],
+                                          'error': call['error'], 'bytes_sent': call['bytes_sent'],
+                                          'bytes_received': call['bytes_received']}})
+        return trace_events
+
+    def write_report(self, report_file):
+        # One JSON file: the summary tables plus a traceEvents list, so it can
+        # also be opened in chrome://tracing or Perfetto
+        report = {'duration_seconds': time.time() - self.start_time,
+                  'phases': [{'name': phase['name'], 'thread': phase['thread'],
+                              'start_seconds': phase['start'] - self.start_time,
+                              'duration_seconds': phase['duration']} for phase in self.get_records()[0]],
+                  'api_calls': self.get_summary(),
+                  'traceEvents': self.get_trace_events()}
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def start_run_trace():
+    # Start recording; clients from aws_clients.get_client are attached
+    global run_tracer
+    run_tracer = RunTracer()
+    return run_tracer
+
+
+def get_run_tracer():
+    return run_tracer
+
+
+def start_run_trace_from_environment():
+    # Start recording if FAWS_TRACE_REPORT is set, return the report path
+    report_file = os.environ.get(TRACE_REPORT_VARIABLE)
+    if report_file:
+        start_run_trace()
+    return report_file
+
+
+def write_run_report(report_file):
+    if run_tracer is not None and report_file:
+        run_tracer.write_report(report_file)
+        print('\nRun report written to ' + report_file)
+
+
+@contextmanager
+def trace_phase(name):
+    # Record a pipeline phase when a run trace is active, otherwise do nothing
+    if run_tracer is None:
+        yield None
+    else:
+        with run_tracer.phase(name) as phase:
+            yield phase
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from deploy_settings import get_default_settings
+from run_spec import add_run_spec_arguments, get_run_settings
+from stack_registry import STACK_REGISTRY, get_stack_parameters
+from template_cache import get_templates_defaults
+
+
+# Parameter file format -> file name suffix (after the template name):
+# 'json' is the [{ParameterKey, ParameterValue}] list create-stack
+# --parameters file:// takes, 'yaml' the same list as YAML, 'overrides' the
+# ["Key=Value"] list aws cloudformation deploy --parameter-overrides takes
+PARAMETER_FILE_FORMATS = {'json': '.parameters', 'yaml': '.parameters.yaml', 'overrides': '.overrides.json'}
+
+
+def get_template_parameter_values(cf_template, settings, registry=STACK_REGISTRY):
+    # {parameter: value} the registry gives a template from settings.
+    # Upstream stack outputs only exist once deployed, so they are left to
+    # the template default.
+    parameter_values = {}
+    for key in registry:
+        if registry[key]['cf_template'] == cf_template:
+            for parameter in get_stack_parameters(key, dict(settings, use_imports=True), {}, registry):
+                parameter_values[parameter['ParameterKey']] = parameter['ParameterValue']
+    return parameter_values
+
+
+def merge_parameters(template_defaults, parameter_values):
+    # [{ParameterKey, ParameterValue}] for every template parameter, sorted:
+    # the settings' value, else the template default, else ''
+    parameters = []
+    for parameter_key in sorted(template_defaults):
+        value = parameter_values.get(parameter_key, template_defaults[parameter_key])
+        if value is None:
+            value = ''
+        parameters.append({'ParameterKey': parameter_key, 'ParameterValue': str(value)})
+    return parameters
+
+
+def format_parameters(parameters, file_format):
+    if file_format == 'json':
+        return json.dumps(parameters, indent=2) + '\n'
+    if file_format == 'yaml':
+        if yaml is None:
+            raise ValueError('PyYAML is not installed, YAML parameter files cannot be written')
+        return yaml.safe_dump(parameters, default_flow_style=False)
+    if file_format == 'overrides':
+        return json.dumps([parameter['ParameterKey'] + '=' + parameter['ParameterValue']
+                           for parameter in parameters], indent=2) + '\n'
+    raise ValueError('Unknown parameter file format ' + file_format)
+
+
+def write_file_atomic(file_path, file_content):
+    # Write to a temporary file in the same directory and rename it over
+    # file_path, so readers never see a partial file
+    temp_file = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file_path) or '.', suffix='.tmp',
+                                            delete=False)
+    try:
+        with temp_file:
+            temp_file.write(file_content)
+        os.rename(temp_file.name, file_path)
+    except Exception:
+        os.remove(temp_file.name)
+        raise
+
+
+def get_parameter_settings(run_settings):
+    # Settings parameters files are written from: the run spec and flags
+    # over the script defaults
+    settings = get_default_settings()
+    settings.update(run_settings)
+    if settings['raw_sns_topic_name'] == '':
+        settings['raw_sns_topic_name'] = settings['raw_account_name']
+    return settings
+
+
+def create_parameters_files(cf_directory, cf_templates_list, output_directory='.', settings=None,
+                            file_formats=('json',), get_remote_template_defaults=None, registry=STACK_REGISTRY,
+                            max_workers=10):
+    # Write a parameters file per template and format to output_directory.
+    # Template defaults come from the template cache / local template files
+    # (get_remote_template_defaults(cf_template) for any that cannot be
+    # parsed locally) and are overridden by the values the registry takes
+    # from settings, when given. Templates are processed in parallel.
+    # Returns {'written': [file path], 'failed': {template: reason}}.
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    for file_format in file_formats:
+        # Fail before anything is written
+        format_parameters([], file_format)
+    if get_remote_template_defaults is None:
+        def get_remote_template_defaults(cf_template):
+            return None
+
+    templates_defaults = get_templates_defaults(cf_directory, cf_templates_list, get_remote_template_defaults,
+                                                max_workers)
+
+    def create_template_files(position):
+        cf_template = cf_templates_list[position]
+        if templates_defaults[position] is None:
+            raise ValueError('its parameters could not be read')
+        parameter_values = {}
+        if settings is not None:
+            parameter_values = get_template_parameter_values(cf_template, settings, registry)
+        parameters = merge_parameters(templates_defaults[position], parameter_values)
+        file_paths = []
+        for file_format in file_formats:
+            file_path = os.path.join(output_directory, cf_template + PARAMETER_FILE_FORMATS[file_format])
+            write_file_atomic(file_path, format_parameters(parameters, file_format))
+            file_paths.append(file_path)
+        return file_paths
+
+    def run_template(position):
+        try:
+            return create_template_files(position), None
+        except Exception as e:
+            return [], str(e)
+
+    parameters_files = {'written': [], 'failed': {}}
+    if not cf_templates_list:
+        return parameters_files
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(cf_templates_list)))
+    try:
+        template_results = list(executor.map(run_template, range(len(cf_templates_list))))
+    finally:
+        executor.shutdown(wait=True)
+    for position, (file_paths, error) in enumerate(template_results):
+        parameters_files['written'].extend(file_paths)
+        if error is not None:
+            parameters_files['failed'][cf_templates_list[position]] = error
+    return parameters_files
+
+
+def print_parameters_files(parameters_files):
+    for file_path in parameters_files['written']:
+        print('Created ' + file_path)
+    for cf_template in sorted(parameters_files['failed']):
+        print('Skipped ' + cf_template + ': ' + parameters_files['failed'][cf_template])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Write CloudFormation parameters files for a template directory, '
+                                                 'without calling AWS.')
+    add_run_spec_arguments(parser)
+    parser.add_argument('--templates', help='Comma-delimited template file names (every *.template file)')
+    parser.add_argument('--output-directory', default='.', help='Directory the files are written to (.)')
+    parser.add_argument('--format', action='append', choices=sorted(PARAMETER_FILE_FORMATS),
+                        help='File format (repeatable, json)')
+    parser.add_argument('--workers', type=int, default=10, help='Templates processed at once (10)')
+    args = parser.parse_args(argv)
+    try:
+        run_settings = get_run_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if not run_settings.get('cf_directory'):
+        parser.error('--cf-directory is required (in the run spec or on the command line)')
+
+    # Values the run spec and flags give override the script defaults, which
+    # override the template defaults
+    settings = get_parameter_settings(run_settings)
+    cf_directory = os.path.expanduser(settings['cf_directory'])
+    if args.templates:
+        cf_templates_list = args.templates.replace(' ', '').split(',')
+    else:
+        cf_templates_list = sorted([f for f in os.listdir(cf_directory) if f.endswith('.template')])
+
+    parameters_files = create_parameters_files(cf_directory, cf_templates_list, args.output_directory, settings,
+                                               args.format or ['json'], max_workers=args.workers)
+    print_parameters_files(parameters_files)
+    if parameters_files['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,243 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from aws_clients import get_client
+from defaults_model import get_defaults_model, get_stack_key
+from run_spec import RUN_SPEC_SETTINGS, get_setting_problem
+from s3_templates import get_bucket_exists
+from stack_registry import STACK_REGISTRY, get_registry_stack_name, get_stack_parameters, get_template_path
+from subnet_plan import validate_subnet_plan
+from template_analyzer import load_template
+
+
+# Stack statuses a stack can be neither created over nor updated from
+STACK_BLOCKED_STATUSES = ['ROLLBACK_COMPLETE', 'ROLLBACK_FAILED', 'DELETE_FAILED', 'UPDATE_ROLLBACK_FAILED']
+
+STACK_NAME_PATTERN = re.compile('^[a-zA-Z][-a-zA-Z0-9]{0,127}$')
+
+# validate_template only takes template bodies up to this size
+TEMPLATE_BODY_MAX_BYTES = 51200
+
+
+def check_credentials(settings, context):
+    get_client('sts', settings['credentials']).get_caller_identity()
+    return []
+
+
+def check_bucket(settings, context):
+    # A missing bucket is created; one owned by another account is an error
+    try:
+        get_bucket_exists(get_client('s3', settings['credentials']), context['s3_bucket_name'])
+    except ValueError as e:
+        return [('error', str(e))]
+    return []
+
+
+def get_template_check(cf_template):
+    def check_template(settings, context):
+        template_path = os.path.join(settings['cf_directory'], cf_template)
+        if not os.path.isfile(template_path):
+            return [('error', cf_template + ' is not in ' + settings['cf_directory'])]
+        with open(template_path) as f:
+            template_body = f.read()
+        if len(template_body) > TEMPLATE_BODY_MAX_BYTES:
+            return [('warning', cf_template + ' is too large to validate before it is uploaded')]
+        try:
+            get_client('cloudformation', settings['credentials']).validate_template(TemplateBody=template_body)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationError':
+                return [('error', cf_template + ': ' + e.response['Error']['Message'])]
+            raise
+        return []
+    return check_template
+
+
+def get_parameter_problems(parameter_key, value, definition):
+    # What is wrong with value for a template parameter definition, if
+    # anything, without asking CloudFormation
+    problems = []
+    value = str(value)
+    if 'AllowedValues' in definition and value not in [str(allowed) for allowed in definition['AllowedValues']]:
+        problems.append(parameter_key + ' "' + value + '" is not one of ' +
+                        ', '.join([str(allowed) for allowed in definition['AllowedValues']]))
+    if 'AllowedPattern' in definition and not re.match('^(?:' + definition['AllowedPattern'] + ')$', value):
+        problems.append(parameter_key + ' "' + value + '" does not match ' + definition['AllowedPattern'])
+    parameter_type = definition.get('Type', 'String')
+    if parameter_type == 'Number':
+        try:
+            number = float(value)
+        except ValueError:
+            problems.append(parameter_key + ' "' + value + '" is not a number')
+        else:
+            if 'MinValue' in definition and number < float(definition['MinValue']):
+                problems.append(parameter_key + ' ' + value + ' is less than ' + str(definition['MinValue']))
+            if 'MaxValue' in definition and number > float(definition['MaxValue']):
+                problems.append(parameter_key + ' ' + value + ' is more than ' + str(definition['MaxValue']))
+    elif parameter_type == 'String':
+        if 'MinLength' in definition and len(value) < int(definition['MinLength']):
+            problems.append(parameter_key + ' is shorter than ' + str(definition['MinLength']) + ' characters')
+        if 'MaxLength' in definition and len(value) > int(definition['MaxLength']):
+            problems.append(parameter_key + ' is longer than ' + str(definition['MaxLength']) + ' characters')
+    return problems
+
+
+def get_stack_parameter_check(key):
+    def check_stack_parameters(settings, context):
+        # The registry's parameter values against the local template's
+        # parameter definitions. Values from upstream outputs only exist once
+        # those stacks are deployed, so they are not checked.
+        registry = context['registry']
+        template_path = get_template_path(key, settings, registry)
+        if template_path is None:
+            return []
+        with open(template_path) as f:
+            definitions = load_template(f.read()).get('Parameters') or {}
+        parameters = get_stack_parameters(key, dict(settings, use_imports=True), {}, registry)
+        parameter_keys = [parameter_key for parameter_key, source in registry[key]['parameters']]
+        problems = []
+        for parameter in parameters:
+            if parameter['ParameterKey'] not in definitions:
+                problems.append(('error', registry[key]['cf_template'] + ' has no parameter ' +
+                                 parameter['ParameterKey']))
+                continue
+            for problem in get_parameter_problems(parameter['ParameterKey'], parameter['ParameterValue'],
+                                                  definitions[parameter['ParameterKey']]):
+                problems.append(('error', key + ': ' + problem))
+        for parameter_key in sorted(definitions):
+            if parameter_key not in parameter_keys and 'Default' not in definitions[parameter_key]:
+                problems.append(('error', registry[key]['cf_template'] + ' parameter ' + parameter_key +
+                                 ' has no value and no default'))
+        return problems
+    return check_stack_parameters
+
+
+def check_allowed_values(settings, context):
+    # Settings of the stacks being deployed, and of sections that are not
+    # stacks, must be one of the values the defaults file allows
+    defaults_model = get_defaults_model()
+    problems = []
+    for (section, key), setting in sorted(RUN_SPEC_SETTINGS.items()):
+        defaults_section = defaults_model.get_section(section)
+        if defaults_section is None or (defaults_section.stack and
+                                        get_stack_key(section) not in context['stack_keys']):
+            continue
+        setting_problem = get_setting_problem(setting, settings.get(setting, ''), defaults_model)
+        if setting_problem is not None:
+            problems.append(('error', setting_problem))
+    return problems
+
+
+def check_subnet_plan(settings, context):
+    try:
+        validate_subnet_plan(settings['cidr'], settings['az_count'], get_client('ec2', settings['credentials']),
+                             get_registry_stack_name('BaseNetwork', settings['stack_prefix'], context['registry']))
+    except ValueError as e:
+        return [('error', str(e))]
+    return []
+
+
+def check_availability_zones(settings, context):
+    availability_zones = get_client('ec2', settings['credentials']).describe_availability_zones(
+        Filters=[{'Name': 'state', 'Values': ['available']}])['AvailabilityZones']
+    if len(availability_zones) < int(settings['az_count']):
+        return [('error', settings['region'] + ' has ' + str(len(availability_zones)) +
+                 ' available availability zones, ' + settings['az_count'] + ' are needed')]
+    return []
+
+
+def check_key_pair(settings, context):
+    # An existing key pair is kept, but its private key cannot be written
+    try:
+        get_client('ec2', settings['credentials']).describe_key_pairs(KeyNames=[context['ec2_key_name']])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidKeyPair.NotFound':
+            return []
+        raise
+    return [('warning', 'EC2 key pair "' + context['ec2_key_name'] + '" already exists; no key file is written')]
+
+
+def check_stacks(settings, context):
+    # Stack names must be valid and not belong to a stack that is busy or
+    # can only be deleted, which one paginated describe_stacks pass shows
+    registry = context['registry']
+    stack_names = [get_registry_stack_name(key, settings['stack_prefix'], registry) for key in context['stack_keys']]
+    problems = []
+    for stack_name in stack_names:
+        if not STACK_NAME_PATTERN.match(stack_name):
+            problems.append(('error', 'Stack name "' + stack_name + '" is not valid'))
+    paginator = get_client('cloudformation', settings['credentials']).get_paginator('describe_stacks')
+    for page in paginator.paginate():
+        for stack in page['Stacks']:
+            if stack['StackName'] not in stack_names:
+                continue
+            if stack['StackStatus'].endswith('_IN_PROGRESS'):
+                problems.append(('error', stack['StackName'] + ' is busy (' + stack['StackStatus'] + ')'))
+            elif stack['StackStatus'] in STACK_BLOCKED_STATUSES:
+                problems.append(('error', stack['StackName'] + ' is ' + stack['StackStatus'] +
+                                 ' and must be deleted first'))
+    return problems
+
+
+def get_preflight_checks(settings, stack_keys, ec2_key_name=None):
+    # [(name, function(settings, context))] for every check that applies
+    checks = [('credentials', check_credentials), ('bucket', check_bucket)]
+    if ec2_key_name is not None:
+        checks.append(('key pair', check_key_pair))
+    for cf_template in settings.get('cf_templates_list') or []:
+        checks.append(('template ' + cf_template, get_template_check(cf_template)))
+    if stack_keys:
+        checks.append(('stacks', check_stacks))
+        for key in stack_keys:
+            checks.append(('parameters ' + key, get_stack_parameter_check(key)))
+        checks.append(('allowed values', check_allowed_values))
+        if 'BaseNetwork' in stack_keys:
+            checks.append(('subnets', check_subnet_plan))
+            checks.append(('availability zones', check_availability_zones))
+    return checks
+
+
+def run_preflight(settings, s3_bucket_name, ec2_key_name=None, stack_keys=None, registry=STACK_REGISTRY,
+                  max_workers=10):
+    # Run every pre-flight check at once and return {'errors': [...],
+    # 'warnings': [...]}. stack_keys are the registry stacks about to be
+    # deployed (every one if None, none if empty); the key pair is only
+    # checked when ec2_key_name is given. A check that fails to run is an
+    # error.
+    if stack_keys is None:
+        stack_keys = list(registry)
+    context = {'s3_bucket_name': s3_bucket_name, 'ec2_key_name': ec2_key_name, 'stack_keys': stack_keys,
+               'registry': registry}
+
+    def run_check(check):
+        name, function = check
+        try:
+            return function(settings, context)
+        except Exception as e:
+            return [('error', name + ' check failed: ' + str(e))]
+
+    checks = get_preflight_checks(settings, stack_keys, ec2_key_name)
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(checks)))
+    try:
+        check_results = list(executor.map(run_check, checks))
+    finally:
+        executor.shutdown(wait=True)
+
+    preflight_results = {'errors': [], 'warnings': []}
+    for check_result in check_results:
+        for severity, message in check_result:
+            preflight_results[severity + 's'].append(message)
+    return preflight_results
+
+
+def print_preflight_results(preflight_results):
+    for warning in preflight_results['warnings']:
+        print('Pre-flight warning: ' + warning)
+    for error in preflight_results['errors']:
+        print('Pre-flight error: ' + error)
+
+
+def format_preflight_errors(preflight_results):
+    return 'Pre-flight checks failed: ' + '; '.join(preflight_results['errors'])
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+
+
+JOURNAL_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'faws_default_stacks', 'journals')
+
+# Settings that only affect how a run reports, or that are supplied again on
+# resume, so they are neither journaled nor compared
+JOURNAL_EXCLUDED_SETTINGS = ['credentials', 'events_file', 'dry_run', 'tail_events']
+
+
+class RunJournal(object):
+    # Append-only JSON lines record of the completed steps of one
+    # environment run and their outputs. Every line is flushed to disk as its
+    # step completes, so a crashed run can be resumed from its last completed
+    # step; a line torn by the crash is ignored. Without resume any earlier
+    # journal in the file is discarded.
+
+    def __init__(self, journal_file, resume=False):
+        journal_directory = os.path.dirname(journal_file)
+        if journal_directory and not os.path.isdir(journal_directory):
+            os.makedirs(journal_directory)
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.steps = {}
+        if resume and os.path.isfile(journal_file):
+            with open(journal_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.steps[record['step']] = record['outputs']
+        else:
+            open(journal_file, 'w').close()
+
+    def has_step(self, step):
+        with self.lock:
+            return step in self.steps
+
+    def get_step(self, step):
+        with self.lock:
+            return self.steps.get(step)
+
+    def record_step(self, step, outputs=None):
+        line = json.dumps({'step': step, 'outputs': outputs, 'time': time.time()}, sort_keys=True)
+        with self.lock:
+            with open(self.journal_file, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.steps[step] = json.loads(line)['outputs']
+
+    def get_complete(self):
+        return self.has_step('complete')
+
+
+def run_step(journal, step, function, *args, **kwargs):
+    # Run function unless the journal already has step, recording its
+    # (JSON) outputs; without a journal it always runs
+    if journal is None:
+        return function(*args, **kwargs)
+    if journal.has_step(step):
+        return journal.get_step(step)
+    outputs = function(*args, **kwargs)
+    journal.record_step(step, outputs)
+    return outputs
+
+
+def get_journal_settings(settings):
+    # The settings a run is journaled with; credentials are kept as the
+    # profile name only
+    journal_settings = dict([(setting, settings[setting]) for setting in settings
+                             if setting not in JOURNAL_EXCLUDED_SETTINGS])
+    journal_settings['profile'] = (settings.get('credentials') or {}).get('profile_name')
+    return json.loads(json.dumps(journal_settings))
+
+
+def get_journal_file(settings, journal_directory=None):
+    # One journal per account, region and stack prefix, under
+    # JOURNAL_DIRECTORY unless journal_directory is given
+    if journal_directory is None:
+        journal_directory = JOURNAL_DIRECTORY
+    return os.path.join(journal_directory, settings['ddi'] + '-' + settings['region'] + '-' +
+                        settings['stack_prefix'] + '.jsonl')
+
+
+def get_latest_journal_file(journal_directory=None):
+    # The most recently written journal of a run that did not complete, or
+    # None
+    if journal_directory is None:
+        journal_directory = JOURNAL_DIRECTORY
+    if not os.path.isdir(journal_directory):
+        return None
+    journal_files = []
+    for file_name in os.listdir(journal_directory):
+        journal_file = os.path.join(journal_directory, file_name)
+        if file_name.endswith('.jsonl') and not RunJournal(journal_file, resume=True).get_complete():
+            journal_files.append((os.path.getmtime(journal_file), journal_file))
+    if not journal_files:
+        return None
+    return max(journal_files)[1]
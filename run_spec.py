@@ -0,0 +1,223 @@
+import json
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from defaults_model import get_defaults_model
+
+
+# Run spec (section, key) -> deploy_defaults setting. Sections and keys
+# follow the defaults file and are matched ignoring case, spaces and '-'.
+RUN_SPEC_SETTINGS = {
+    ('Script', 'TemplateDirectory'): 'cf_directory',
+    ('Account', 'ddi'): 'ddi',
+    ('Account', 'accountname'): 'raw_account_name',
+    ('Credentials', 'Profile'): 'profile',
+    ('VPC Parameters', 'Region'): 'region',
+    ('VPC Parameters', 'Environment'): 'environment',
+    ('VPC Parameters', 'StackPrefix'): 'stack_prefix',
+    ('Base Network', 'AvailabilityZoneCount'): 'az_count',
+    ('Base Network', 'CIDRRange'): 'cidr',
+    ('Route53 Internal Zone', 'InternalZoneName'): 'internal_zone_name',
+    ('SNS Topic Subscriptions', 'DisplayName'): 'raw_sns_topic_name',
+    ('SNS Topic Subscriptions', 'SubscriptionProtocol1'): 'sns_protocol_1',
+    ('SNS Topic Subscriptions', 'SubscriptionEndpoint1'): 'sns_endpoint_1',
+    ('SNS Topic Subscriptions', 'SubscriptionProtocol2'): 'sns_protocol_2',
+    ('SNS Topic Subscriptions', 'SubscriptionEndpoint2'): 'sns_endpoint_2',
+    ('SNS Topic Subscriptions', 'SubscriptionProtocol3'): 'sns_protocol_3',
+    ('SNS Topic Subscriptions', 'SubscriptionEndpoint3'): 'sns_endpoint_3'
+}
+
+# Command line flag -> setting, label for help and prompts. Flags override
+# the run spec. Defaults are added from the defaults file.
+RUN_SPEC_ARGUMENTS = [
+    ('--cf-directory', 'cf_directory', 'CloudFormation template directory path'),
+    ('--ddi', 'ddi', 'Rackspace account number'),
+    ('--account-name', 'raw_account_name', 'Rackspace account name'),
+    ('--profile', 'profile', 'Named AWS profile to use instead of the AWS_* environment variables'),
+    ('--region', 'region', 'Region'),
+    ('--environment', 'environment', 'Environment'),
+    ('--stack-prefix', 'stack_prefix', 'Stack prefix'),
+    ('--az-count', 'az_count', 'Availability zone count'),
+    ('--cidr', 'cidr', 'CIDR range'),
+    ('--internal-zone-name', 'internal_zone_name', 'Route53 internal zone name'),
+    ('--sns-topic-name', 'raw_sns_topic_name', 'SNS topic name'),
+    ('--sns-protocol-1', 'sns_protocol_1', 'SNS protocol 1'),
+    ('--sns-endpoint-1', 'sns_endpoint_1', 'SNS endpoint 1'),
+    ('--sns-protocol-2', 'sns_protocol_2', 'SNS protocol 2'),
+    ('--sns-endpoint-2', 'sns_endpoint_2', 'SNS endpoint 2'),
+    ('--sns-protocol-3', 'sns_protocol_3', 'SNS protocol 3'),
+    ('--sns-endpoint-3', 'sns_endpoint_3', 'SNS endpoint 3')
+]
+
+
+def get_spec_key(name):
+    return name.replace(' ', '').replace('-', '').lower()
+
+
+def get_spec_setting(section, key):
+    # The setting a defaults file (section, key) is given by, or None
+    for (spec_section, spec_key), setting in RUN_SPEC_SETTINGS.items():
+        if (get_spec_key(spec_section), get_spec_key(spec_key)) == (get_spec_key(section), get_spec_key(key)):
+            return setting
+    return None
+
+
+def get_spec_defaults(defaults_model=None):
+    # {setting: default} for every setting the defaults file (or its
+    # DEFAULT_VALUES) gives a default
+    if defaults_model is None:
+        defaults_model = get_defaults_model()
+    spec_defaults = {}
+    for (section, key), setting in RUN_SPEC_SETTINGS.items():
+        parameter = defaults_model.get_parameter(section, key)
+        if parameter is not None and not parameter.references:
+            spec_defaults[setting] = parameter.default or ''
+    return spec_defaults
+
+
+def get_setting_sections(defaults_model=None):
+    # [(section name, [setting])] for the settings the defaults file lists,
+    # in its order, which is the order they are asked for
+    if defaults_model is None:
+        defaults_model = get_defaults_model()
+    setting_sections = []
+    for section in defaults_model.sections:
+        section_settings = [get_spec_setting(section.name, parameter.name)
+                            for parameter in section.settings + section.parameters if not parameter.references]
+        section_settings = [setting for setting in section_settings if setting is not None]
+        if section_settings:
+            setting_sections.append((section.name, section_settings))
+    return setting_sections
+
+
+def get_setting_allowed_values(setting, defaults_model=None):
+    # The values the defaults file allows for setting ('[a, b]'), or None
+    if defaults_model is None:
+        defaults_model = get_defaults_model()
+    for (section, key), spec_setting in RUN_SPEC_SETTINGS.items():
+        if spec_setting == setting:
+            parameter = defaults_model.get_parameter(section, key)
+            if parameter is not None:
+                return parameter.allowed_values
+    return None
+
+
+def get_setting_problem(setting, value, defaults_model=None):
+    # Why value is not allowed for setting, or None; blank values are left
+    # to the required checks
+    allowed_values = get_setting_allowed_values(setting, defaults_model)
+    if allowed_values is None or value == '' or str(value) in allowed_values:
+        return None
+    return get_setting_flag(setting) + ' "' + str(value) + '" is not one of ' + ', '.join(allowed_values)
+
+
+def load_run_spec(spec_file):
+    # Parse a JSON or YAML run spec file into a dict. Raises ValueError if it
+    # is neither.
+    with open(spec_file) as f:
+        spec_body = f.read()
+    try:
+        run_spec = json.loads(spec_body)
+    except ValueError:
+        if yaml is None:
+            raise ValueError(spec_file + ' is not JSON and PyYAML is not installed')
+        try:
+            run_spec = yaml.safe_load(spec_body)
+        except yaml.YAMLError as e:
+            raise ValueError(spec_file + ' is not valid JSON or YAML: ' + str(e))
+    if not isinstance(run_spec, dict):
+        raise ValueError(spec_file + ' is not a JSON or YAML object')
+    return run_spec
+
+
+def get_run_spec_settings(run_spec):
+    # Map a run spec's sections onto settings. Unknown sections or keys are
+    # an error, so a typo does not silently fall back to a default value.
+    spec_settings = {}
+    for (section, key), setting in RUN_SPEC_SETTINGS.items():
+        spec_settings[(get_spec_key(section), get_spec_key(key))] = setting
+
+    settings = {}
+    for section in run_spec:
+        if not isinstance(run_spec[section], dict):
+            raise ValueError('Run spec section "' + str(section) + '" is not a mapping')
+        for key in run_spec[section]:
+            spec_key = (get_spec_key(str(section)), get_spec_key(str(key)))
+            if spec_key not in spec_settings:
+                raise ValueError('Unknown run spec setting "' + str(section) + ': ' + str(key) + '"')
+            value = run_spec[section][key]
+            if value is not None:
+                settings[spec_settings[spec_key]] = str(value)
+    return settings
+
+
+def add_run_spec_arguments(parser):
+    parser.add_argument('--spec', help='JSON or YAML run spec, laid out like the defaults file')
+    spec_defaults = get_spec_defaults()
+    for flag, setting, label in RUN_SPEC_ARGUMENTS:
+        if spec_defaults.get(setting):
+            label += ' (' + spec_defaults[setting] + ')'
+        parser.add_argument(flag, dest=setting, help=label)
+
+
+def get_run_settings(args):
+    # Settings given by the run spec and command line flags, flags winning
+    settings = {}
+    if args.spec:
+        settings.update(get_run_spec_settings(load_run_spec(args.spec)))
+    for flag, setting, label in RUN_SPEC_ARGUMENTS:
+        if getattr(args, setting) is not None:
+            settings[setting] = getattr(args, setting)
+    return settings
+
+
+def get_setting_flag(setting):
+    for flag, flag_setting, label in RUN_SPEC_ARGUMENTS:
+        if flag_setting == setting:
+            return flag
+    return setting
+
+
+def get_setting_label(setting):
+    for flag, flag_setting, label in RUN_SPEC_ARGUMENTS:
+        if flag_setting == setting:
+            return label
+    return setting
+
+
+def get_setting_prompt(setting, default=''):
+    # 'Label (default): ' for setting
+    prompt = get_setting_label(setting)
+    if default:
+        prompt += ' (' + default + ')'
+    return prompt + ': '
+
+
+def prompt_setting(run_settings, setting, prompt, default='', required=False, interactive=True):
+    # Return the run spec / flag value for setting, else ask for it (blank
+    # keeps default). Unattended runs use default, or fail for a required
+    # setting rather than block on input nobody will type. Values the
+    # defaults file does not allow are asked again, or raise ValueError when
+    # nobody can answer.
+    if setting in run_settings:
+        value = run_settings[setting]
+    elif not interactive:
+        if required and default == '':
+            raise ValueError(get_setting_flag(setting) + ' is required (in the run spec or on the command line)')
+        value = default
+    else:
+        while True:
+            value = input(prompt)
+            if value == '':
+                value = default
+            setting_problem = get_setting_problem(setting, value)
+            if setting_problem is None:
+                break
+            print(setting_problem)
+    setting_problem = get_setting_problem(setting, value)
+    if setting_problem is not None:
+        raise ValueError(setting_problem)
+    return value
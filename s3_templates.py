@@ -0,0 +1,236 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# Templates are small, so most uploads are a single PUT; larger files are
+# split into MULTIPART_CHUNKSIZE parts uploaded in parallel
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=MULTIPART_CHUNKSIZE, multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                 max_concurrency=4, use_threads=True)
+
+
+# Expire previous template versions in the versioned bucket after a year
+LIFECYCLE_RULE = {
+    'ID': 'DeletePreviousVersions',
+    'Filter': {'Prefix': ''},
+    'Status': 'Enabled',
+    'NoncurrentVersionExpiration': {
+        'NoncurrentDays': 365
+    }
+}
+
+
+def get_bucket_exists(s3, s3_bucket_name):
+    # Probe the bucket directly instead of scanning list_buckets. A 403 means
+    # the name is taken by a bucket this account cannot use.
+    try:
+        s3.head_bucket(Bucket=s3_bucket_name)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ['404', 'NoSuchBucket', 'NotFound']:
+            return False
+        if error_code in ['403', 'Forbidden', 'AccessDenied']:
+            raise ValueError('S3 bucket "' + s3_bucket_name + '" exists but is not accessible with these credentials')
+        raise
+    return True
+
+
+def get_bucket_versioning_changed(s3, s3_bucket_name):
+    return s3.get_bucket_versioning(Bucket=s3_bucket_name).get('Status') != 'Enabled'
+
+
+def get_bucket_lifecycle_rules(s3, s3_bucket_name):
+    try:
+        return s3.get_bucket_lifecycle_configuration(Bucket=s3_bucket_name)['Rules']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchLifecycleConfiguration':
+            return []
+        raise
+
+
+def get_lifecycle_rule_current(lifecycle_rules):
+    # True if the DeletePreviousVersions rule is already in place
+    for rule in lifecycle_rules:
+        if rule.get('ID') == LIFECYCLE_RULE['ID'] and rule.get('Status') == 'Enabled' and \
+                rule.get('NoncurrentVersionExpiration', {}).get('NoncurrentDays') == \
+                LIFECYCLE_RULE['NoncurrentVersionExpiration']['NoncurrentDays']:
+            return True
+    return False
+
+
+def setup_template_bucket(s3, s3_bucket_name, region, dry_run=False):
+    # Create the template bucket if needed and bring versioning and the
+    # lifecycle rule in line, only calling the put APIs whose configuration
+    # differs. The two checks (and the two updates) run in parallel. Returns
+    # the list of changes made, or that would be made with dry_run.
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        bucket_exists = get_bucket_exists(s3, s3_bucket_name)
+        if bucket_exists:
+            versioning_future = executor.submit(get_bucket_versioning_changed, s3, s3_bucket_name)
+            lifecycle_future = executor.submit(get_bucket_lifecycle_rules, s3, s3_bucket_name)
+            versioning_changed = versioning_future.result()
+            lifecycle_rules = lifecycle_future.result()
+        else:
+            versioning_changed = True
+            lifecycle_rules = []
+        lifecycle_changed = not get_lifecycle_rule_current(lifecycle_rules)
+
+        bucket_changes = []
+        if not bucket_exists:
+            bucket_changes.append('create_bucket')
+        if versioning_changed:
+            bucket_changes.append('put_bucket_versioning')
+        if lifecycle_changed:
+            bucket_changes.append('put_bucket_lifecycle_configuration')
+        if dry_run:
+            return bucket_changes
+
+        if not bucket_exists:
+            if region == 'us-east-1':
+                # us-east-1 rejects an explicit LocationConstraint
+                s3.create_bucket(Bucket=s3_bucket_name, ACL='private')
+            else:
+                s3.create_bucket(Bucket=s3_bucket_name, ACL='private',
+                                 CreateBucketConfiguration={'LocationConstraint': region})
+
+        futures = []
+        if versioning_changed:
+            futures.append(executor.submit(s3.put_bucket_versioning, Bucket=s3_bucket_name,
+                                           VersioningConfiguration={'Status': 'Enabled'}))
+        if lifecycle_changed:
+            # Keep any other rules already on the bucket
+            lifecycle_rules = [rule for rule in lifecycle_rules if rule.get('ID') != LIFECYCLE_RULE['ID']]
+            for rule in lifecycle_rules:
+                # Rules written by put_bucket_lifecycle use a top-level Prefix,
+                # which cannot be mixed with Filter rules
+                if 'Prefix' in rule and 'Filter' not in rule:
+                    rule['Filter'] = {'Prefix': rule.pop('Prefix')}
+            lifecycle_rules.append(LIFECYCLE_RULE)
+            futures.append(executor.submit(s3.put_bucket_lifecycle_configuration, Bucket=s3_bucket_name,
+                                           LifecycleConfiguration={'Rules': lifecycle_rules}))
+        for future in futures:
+            future.result()
+    finally:
+        executor.shutdown(wait=True)
+
+    return bucket_changes
+
+
+def get_file_etag(file_path, chunk_size=MULTIPART_CHUNKSIZE, multipart_threshold=MULTIPART_CHUNKSIZE):
+    # Return the ETag S3 gives the file when uploaded with TRANSFER_CONFIG:
+    # the MD5 of the body, or for multipart uploads the MD5 of the part MD5s
+    # followed by '-<part count>'. s3transfer uploads a file of
+    # multipart_threshold bytes or more in parts, so a file of exactly
+    # multipart_threshold bytes is one part with a '-1' ETag.
+    file_hash = hashlib.md5()
+    part_hashes = []
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+            part_hashes.append(hashlib.md5(chunk))
+
+    if os.path.getsize(file_path) < multipart_threshold:
+        return file_hash.hexdigest()
+    part_digests = b''.join([part_hash.digest() for part_hash in part_hashes])
+    return hashlib.md5(part_digests).hexdigest() + '-' + str(len(part_hashes))
+
+
+def get_bucket_etags(s3, s3_bucket_name, prefix):
+    # Return {key: ETag} for every object under prefix with one paginated
+    # listing instead of a head_object per file
+    bucket_etags = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket_name, Prefix=prefix):
+        for element in page.get('Contents', []):
+            bucket_etags[element['Key']] = element['ETag'].strip('"')
+    return bucket_etags
+
+
+def upload_templates(s3, s3_bucket_name, prefix, cf_directory, cf_templates_list, max_workers=10):
+    # Upload the templates to s3_bucket_name/prefix/ in parallel, skipping
+    # files whose content already matches the current object. Returns
+    # {'uploaded': [...], 'skipped': [...]}.
+    bucket_etags = get_bucket_etags(s3, s3_bucket_name, prefix + '/')
+
+    upload_list = []
+    skipped_list = []
+    for cf_file in cf_templates_list:
+        key = prefix + '/' + cf_file
+        file_etag = get_file_etag(os.path.join(cf_directory, cf_file), TRANSFER_CONFIG.multipart_chunksize,
+                                  TRANSFER_CONFIG.multipart_threshold)
+        if bucket_etags.get(key) == file_etag:
+            skipped_list.append(cf_file)
+        else:
+            upload_list.append(cf_file)
+
+    def upload_template(cf_file):
+        s3.upload_file(os.path.join(cf_directory, cf_file), s3_bucket_name, prefix + '/' + cf_file,
+                       Config=TRANSFER_CONFIG)
+
+    if upload_list:
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(upload_list)))
+        try:
+            list(executor.map(upload_template, upload_list))
+        finally:
+            executor.shutdown(wait=True)
+
+    return {'uploaded': upload_list, 'skipped': skipped_list}
+
+
+# delete_objects takes at most this many keys per call
+DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+def get_object_versions(s3, s3_bucket_name, prefix=''):
+    # Every object version and delete marker under prefix, as
+    # [{'Key': ..., 'VersionId': ...}], from one paginated listing
+    object_versions = []
+    paginator = s3.get_paginator('list_object_versions')
+    for page in paginator.paginate(Bucket=s3_bucket_name, Prefix=prefix):
+        for element in page.get('Versions', []) + page.get('DeleteMarkers', []):
+            object_versions.append({'Key': element['Key'], 'VersionId': element['VersionId']})
+    return object_versions
+
+
+def empty_template_bucket(s3, s3_bucket_name, prefix='', max_workers=4):
+    # Permanently delete every object version and delete marker under prefix,
+    # DELETE_OBJECTS_MAX_KEYS per delete_objects call, batches in parallel.
+    # Returns the number of versions deleted; raises RuntimeError if S3
+    # refused any of them.
+    object_versions = get_object_versions(s3, s3_bucket_name, prefix)
+    batches = [object_versions[position:position + DELETE_OBJECTS_MAX_KEYS]
+               for position in range(0, len(object_versions), DELETE_OBJECTS_MAX_KEYS)]
+
+    def delete_batch(batch):
+        return s3.delete_objects(Bucket=s3_bucket_name, Delete={'Objects': batch, 'Quiet': True}).get('Errors', [])
+
+    errors = []
+    if batches:
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(batches)))
+        try:
+            for batch_errors in executor.map(delete_batch, batches):
+                errors.extend(batch_errors)
+        finally:
+            executor.shutdown(wait=True)
+    if errors:
+        raise RuntimeError('Could not delete ' + str(len(errors)) + ' object version(s) from ' + s3_bucket_name +
+                           ', e.g. ' + errors[0]['Key'] + ': ' + errors[0].get('Message', errors[0].get('Code', '')))
+    return len(object_versions)
+
+
+def delete_template_bucket(s3, s3_bucket_name):
+    # Delete the bucket if nothing is left in it (other environments share
+    # it). Returns True if it was deleted.
+    if not get_bucket_exists(s3, s3_bucket_name) or get_object_versions(s3, s3_bucket_name):
+        return False
+    s3.delete_bucket(Bucket=s3_bucket_name)
+    return True
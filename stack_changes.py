@@ -0,0 +1,73 @@
+import hashlib
+import json
+import time
+
+from stack_waiter import get_backoff_delays
+
+
+# Change set failure reasons that only mean the stack is already up to date
+NO_CHANGES_REASONS = ["didn't contain changes", 'No updates are to be performed']
+# Longest wait for a change set to be computed, in seconds; CloudFormation
+# normally takes a few
+CHANGE_SET_WAIT_TIMEOUT = 10 * 60
+
+
+def get_deploy_hash(template_hash, parameters):
+    # Hash of what a stack was deployed from: template contents plus the
+    # resolved parameter values
+    deploy_hash = hashlib.sha256()
+    deploy_hash.update(template_hash.encode('utf-8'))
+    deploy_hash.update(json.dumps(sorted([(parameter['ParameterKey'], parameter['ParameterValue'])
+                                          for parameter in parameters])).encode('utf-8'))
+    return deploy_hash.hexdigest()
+
+
+def get_change_set_name(stack_name):
+    return stack_name + '-' + time.strftime('%Y%m%d%H%M%S')
+
+
+def wait_for_change_set(cf, stack_name, change_set_name, initial_delay=1, max_delay=10, timeout=None):
+    # Poll until the change set has been computed, or for at most timeout
+    # seconds (CHANGE_SET_WAIT_TIMEOUT); return its last description
+    if timeout is None:
+        timeout = CHANGE_SET_WAIT_TIMEOUT
+    start_time = time.time()
+    delays = get_backoff_delays(initial_delay, max_delay)
+    while True:
+        change_set = cf.describe_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        if change_set['Status'] in ['CREATE_COMPLETE', 'FAILED'] or time.time() - start_time >= timeout:
+            return change_set
+        time.sleep(next(delays))
+
+
+def update_stack(cf, stack_name, cf_template_url, parameters):
+    # Build a change set for an existing stack and execute it if it changes
+    # anything. Returns True if an update was started, False if the stack is
+    # already up to date (the empty change set is deleted). Raises
+    # RuntimeError if the change set failed or was not computed in time.
+    change_set_name = get_change_set_name(stack_name)
+    cf.create_change_set(
+        StackName=stack_name,
+        ChangeSetName=change_set_name,
+        ChangeSetType='UPDATE',
+        TemplateURL=cf_template_url,
+        Parameters=parameters,
+        Capabilities=[
+            'CAPABILITY_IAM',
+        ]
+    )
+    change_set = wait_for_change_set(cf, stack_name, change_set_name)
+    if change_set['Status'] not in ['CREATE_COMPLETE', 'FAILED']:
+        cf.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        raise RuntimeError(stack_name + ' change set was still ' + change_set['Status'] + ' after ' +
+                           str(CHANGE_SET_WAIT_TIMEOUT) + ' seconds')
+    if change_set['Status'] == 'FAILED':
+        reason = change_set.get('StatusReason', '')
+        cf.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        for no_changes_reason in NO_CHANGES_REASONS:
+            if no_changes_reason in reason:
+                return False
+        raise RuntimeError(stack_name + ' change set failed: ' + reason)
+
+    cf.execute_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+    return True
@@ -0,0 +1,134 @@
+import json
+import sys
+import threading
+
+from botocore.exceptions import ClientError
+
+from stack_waiter import get_backoff_delays, get_stack_events
+
+
+# Serializes event output from every tailer, so lines never interleave
+output_lock = threading.Lock()
+
+
+def format_stack_event(event, label=None):
+    # One console line for a stack event
+    timestamp = event['Timestamp']
+    if hasattr(timestamp, 'strftime'):
+        timestamp = timestamp.strftime('%H:%M:%S')
+    line = str(timestamp) + ' '
+    if label:
+        line += label + ' '
+    line += event['StackName'] + ' ' + event['LogicalResourceId'] + ' ' + event['ResourceStatus']
+    if event.get('ResourceStatusReason'):
+        line += ' - ' + event['ResourceStatusReason']
+    return line
+
+
+def get_stack_event_record(event, label=None):
+    # JSON-serializable copy of a stack event for the JSON-lines stream
+    record = dict([(key, event[key]) for key in ['EventId', 'StackName', 'LogicalResourceId', 'PhysicalResourceId',
+                                                 'ResourceType', 'ResourceStatus', 'ResourceStatusReason']
+                   if key in event])
+    record['Timestamp'] = str(event['Timestamp'])
+    if label:
+        record['Label'] = label
+    return record
+
+
+class StackEventTailer(object):
+    # Follows describe_stack_events for every in-flight stack from one
+    # background thread and writes each new event once, to the console and/or
+    # a JSON-lines file. A tick reads only the events newer than the last one
+    # seen - one call per followed stack, the full history is never re-read.
+
+    def __init__(self, cf, console=True, json_file=None, label=None, initial_delay=None, max_delay=None):
+        self.cf = cf
+        self.console = console
+        self.json_file = json_file
+        self.label = label
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        # Only one read per stack at a time, so no event is written twice
+        self.read_lock = threading.Lock()
+        self.followed = {}
+        self.thread = None
+
+    def get_latest_event_id(self, stack_name):
+        # Newest existing event of the stack, None if it does not exist yet
+        try:
+            stack_events = self.cf.describe_stack_events(StackName=stack_name)['StackEvents']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationError':
+                return None
+            raise
+        if not stack_events:
+            return None
+        return stack_events[0]['EventId']
+
+    def follow(self, stack_name):
+        # Start tailing stack_name; call before starting the operation so
+        # only its events are written
+        last_event_id = self.get_latest_event_id(stack_name)
+        with self.condition:
+            self.followed[stack_name] = last_event_id
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            else:
+                self.condition.notify_all()
+
+    def unfollow(self, stack_name):
+        # Write the stack's remaining events and stop tailing it
+        self.read_stack(stack_name)
+        with self.condition:
+            self.followed.pop(stack_name, None)
+
+    def read_stack(self, stack_name):
+        # Write the stack's new events, return how many there were
+        with self.read_lock:
+            with self.condition:
+                if stack_name not in self.followed:
+                    return 0
+                last_event_id = self.followed[stack_name]
+            try:
+                stack_events = get_stack_events(self.cf, stack_name, last_event_id)
+            except ClientError:
+                # Throttled or gone; the next tick tries again
+                return 0
+            if stack_events:
+                with self.condition:
+                    self.followed[stack_name] = stack_events[-1]['EventId']
+                self.write_events(stack_events)
+            return len(stack_events)
+
+    def write_events(self, stack_events):
+        with output_lock:
+            for event in stack_events:
+                if self.console:
+                    print(format_stack_event(event, self.label))
+                if self.json_file is not None:
+                    self.json_file.write(json.dumps(get_stack_event_record(event, self.label)) + '\n')
+            if self.console:
+                sys.stdout.flush()
+            if self.json_file is not None:
+                self.json_file.flush()
+
+    def run(self):
+        delays = get_backoff_delays(self.initial_delay, self.max_delay)
+        while True:
+            with self.condition:
+                if not self.followed:
+                    self.thread = None
+                    return
+                stack_names = sorted(self.followed)
+            event_count = 0
+            for stack_name in stack_names:
+                event_count += self.read_stack(stack_name)
+            # New events mean the stacks are busy - keep polling quickly
+            if event_count:
+                delays = get_backoff_delays(self.initial_delay, self.max_delay)
+            with self.condition:
+                self.condition.wait(next(delays))
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from defaults_model import DEFAULTS_FILE, get_defaults_model
+from instrumentation import trace_phase
+from template_analyzer import analyze_template_directory, get_template_dependencies
+
+
+def get_stack_dependencies(defaults_file=DEFAULTS_FILE):
+    # Build {stack key: set(upstream stack keys)} from the 'X = Stack:Output'
+    # references in the defaults file
+    return get_defaults_model(defaults_file).get_stack_dependencies()
+
+
+def get_template_stack_dependencies(cf_directory, stack_templates, stack_names=None):
+    # Build {stack key: set(upstream stack keys)} from the Fn::ImportValue /
+    # Export pairs in the local templates. stack_templates maps stack key ->
+    # template file name, stack_names stack key -> the stack name
+    # ${AWS::StackName} stands for in its template.
+    template_stacks = {}
+    template_substitutions = {}
+    for key in stack_templates:
+        template_stacks[stack_templates[key]] = key
+        if stack_names is not None and key in stack_names:
+            template_substitutions[stack_templates[key]] = {'AWS::StackName': stack_names[key]}
+    template_analyses = analyze_template_directory(cf_directory, list(template_stacks))
+    template_dependencies = get_template_dependencies(template_analyses, template_substitutions)
+
+    stack_dependencies = {}
+    for cf_template in template_dependencies:
+        stack_dependencies[template_stacks[cf_template]] = set(
+            [template_stacks[upstream] for upstream in template_dependencies[cf_template]])
+    return stack_dependencies
+
+
+def merge_stack_dependencies(*stack_dependencies_list):
+    # Union several {stack key: set(upstream stack keys)} dicts
+    merged_dependencies = {}
+    for stack_dependencies in stack_dependencies_list:
+        for key in stack_dependencies:
+            merged_dependencies.setdefault(key, set()).update(stack_dependencies[key])
+    return merged_dependencies
+
+
+def reverse_stack_dependencies(stack_dependencies):
+    # {stack key: set(downstream stack keys)} - the order stacks can be
+    # deleted in, every stack only after the stacks that use it
+    reversed_dependencies = {}
+    for key in stack_dependencies:
+        reversed_dependencies.setdefault(key, set())
+        for upstream in stack_dependencies[key]:
+            reversed_dependencies.setdefault(upstream, set()).add(key)
+    return reversed_dependencies
+
+
+def get_stack_order(stack_keys, stack_dependencies):
+    # Return the stacks grouped into levels; every stack in a level only
+    # depends on stacks in earlier levels. Dependencies on stacks that are not
+    # part of this run are assumed to already be deployed.
+    remaining = {}
+    for key in stack_keys:
+        remaining[key] = set(stack_dependencies.get(key, set())) & set(stack_keys)
+
+    stack_order = []
+    while remaining:
+        level = sorted([key for key in remaining if not remaining[key]])
+        if not level:
+            raise ValueError('Circular stack dependency: ' + ', '.join(sorted(remaining)))
+        for key in level:
+            del remaining[key]
+        for key in remaining:
+            remaining[key] -= set(level)
+        stack_order.append(level)
+
+    return stack_order
+
+
+def deploy_stack_graph(stack_deploy_dict, stack_dependencies):
+    # Run every stack deploy function as soon as the stacks it depends on have
+    # finished, so independent stacks build at the same time.
+    # stack_deploy_dict maps stack key -> function(stack_results) where
+    # stack_results holds the return value of every completed stack. Returns
+    # (stack_results, stack_failures); stacks downstream of a failure are
+    # skipped and recorded as failures.
+    stack_keys = list(stack_deploy_dict)
+    # Validates the graph before anything is submitted
+    get_stack_order(stack_keys, stack_dependencies)
+
+    pending = {}
+    for key in stack_keys:
+        pending[key] = set(stack_dependencies.get(key, set())) & set(stack_keys)
+
+    def deploy_stack(key, stack_results):
+        with trace_phase('stack ' + key):
+            return stack_deploy_dict[key](stack_results)
+
+    stack_results = {}
+    stack_failures = {}
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max(len(stack_keys), 1))
+    try:
+        while pending or running:
+            for key in sorted(pending):
+                failed = pending[key] & set(stack_failures)
+                if failed:
+                    stack_failures[key] = 'Skipped, depends on failed stack ' + ', '.join(sorted(failed))
+                    del pending[key]
+                elif not pending[key] - set(stack_results):
+                    future = executor.submit(deploy_stack, key, dict(stack_results))
+                    running[future] = key
+                    del pending[key]
+
+            if not running:
+                continue
+
+            done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    stack_results[key] = future.result()
+                except Exception as e:
+                    stack_failures[key] = str(e)
+    finally:
+        executor.shutdown(wait=True)
+
+    return stack_results, stack_failures
@@ -0,0 +1,241 @@
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from api_governor import get_error_class, get_retry_delay
+from stack_waiter import STACK_SUCCESS_STATUSES, get_backoff_delays, get_stack_terminal, get_stack_failure_event
+
+
+# Attempts at one listing before the waiters it covers get its error
+POLL_MAX_ATTEMPTS = 5
+
+
+def get_exception_error_class(error):
+    # api_governor.get_error_class for a raised exception
+    if isinstance(error, ClientError):
+        return get_error_class(error.response.get('Error', {}).get('Code'),
+                               error.response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
+    return get_error_class(caught_exception=error)
+
+
+def get_stack_listing(cf, use_list_stacks=False, stacks=None):
+    # Return {stack name: stack} for every stack in the region, from one
+    # paginated describe_stacks (or list_stacks) pass. The stacks of the
+    # pages read before an error are left in stacks, when given.
+    if stacks is None:
+        stacks = {}
+    if use_list_stacks:
+        paginator = cf.get_paginator('list_stacks')
+        for page in paginator.paginate():
+            for stack in page['StackSummaries']:
+                # Deleted stacks keep their name; prefer the live one
+                current = stacks.get(stack['StackName'])
+                if current is None or current['StackStatus'] == 'DELETE_COMPLETE':
+                    stacks[stack['StackName']] = stack
+    else:
+        paginator = cf.get_paginator('describe_stacks')
+        for page in paginator.paginate():
+            for stack in page['Stacks']:
+                stacks[stack['StackName']] = stack
+    return stacks
+
+
+class StackPoller(object):
+    # One background poller shared by every stack being waited on. Each tick
+    # makes a single paginated describe_stacks (or list_stacks) pass for the
+    # whole region and hands each watched stack its status, instead of every
+    # waiter calling describe_stacks for its own stack. Listings are numbered
+    # as they start, and a listing's results only go to the stacks watched
+    # before it started, so a stack submitted during a listing never gets the
+    # status from before its submission. A listing that fails with a
+    # throttling or transient error is retried; once it fails for good, only
+    # the waiters it was polling for get the error.
+
+    def __init__(self, cf, use_list_stacks=False, initial_delay=None, max_delay=None,
+                 max_attempts=POLL_MAX_ATTEMPTS):
+        self.cf = cf
+        self.use_list_stacks = use_list_stacks
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+        self.watched = {}
+        self.stacks = {}
+        self.thread = None
+        # Listings started so far
+        self.poll_count = 0
+
+    def watch(self, stack_name, missing_status=None):
+        # Start tracking stack_name and return the waiter to pass to
+        # unwatch. missing_status is reported once the stack is not in the
+        # listing (e.g. 'DELETE_COMPLETE'); it is only given for stacks known
+        # to exist when the wait starts, which may be gone before the first
+        # poll.
+        waiter = {'error': None}
+        with self.condition:
+            if stack_name not in self.watched:
+                # Only listings numbered above sequence started after this
+                # watch, so only they report the stack's status
+                self.watched[stack_name] = {'waiters': [], 'seen': missing_status is not None,
+                                            'missing_status': missing_status, 'sequence': self.poll_count}
+                # Drop any status left over from an earlier operation
+                self.stacks.pop(stack_name, None)
+            self.watched[stack_name]['waiters'].append(waiter)
+            if self.thread is None:
+                self.start()
+            else:
+                self.condition.notify_all()
+        return waiter
+
+    def start(self):
+        # Start polling; called with the condition held
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def unwatch(self, stack_name, waiter):
+        with self.condition:
+            if stack_name in self.watched and waiter in self.watched[stack_name]['waiters']:
+                self.watched[stack_name]['waiters'].remove(waiter)
+                if not self.watched[stack_name]['waiters']:
+                    del self.watched[stack_name]
+
+    def get_stack(self, stack_name):
+        # Latest stack description (or list_stacks summary) seen by the poller
+        with self.condition:
+            return self.stacks.get(stack_name)
+
+    def get_stack_listing(self, stacks):
+        return get_stack_listing(self.cf, self.use_list_stacks, stacks)
+
+    def get_waiters(self):
+        # {stack name: [waiter]} for every waiter registered now
+        with self.condition:
+            return dict([(stack_name, list(self.watched[stack_name]['waiters'])) for stack_name in self.watched])
+
+    def start_poll(self):
+        # Number the listing about to start
+        with self.condition:
+            self.poll_count += 1
+            return self.poll_count
+
+    def get_listed_watches(self, sequence):
+        # The watched stacks listing sequence was started for; called with
+        # the condition held
+        return [stack_name for stack_name in self.watched if self.watched[stack_name]['sequence'] < sequence]
+
+    def poll(self, stacks=None, sequence=None):
+        # Refresh the stacks watched before the listing started with one
+        # listing, return True if any of them changed status. If the listing
+        # fails, the stacks of the pages already read are refreshed (and left
+        # in stacks) before the error is raised.
+        if stacks is None:
+            stacks = {}
+        if sequence is None:
+            sequence = self.start_poll()
+        error = None
+        try:
+            self.get_stack_listing(stacks)
+        except Exception as e:
+            error = e
+        changed = False
+        with self.condition:
+            for stack_name in self.get_listed_watches(sequence):
+                watch = self.watched[stack_name]
+                previous = self.stacks.get(stack_name)
+                if stack_name in stacks:
+                    watch['seen'] = True
+                    self.stacks[stack_name] = stacks[stack_name]
+                elif error is None and watch['seen'] and watch['missing_status'] is not None:
+                    self.stacks[stack_name] = {'StackName': stack_name, 'StackStatus': watch['missing_status']}
+                current = self.stacks.get(stack_name)
+                if current is not None and (previous is None or
+                                            previous['StackStatus'] != current['StackStatus']):
+                    changed = True
+            self.condition.notify_all()
+        if error is not None:
+            raise error
+        return changed
+
+    def fail_waiters(self, error, listed_stacks, sequence):
+        # Hand error to the waiters failed listing sequence was polling for,
+        # except those of stacks it had already listed
+        with self.condition:
+            for stack_name in self.get_listed_watches(sequence):
+                if stack_name not in listed_stacks:
+                    for waiter in self.watched[stack_name]['waiters']:
+                        waiter['error'] = error
+            self.condition.notify_all()
+
+    def get_poll_retry_delay(self, error, attempts):
+        # Seconds to wait before retrying a failed listing, None once it has
+        # failed for good
+        error_class = get_exception_error_class(error)
+        if error_class is None or attempts >= self.max_attempts:
+            return None
+        return get_retry_delay(attempts, error_class)
+
+    def run(self):
+        delays = get_backoff_delays(self.initial_delay, self.max_delay)
+        attempts = 0
+        while True:
+            with self.condition:
+                if not self.watched:
+                    self.thread = None
+                    return
+            listed_stacks = {}
+            sequence = self.start_poll()
+            try:
+                if self.poll(listed_stacks, sequence):
+                    delays = get_backoff_delays(self.initial_delay, self.max_delay)
+                attempts = 0
+            except Exception as e:
+                attempts += 1
+                retry_delay = self.get_poll_retry_delay(e, attempts)
+                if retry_delay is not None:
+                    time.sleep(retry_delay)
+                    continue
+                attempts = 0
+                self.fail_waiters(e, listed_stacks, sequence)
+            with self.condition:
+                self.condition.wait(next(delays))
+
+    def wait(self, stack_name, success_statuses=None, timeout=None, missing_status=None):
+        # Block until the poller reports a final status for stack_name.
+        # Returns the same result dict as stack_waiter.wait_for_stack.
+        # Raises the listing's error if it failed for good while waiting.
+        if success_statuses is None:
+            success_statuses = STACK_SUCCESS_STATUSES
+
+        start_time = time.time()
+        waiter = self.watch(stack_name, missing_status)
+        timed_out = False
+        try:
+            with self.condition:
+                while True:
+                    if waiter['error'] is not None:
+                        raise waiter['error']
+                    stack = self.stacks.get(stack_name)
+                    if stack is not None and get_stack_terminal(stack['StackStatus']):
+                        stack_status = stack['StackStatus']
+                        break
+                    if timeout is not None and time.time() - start_time > timeout:
+                        timed_out = True
+                        stack_status = stack['StackStatus'] if stack is not None else 'UNKNOWN'
+                        break
+                    self.condition.wait(1)
+        finally:
+            self.unwatch(stack_name, waiter)
+        return self.get_wait_result(stack_name, stack_status, success_statuses, timed_out, missing_status)
+
+    def get_wait_result(self, stack_name, stack_status, success_statuses, timed_out=False, missing_status=None):
+        # The wait_for_stack result dict for a finished wait, with the failing
+        # resource event of a failed stack
+        stack_failed = timed_out or stack_status not in success_statuses
+        failure_event = None
+        if stack_failed and not timed_out and stack_status != missing_status:
+            failure_event = get_stack_failure_event(self.cf, stack_name)
+
+        return {'StackName': stack_name, 'StackStatus': stack_status, 'Failed': stack_failed,
+                'TimedOut': timed_out, 'FailureEvent': failure_event}
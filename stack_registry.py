@@ -0,0 +1,360 @@
+import os
+
+from botocore.exceptions import ClientError
+
+from defaults_model import get_defaults_model, parse_condition
+from exports_resolver import get_exports_resolver, get_export_name
+from stack_changes import get_deploy_hash, update_stack
+from stack_waiter import STACK_STABLE_STATUSES, format_stack_failure
+from state_store import get_state_store, list_stack_resources
+from run_spec import get_spec_setting
+from subnet_plan import get_subnet_plan
+from template_cache import get_template_hash
+
+
+# Every default stack as data: the name it is deployed under (after the
+# stack prefix), its template, and where each parameter value comes from.
+# A parameter source is a setting name ('cidr'), an upstream stack output
+# ('BaseNetwork:VPCID', resolved through the region's exports), a
+# {'outputs': function(settings)} returning a list of stack outputs for a
+# comma separated list parameter, or a function(settings, stack_results) for
+# values that are computed. Stacks referenced by a source are dependencies.
+# Parameters the defaults file maps directly come from its stack section;
+# an entry here only adds the stack name, template and computed values.
+STACK_REGISTRY = {}
+# Registry keys in registration order, for printing
+STACK_REGISTRY_KEYS = []
+
+
+def get_az_count_parameter(settings, stack_results):
+    if settings['az_count'] == '3':
+        return '3 AZs :: 6 Subnets'
+    return '2 AZs :: 4 Subnets'
+
+
+def get_subnet_parameter(subnet_name):
+    def get_subnet(settings, stack_results):
+        return get_subnet_plan(settings['cidr'])[subnet_name]
+    return get_subnet
+
+
+def get_sns_topic_name_parameter(settings, stack_results):
+    return settings['raw_sns_topic_name'].replace(' ', '-').lower()
+
+
+def get_export_applies(defaults_section, export, settings):
+    # Whether an export's '(if Name = value)' condition holds for settings;
+    # exports without one, or with any other condition, always apply
+    condition = parse_condition(export.condition)
+    if condition is None:
+        return True
+    setting = get_spec_setting(defaults_section.name, condition[0])
+    return setting is None or str(settings.get(setting)) == condition[1]
+
+
+def get_defaults_outputs_source(defaults_model, references):
+    # {'outputs': function(settings)} for a list of 'Stack:Output'
+    # references, leaving out exports whose condition does not hold
+    def get_outputs(settings):
+        outputs = []
+        for reference_key, reference_name in references:
+            reference_section = defaults_model.get_section(reference_key)
+            if get_export_applies(reference_section, reference_section.get_export(reference_name), settings):
+                outputs.append(reference_section.key + ':' + reference_name)
+        return outputs
+    return {'outputs': get_outputs}
+
+
+def get_defaults_parameter_sources(key, defaults_model):
+    # [(ParameterKey, source)] for the parameters of the defaults file stack
+    # section key: a value given by a setting, a 'Stack:Output' reference,
+    # or a list of them. Computed values have no source here. Raises
+    # ValueError for a reference to an output its stack does not export.
+    section = defaults_model.get_section(key)
+    if section is None or not section.stack:
+        return []
+    parameter_sources = []
+    for parameter in section.parameters:
+        source = None
+        stack_references = []
+        for reference_key, reference_name in parameter.references:
+            reference_section = defaults_model.get_section(reference_key)
+            if reference_section is None:
+                raise ValueError(section.name + ' ' + parameter.name + ' references unknown section ' +
+                                 reference_key)
+            if reference_section.stack:
+                if reference_section.get_export(reference_name) is None:
+                    raise ValueError(section.name + ' ' + parameter.name + ' references ' + reference_key + ':' +
+                                     reference_name + ', which ' + reference_section.name + ' does not export')
+                stack_references.append((reference_section.key, reference_name))
+        if not parameter.references:
+            source = get_spec_setting(section.name, parameter.name)
+        elif len(parameter.references) == 1 and stack_references:
+            source = stack_references[0][0] + ':' + stack_references[0][1]
+        elif len(parameter.references) == 1:
+            reference_key, reference_name = parameter.references[0]
+            source = get_spec_setting(defaults_model.get_section(reference_key).name, reference_name)
+        elif len(stack_references) == len(parameter.references):
+            source = get_defaults_outputs_source(defaults_model, stack_references)
+        if source is not None:
+            parameter_sources.append((parameter.name, source))
+    return parameter_sources
+
+
+def register_stack(key, stack_name, cf_template, parameters=None, depends_on=None):
+    # parameters is a list of (ParameterKey, source), in submission order,
+    # added to (or replacing) the sources the defaults file gives the stack.
+    # depends_on adds dependencies that are not visible in the sources.
+    parameters = parameters or []
+    parameter_keys = [parameter_key for parameter_key, source in parameters]
+    parameters = [(parameter_key, source)
+                  for parameter_key, source in get_defaults_parameter_sources(key, get_defaults_model())
+                  if parameter_key not in parameter_keys] + parameters
+    dependencies = set(depends_on or [])
+    for parameter_key, source in parameters:
+        if isinstance(source, str) and ':' in source:
+            dependencies.add(source.split(':', 1)[0])
+    if key not in STACK_REGISTRY:
+        STACK_REGISTRY_KEYS.append(key)
+    STACK_REGISTRY[key] = {'stack_name': stack_name, 'cf_template': cf_template, 'parameters': parameters,
+                           'dependencies': dependencies}
+
+
+register_stack('BaseNetwork', 'BaseNetwork', 'base_network.template', [
+    ('AvailabilityZoneCount', get_az_count_parameter),
+    ('PublicSubnetAZ1', get_subnet_parameter('PublicSubnetAZ1')),
+    ('PublicSubnetAZ2', get_subnet_parameter('PublicSubnetAZ2')),
+    ('PublicSubnetAZ3', get_subnet_parameter('PublicSubnetAZ3')),
+    ('PrivateSubnetAZ1', get_subnet_parameter('PrivateSubnetAZ1')),
+    ('PrivateSubnetAZ2', get_subnet_parameter('PrivateSubnetAZ2')),
+    ('PrivateSubnetAZ3', get_subnet_parameter('PrivateSubnetAZ3'))
+])
+
+register_stack('S3VPCEndpoint', 'S3-VPC-Endpoint', 's3_vpc.template')
+
+register_stack('Route53InternalZone', 'Route53-InternalZone', 'route53_internalzone.template')
+
+register_stack('SNSTopicSubscriptions', 'SNS-Topic-Subscriptions', 'sns_topic_subscriptions.template', [
+    ('DisplayName', get_sns_topic_name_parameter)
+])
+
+
+def get_registry_stack_name(key, stack_prefix, registry=STACK_REGISTRY):
+    return stack_prefix + '-' + registry[key]['stack_name']
+
+
+def get_registry_templates(registry=STACK_REGISTRY):
+    # {stack key: template}
+    return dict([(key, registry[key]['cf_template']) for key in registry])
+
+
+def get_registry_stack_names(stack_prefix, registry=STACK_REGISTRY):
+    # {stack key: stack name}
+    return dict([(key, get_registry_stack_name(key, stack_prefix, registry)) for key in registry])
+
+
+def get_registry_dependencies(registry=STACK_REGISTRY):
+    return dict([(key, set(registry[key]['dependencies'])) for key in registry])
+
+
+def get_source_outputs(source, settings):
+    # The 'Stack:Output' references of a parameter source, or None if the
+    # source is not a stack output
+    if isinstance(source, dict):
+        return source['outputs'](settings)
+    if isinstance(source, str) and ':' in source:
+        return [source]
+    return None
+
+
+def get_parameter_exports(key, settings, registry=STACK_REGISTRY):
+    # {parameter: export name, or a list of export names for a list
+    # parameter} for every parameter the stack takes from an upstream output
+    parameter_exports = {}
+    for parameter_key, source in registry[key]['parameters']:
+        source_outputs = get_source_outputs(source, settings)
+        if source_outputs is None:
+            continue
+        export_names = []
+        for source_output in source_outputs:
+            stack_key, output_key = source_output.split(':', 1)
+            export_names.append(get_export_name(get_registry_stack_name(stack_key, settings['stack_prefix'],
+                                                                        registry), output_key))
+        parameter_exports[parameter_key] = export_names if isinstance(source, dict) else export_names[0]
+    return parameter_exports
+
+
+def get_import_templates(settings, registry=STACK_REGISTRY):
+    # {template: get_parameter_exports} for every registry stack that takes
+    # upstream outputs, for exports_resolver.write_import_templates
+    import_templates = {}
+    for key in registry:
+        parameter_exports = get_parameter_exports(key, settings, registry)
+        if parameter_exports:
+            import_templates[registry[key]['cf_template']] = parameter_exports
+    return import_templates
+
+
+def get_stack_parameters(key, settings, stack_results, registry=STACK_REGISTRY, exports_resolver=None):
+    # Resolve the registry parameter sources into create_stack Parameters.
+    # Upstream outputs are looked up through exports_resolver; with
+    # settings['use_imports'] they are left out, the uploaded template
+    # imports them itself.
+    parameters = []
+    for parameter_key, source in registry[key]['parameters']:
+        source_outputs = get_source_outputs(source, settings)
+        if source_outputs is not None:
+            if settings.get('use_imports'):
+                continue
+            values = []
+            for source_output in source_outputs:
+                stack_key, output_key = source_output.split(':', 1)
+                values.append(exports_resolver.resolve(
+                    get_registry_stack_name(stack_key, settings['stack_prefix'], registry), output_key))
+            value = ','.join(values)
+        elif callable(source):
+            value = source(settings, stack_results)
+        else:
+            value = settings[source]
+        parameters.append({'ParameterKey': parameter_key, 'ParameterValue': value})
+    return parameters
+
+
+def get_stack_status(cf, stack_name):
+    # Status of the stack, None if it does not exist. Only "does not exist"
+    # means not deployed; throttling and other errors are raised.
+    try:
+        stack = cf.describe_stacks(StackName=stack_name)['Stacks'][0]
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ValidationError' or 'does not exist' not in e.response['Error']['Message']:
+            raise
+        return None
+    return stack['StackStatus']
+
+
+def get_stack_deployed(cf, stack_name):
+    # Determine if stack is deployed, return value
+    return get_stack_status(cf, stack_name) is not None
+
+
+def get_stack_resources(cf, stack_name):
+    # {logical id: physical id} for every resource, across all pages
+    stack_resources = {}
+    for element in list_stack_resources(cf, stack_name):
+        stack_resources[element['LogicalResourceId']] = element['PhysicalResourceId']
+
+    return stack_resources
+
+
+def submit_stack(cf, stack_name, cf_template_url, parameters, incremental=False):
+    # The single submission path every default stack goes through. Creates a
+    # missing stack; an existing stack is updated through a change set with
+    # incremental, otherwise left as it is. A stack with an operation still
+    # in progress (from an interrupted run) is only waited on. Returns True if
+    # an operation was started or is running, without waiting for it.
+    stack_status = get_stack_status(cf, stack_name)
+    if stack_status is None:
+        cf.create_stack(
+            StackName=stack_name,
+            TemplateURL=cf_template_url,
+            Parameters=parameters,
+            TimeoutInMinutes=30,
+            Capabilities=[
+                'CAPABILITY_IAM',
+            ],
+            OnFailure='ROLLBACK'
+        )
+        return True
+    if stack_status.endswith('_IN_PROGRESS'):
+        return True
+    if incremental:
+        return update_stack(cf, stack_name, cf_template_url, parameters)
+    return False
+
+
+def get_template_path(key, settings, registry=STACK_REGISTRY):
+    # Local template file of the stack, None when it is not available
+    if not settings.get('cf_directory'):
+        return None
+    template_path = os.path.join(settings['cf_directory'], registry[key]['cf_template'])
+    if not os.path.isfile(template_path):
+        return None
+    return template_path
+
+
+def get_import_parameters(key, settings, registry=STACK_REGISTRY):
+    # The imports a rewritten template makes, as parameters, so they are part
+    # of the stack's deploy hash
+    parameter_exports = get_parameter_exports(key, settings, registry)
+    parameters = []
+    for parameter_key in sorted(parameter_exports):
+        export_names = parameter_exports[parameter_key]
+        if isinstance(export_names, list):
+            export_names = ','.join(export_names)
+        parameters.append({'ParameterKey': 'Fn::ImportValue:' + parameter_key, 'ParameterValue': export_names})
+    return parameters
+
+
+def prepare_registry_stack(cf, bucket_url, key, settings, stack_results, registry=STACK_REGISTRY, state_store=None):
+    # Resolve everything needed to submit one registry stack: its name,
+    # template URL, parameters and hashes. Upstream outputs resolve through
+    # the region's cached exports, falling back to the outputs in the state
+    # store. 'Skip' holds the stored result when settings['incremental'] and
+    # the stack's template and parameters hash the same as its last
+    # successful deployment.
+    if state_store is None:
+        state_store = get_state_store()
+    stack_name = get_registry_stack_name(key, settings['stack_prefix'], registry)
+    exports_resolver = get_exports_resolver(cf, state_store, settings['ddi'], settings['region'])
+    parameters = get_stack_parameters(key, settings, stack_results, registry, exports_resolver)
+    template_path = get_template_path(key, settings, registry)
+    template_hash = None
+    deploy_hash = None
+    if template_path is not None:
+        template_hash = get_template_hash(template_path)
+        hash_parameters = parameters
+        if settings.get('use_imports'):
+            hash_parameters = parameters + get_import_parameters(key, settings, registry)
+        deploy_hash = get_deploy_hash(template_hash, hash_parameters)
+
+    skip = None
+    if settings.get('incremental', False) and deploy_hash is not None:
+        stored_stack = state_store.get_stack(settings['ddi'], settings['region'], stack_name)
+        if stored_stack is not None and stored_stack['DeployHash'] == deploy_hash and \
+                stored_stack['StackStatus'] in STACK_STABLE_STATUSES:
+            skip = (stack_name, stored_stack['Resources'])
+    return {'StackName': stack_name, 'TemplateURL': bucket_url + '/' + registry[key]['cf_template'],
+            'Parameters': parameters, 'TemplateHash': template_hash, 'DeployHash': deploy_hash, 'Skip': skip}
+
+
+def record_registry_stack(cf, prepared_stack, settings, stack_started, stack_wait_result, stack=None,
+                          state_store=None):
+    # Record a submitted stack once it is final and return (stack name,
+    # {logical id: physical id}). Raises RuntimeError describing the failing
+    # resource if the stack failed. stack is its description, if the waiter
+    # already has it.
+    if state_store is None:
+        state_store = get_state_store()
+    account = settings['ddi']
+    region = settings['region']
+    stack_name = prepared_stack['StackName']
+    if stack is None:
+        stack = cf.describe_stacks(StackName=stack_name)['Stacks'][0]
+    if stack_started:
+        # The stack's exports may have changed
+        get_exports_resolver(cf, state_store, account, region).invalidate()
+    if stack_wait_result['Failed']:
+        state_store.record_stack(account, region, stack)
+        raise RuntimeError(format_stack_failure(stack_wait_result))
+    resource_summaries = list_stack_resources(cf, stack_name)
+
+    # Record what the stack now runs. The hashes of an existing stack left
+    # untouched are unknown, so the stored ones are kept.
+    template_hash = prepared_stack['TemplateHash']
+    deploy_hash = prepared_stack['DeployHash']
+    if not (stack_started or settings.get('incremental', False)):
+        template_hash = None
+        deploy_hash = None
+    state_store.record_stack(account, region, stack, resource_summaries, template_hash, deploy_hash)
+    return stack_name, dict([(resource['LogicalResourceId'], resource['PhysicalResourceId'])
+                             for resource in resource_summaries])
@@ -0,0 +1,146 @@
+import random
+import time
+
+
+STACK_SUCCESS_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE']
+# A stack whose last update rolled back still runs its previous template,
+# so one this run did not touch is as usable as a successful one
+STACK_STABLE_STATUSES = STACK_SUCCESS_STATUSES + ['UPDATE_ROLLBACK_COMPLETE']
+
+# Default first and longest poll interval, in seconds
+POLL_INITIAL_DELAY = 2
+POLL_MAX_DELAY = 30
+# Event polls without a new event before the status is read from
+# describe_stacks instead
+EMPTY_EVENT_POLLS_MAX = 5
+
+
+def get_stack_terminal(stack_status):
+    # Every CloudFormation stack status that is not *_IN_PROGRESS is final
+    return not stack_status.endswith('_IN_PROGRESS')
+
+
+def get_backoff_delays(initial_delay=None, max_delay=None, factor=2):
+    # Yield jittered, exponentially growing poll intervals, starting short so
+    # a stack that finishes quickly is noticed quickly
+    if initial_delay is None:
+        initial_delay = POLL_INITIAL_DELAY
+    if max_delay is None:
+        max_delay = POLL_MAX_DELAY
+    delay = initial_delay
+    while True:
+        yield random.uniform(delay / 2.0, delay)
+        delay = min(delay * factor, max_delay)
+
+
+def get_stack_events(cf, stack_name, last_event_id=None):
+    # Return the events newer than last_event_id, oldest first. Only the
+    # first page is read unless last_event_id is further back than that.
+    stack_events = []
+    kwargs = {'StackName': stack_name}
+    while True:
+        page = cf.describe_stack_events(**kwargs)
+        for event in page['StackEvents']:
+            if event['EventId'] == last_event_id:
+                stack_events.reverse()
+                return stack_events
+            stack_events.append(event)
+        if last_event_id is None or 'NextToken' not in page:
+            break
+        kwargs['NextToken'] = page['NextToken']
+    stack_events.reverse()
+    return stack_events
+
+
+def get_events_stack_status(stack_name, stack_events, stack_status):
+    # The status of the newest stack-level event in stack_events (oldest
+    # first), else stack_status
+    for event in stack_events:
+        if event['LogicalResourceId'] == stack_name and event['ResourceType'] == 'AWS::CloudFormation::Stack':
+            stack_status = event['ResourceStatus']
+    return stack_status
+
+
+def get_stack_failure_event(cf, stack_name):
+    # Return the first resource failure of the latest stack operation, the
+    # event that usually explains a rollback
+    failure_event = None
+    kwargs = {'StackName': stack_name}
+    while True:
+        page = cf.describe_stack_events(**kwargs)
+        for event in page['StackEvents']:
+            if event['ResourceStatus'].endswith('_FAILED') and event['LogicalResourceId'] != stack_name:
+                failure_event = event
+            if event['LogicalResourceId'] == stack_name and \
+                    event.get('ResourceStatusReason') == 'User Initiated':
+                return failure_event
+        if 'NextToken' not in page:
+            return failure_event
+        kwargs['NextToken'] = page['NextToken']
+
+
+def wait_for_stack(cf, stack_name, success_statuses=None, use_events=True, timeout=None,
+                   initial_delay=None, max_delay=None):
+    # Wait until the stack reaches a final status, polling with jittered
+    # exponential backoff. With use_events the stack's own events are polled
+    # instead of describe_stacks - any new event resets the backoff, and the
+    # stack-level event reports completion without another describe call.
+    if success_statuses is None:
+        success_statuses = STACK_SUCCESS_STATUSES
+
+    start_time = time.time()
+    stack_status = cf.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus']
+    last_event_id = None
+    if use_events and not get_stack_terminal(stack_status):
+        # The stack can finish between the describe and this first events
+        # call, so its final event may already be in this batch
+        stack_events = get_stack_events(cf, stack_name)
+        if stack_events:
+            last_event_id = stack_events[-1]['EventId']
+        stack_status = get_events_stack_status(stack_name, stack_events, stack_status)
+
+    delays = get_backoff_delays(initial_delay, max_delay)
+    timed_out = False
+    empty_event_polls = 0
+    while not get_stack_terminal(stack_status):
+        if timeout is not None and time.time() - start_time > timeout:
+            timed_out = True
+            break
+        time.sleep(next(delays))
+
+        if use_events:
+            stack_events = get_stack_events(cf, stack_name, last_event_id)
+            if stack_events:
+                last_event_id = stack_events[-1]['EventId']
+                delays = get_backoff_delays(initial_delay, max_delay)
+                empty_event_polls = 0
+                stack_status = get_events_stack_status(stack_name, stack_events, stack_status)
+            else:
+                # A missed event must not leave the wait spinning forever
+                empty_event_polls += 1
+                if empty_event_polls >= EMPTY_EVENT_POLLS_MAX:
+                    empty_event_polls = 0
+                    stack_status = cf.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus']
+        else:
+            stack_status = cf.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus']
+
+    stack_failed = timed_out or stack_status not in success_statuses
+    failure_event = None
+    if stack_failed and not timed_out:
+        failure_event = get_stack_failure_event(cf, stack_name)
+
+    return {'StackName': stack_name, 'StackStatus': stack_status, 'Failed': stack_failed,
+            'TimedOut': timed_out, 'FailureEvent': failure_event}
+
+
+def format_stack_failure(stack_wait_result):
+    # Describe why a stack did not complete, for printing
+    message = stack_wait_result['StackName'] + ' ' + stack_wait_result['StackStatus']
+    if stack_wait_result['TimedOut']:
+        message += ' (timed out)'
+    event = stack_wait_result['FailureEvent']
+    if event is not None:
+        message += ': ' + event['LogicalResourceId'] + ' ' + event['ResourceStatus']
+        if event.get('ResourceStatusReason'):
+            message += ' - ' + event['ResourceStatusReason']
+    return message
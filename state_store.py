@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from aws_clients import get_client
+
+
+STATE_STORE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'faws_default_stacks', 'state.db')
+
+STATE_STORE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS stacks (account TEXT, region TEXT, stack_name TEXT, stack_id TEXT, '
+    'stack_status TEXT, last_updated TEXT, template_hash TEXT, deploy_hash TEXT, refreshed REAL, '
+    'PRIMARY KEY (account, region, stack_name))',
+    'CREATE TABLE IF NOT EXISTS outputs (account TEXT, region TEXT, stack_name TEXT, output_key TEXT, '
+    'output_value TEXT, export_name TEXT, PRIMARY KEY (account, region, stack_name, output_key))',
+    'CREATE TABLE IF NOT EXISTS resources (account TEXT, region TEXT, stack_name TEXT, logical_id TEXT, '
+    'physical_id TEXT, resource_type TEXT, resource_status TEXT, '
+    'PRIMARY KEY (account, region, stack_name, logical_id))'
+]
+
+state_store_lock = threading.Lock()
+state_stores = {}
+
+
+class StateStore(object):
+    # Local SQLite record of every deployed stack: status, outputs, physical
+    # resource IDs and the template / deploy hashes it was deployed from,
+    # keyed by (account, region, stack name). One connection is shared by
+    # all threads, serialized by a lock.
+
+    def __init__(self, state_store_file=None):
+        if state_store_file is None:
+            state_store_file = STATE_STORE_FILE
+        state_directory = os.path.dirname(state_store_file)
+        if state_directory and not os.path.isdir(state_directory):
+            os.makedirs(state_directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(state_store_file, timeout=30, check_same_thread=False)
+        with self.lock:
+            with self.connection:
+                for statement in STATE_STORE_SCHEMA:
+                    self.connection.execute(statement)
+
+    def record_stack(self, account, region, stack, resource_summaries=None, template_hash=None,
+                     deploy_hash=None):
+        # Store a describe_stacks description and, if given, its resource
+        # summaries (replacing the stored ones). Hashes left as None keep the
+        # stored value.
+        stack_name = stack['StackName']
+        last_updated = str(stack.get('LastUpdatedTime') or stack.get('CreationTime') or '')
+        with self.lock:
+            with self.connection:
+                row = self.connection.execute(
+                    'SELECT template_hash, deploy_hash FROM stacks WHERE account=? AND region=? AND stack_name=?',
+                    (account, region, stack_name)).fetchone()
+                if row is not None:
+                    template_hash = template_hash if template_hash is not None else row[0]
+                    deploy_hash = deploy_hash if deploy_hash is not None else row[1]
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO stacks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (account, region, stack_name, stack.get('StackId'), stack['StackStatus'], last_updated,
+                     template_hash, deploy_hash, time.time()))
+                self.connection.execute('DELETE FROM outputs WHERE account=? AND region=? AND stack_name=?',
+                                        (account, region, stack_name))
+                self.connection.executemany(
+                    'INSERT INTO outputs VALUES (?, ?, ?, ?, ?, ?)',
+                    [(account, region, stack_name, output['OutputKey'], output.get('OutputValue'),
+                      output.get('ExportName')) for output in stack.get('Outputs', [])])
+                if resource_summaries is not None:
+                    self.connection.execute('DELETE FROM resources WHERE account=? AND region=? AND stack_name=?',
+                                            (account, region, stack_name))
+                    self.connection.executemany(
+                        'INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        [(account, region, stack_name, resource['LogicalResourceId'],
+                          resource.get('PhysicalResourceId'), resource.get('ResourceType'),
+                          resource.get('ResourceStatus')) for resource in resource_summaries])
+
+    def delete_stack(self, account, region, stack_name):
+        with self.lock:
+            with self.connection:
+                for table in ['stacks', 'outputs', 'resources']:
+                    self.connection.execute('DELETE FROM ' + table + ' WHERE account=? AND region=? AND stack_name=?',
+                                            (account, region, stack_name))
+
+    def get_stack(self, account, region, stack_name):
+        # Return the stored stack with its outputs and resources, or None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT stack_id, stack_status, last_updated, template_hash, deploy_hash, refreshed FROM stacks '
+                'WHERE account=? AND region=? AND stack_name=?', (account, region, stack_name)).fetchone()
+            if row is None:
+                return None
+            outputs = self.connection.execute(
+                'SELECT output_key, output_value FROM outputs WHERE account=? AND region=? AND stack_name=?',
+                (account, region, stack_name)).fetchall()
+            resources = self.connection.execute(
+                'SELECT logical_id, physical_id FROM resources WHERE account=? AND region=? AND stack_name=?',
+                (account, region, stack_name)).fetchall()
+        return {'StackName': stack_name, 'StackId': row[0], 'StackStatus': row[1], 'LastUpdated': row[2],
+                'TemplateHash': row[3], 'DeployHash': row[4], 'Refreshed': row[5], 'Outputs': dict(outputs),
+                'Resources': dict(resources)}
+
+    def list_stacks(self, account=None, region=None):
+        # [(account, region, stack name, status)] for every stored stack,
+        # optionally only one account and/or region
+        query = 'SELECT account, region, stack_name, stack_status FROM stacks WHERE 1=1'
+        arguments = []
+        if account is not None:
+            query += ' AND account=?'
+            arguments.append(account)
+        if region is not None:
+            query += ' AND region=?'
+            arguments.append(region)
+        with self.lock:
+            return self.connection.execute(query + ' ORDER BY account, region, stack_name', arguments).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_state_store(state_store_file=None):
+    # One shared StateStore per database file, STATE_STORE_FILE unless
+    # state_store_file is given
+    if state_store_file is None:
+        state_store_file = STATE_STORE_FILE
+    with state_store_lock:
+        if state_store_file not in state_stores:
+            state_stores[state_store_file] = StateStore(state_store_file)
+        return state_stores[state_store_file]
+
+
+def close_state_store(state_store_file):
+    # Close the shared StateStore of a database file that is going away
+    with state_store_lock:
+        state_store = state_stores.pop(state_store_file, None)
+    if state_store is not None:
+        state_store.close()
+
+
+def list_stack_resources(cf, stack_name):
+    # Every resource summary of the stack, following NextToken
+    resource_summaries = []
+    paginator = cf.get_paginator('list_stack_resources')
+    for page in paginator.paginate(StackName=stack_name):
+        resource_summaries.extend(page['StackResourceSummaries'])
+    return resource_summaries
+
+
+def refresh_state(cf, state_store, account, region, stack_names=None, full=False):
+    # Bring the store in line with CloudFormation using one paginated
+    # describe_stacks pass. Resources are only re-listed for stacks whose
+    # status or last update time changed since they were stored, unless
+    # full. With full, stored stacks that no longer exist are removed.
+    # stack_names limits the refresh to those stacks. Returns the names of
+    # the stacks whose resources were re-listed.
+    stacks = {}
+    paginator = cf.get_paginator('describe_stacks')
+    for page in paginator.paginate():
+        for stack in page['Stacks']:
+            if stack_names is None or stack['StackName'] in stack_names:
+                stacks[stack['StackName']] = stack
+
+    refreshed = []
+    for stack_name in sorted(stacks):
+        stack = stacks[stack_name]
+        stored_stack = state_store.get_stack(account, region, stack_name)
+        last_updated = str(stack.get('LastUpdatedTime') or stack.get('CreationTime') or '')
+        if full or stored_stack is None or stored_stack['StackStatus'] != stack['StackStatus'] or \
+                stored_stack['LastUpdated'] != last_updated:
+            state_store.record_stack(account, region, stack, list_stack_resources(cf, stack_name))
+            refreshed.append(stack_name)
+        else:
+            state_store.record_stack(account, region, stack)
+
+    if full:
+        for stored_account, stored_region, stack_name, stack_status in state_store.list_stacks(account, region):
+            if stack_name not in stacks and (stack_names is None or stack_name in stack_names):
+                state_store.delete_stack(account, region, stack_name)
+    return refreshed
+
+
+def print_state(state_store, account=None, region=None, stack_name=None):
+    for stored_account, stored_region, stored_stack_name, stack_status in state_store.list_stacks(account, region):
+        if stack_name is not None and stored_stack_name != stack_name:
+            continue
+        print(stored_account + ' ' + stored_region + ' ' + stored_stack_name + ': ' + stack_status)
+        if stack_name is not None:
+            stack = state_store.get_stack(stored_account, stored_region, stored_stack_name)
+            print(' Outputs: ')
+            for key in sorted(stack['Outputs']):
+                print('  ' + key + ': ' + str(stack['Outputs'][key]))
+            print(' Resources: ')
+            for key in sorted(stack['Resources']):
+                print('  ' + key + ': ' + str(stack['Resources'][key]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Query or refresh the local record of deployed stacks.')
+    parser.add_argument('--account', help='Rackspace account number (ddi)')
+    parser.add_argument('--region', help='Region')
+    parser.add_argument('--stack', help='Show the outputs and resources of this stack')
+    parser.add_argument('--refresh', choices=['incremental', 'full'],
+                        help='Refresh --account / --region from CloudFormation first (needs --profile)')
+    parser.add_argument('--profile', help='Named AWS profile used for --refresh')
+    parser.add_argument('--state-file', help='State database (' + STATE_STORE_FILE + ')')
+    args = parser.parse_args(argv)
+
+    state_store = get_state_store(args.state_file)
+    if args.refresh:
+        if not args.account or not args.region or not args.profile:
+            parser.error('--refresh needs --account, --region and --profile')
+        cf = get_client('cloudformation', {'profile_name': args.profile, 'region_name': args.region})
+        refreshed = refresh_state(cf, state_store, args.account, args.region, full=args.refresh == 'full')
+        print('Refreshed ' + str(len(refreshed)) + ' stack(s)')
+    print_state(state_store, args.account, args.region, args.stack)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
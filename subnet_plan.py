@@ -0,0 +1,82 @@
+import ipaddress
+
+
+# Subnet layout of a base network with prefix length p: the public subnets
+# are the first /(p+6) blocks of the first /(p+3), the private subnets the
+# /(p+5) blocks of the second /(p+3). For 172.18.0.0/16 that is
+# 172.18.0.0/22, .4.0/22, .8.0/22 and 172.18.32.0/21, .40.0/21, .48.0/21.
+PUBLIC_SUBNETS = ['PublicSubnetAZ1', 'PublicSubnetAZ2', 'PublicSubnetAZ3']
+PRIVATE_SUBNETS = ['PrivateSubnetAZ1', 'PrivateSubnetAZ2', 'PrivateSubnetAZ3']
+
+# VPCs can be /16 to /28; the layout needs 6 more bits than the VPC has, and
+# subnets can be no smaller than /28
+MIN_PREFIX_LENGTH = 16
+MAX_PREFIX_LENGTH = 22
+
+AZ_COUNTS = ['2', '3']
+
+
+def get_network(cidr):
+    # Parse a CIDR range, raising ValueError if it is not a network address
+    try:
+        return ipaddress.ip_network(cidr)
+    except ValueError as e:
+        raise ValueError('CIDR range ' + str(cidr) + ' is not valid: ' + str(e))
+
+
+def get_subnet_plan(cidr):
+    # {subnet parameter: CIDR} for every base network subnet parameter.
+    # Raises ValueError if the CIDR range cannot hold the layout.
+    network = get_network(cidr)
+    if network.version != 4:
+        raise ValueError('CIDR range ' + str(cidr) + ' is not an IPv4 range')
+    if not MIN_PREFIX_LENGTH <= network.prefixlen <= MAX_PREFIX_LENGTH:
+        raise ValueError('CIDR range ' + str(cidr) + ' must be a /' + str(MIN_PREFIX_LENGTH) + ' to /' +
+                         str(MAX_PREFIX_LENGTH))
+    public_block, private_block = list(network.subnets(new_prefix=network.prefixlen + 3))[0:2]
+    public_subnets = list(public_block.subnets(new_prefix=network.prefixlen + 6))
+    private_subnets = list(private_block.subnets(new_prefix=network.prefixlen + 5))
+    subnet_plan = {}
+    for position in range(len(PUBLIC_SUBNETS)):
+        subnet_plan[PUBLIC_SUBNETS[position]] = str(public_subnets[position])
+        subnet_plan[PRIVATE_SUBNETS[position]] = str(private_subnets[position])
+    return subnet_plan
+
+
+def get_vpc_overlaps(ec2, cidr, stack_name=None):
+    # [(VPC ID, CIDR)] for every existing VPC in the region whose CIDR
+    # blocks overlap cidr, from one paginated describe_vpcs pass. The VPC
+    # created by stack_name itself is not a conflict.
+    network = get_network(cidr)
+    overlaps = []
+    paginator = ec2.get_paginator('describe_vpcs')
+    for page in paginator.paginate():
+        for vpc in page['Vpcs']:
+            tags = dict([(tag['Key'], tag['Value']) for tag in vpc.get('Tags', [])])
+            if stack_name is not None and tags.get('aws:cloudformation:stack-name') == stack_name:
+                continue
+            vpc_cidrs = [association['CidrBlock'] for association in vpc.get('CidrBlockAssociationSet', [])
+                         if association.get('CidrBlockState', {}).get('State', 'associated') == 'associated']
+            if not vpc_cidrs:
+                vpc_cidrs = [vpc['CidrBlock']]
+            for vpc_cidr in vpc_cidrs:
+                if network.overlaps(get_network(vpc_cidr)):
+                    overlaps.append((vpc['VpcId'], vpc_cidr))
+    return overlaps
+
+
+def validate_subnet_plan(cidr, az_count, ec2=None, stack_name=None):
+    # Check the CIDR range and availability zone count (and the range
+    # against the region's existing VPCs when ec2 is given) and return the
+    # subnet plan. Raises ValueError describing every problem, before
+    # anything is deployed.
+    if str(az_count) not in AZ_COUNTS:
+        raise ValueError('Availability zone count must be ' + ' or '.join(AZ_COUNTS) + ', not ' + str(az_count))
+    subnet_plan = get_subnet_plan(cidr)
+    problems = []
+    if ec2 is not None:
+        for vpc_id, vpc_cidr in get_vpc_overlaps(ec2, cidr, stack_name):
+            problems.append('CIDR range ' + str(cidr) + ' overlaps ' + vpc_id + ' ' + vpc_cidr)
+    if problems:
+        raise ValueError('Invalid base network: ' + '; '.join(problems))
+    return subnet_plan
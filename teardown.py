@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import argparse
+from botocore.exceptions import ClientError
+from deploy_settings import set_credentials, set_s3_client, set_cf_client, set_ec2_client, set_s3_bucket_name, \
+    set_ec2_key_name, get_default_settings
+from exports_resolver import get_exports_resolver
+from instrumentation import trace_phase, start_run_trace_from_environment, write_run_report
+from run_spec import add_run_spec_arguments, get_run_settings, prompt_setting, get_setting_prompt
+from s3_templates import empty_template_bucket, delete_template_bucket
+from stack_graph import deploy_stack_graph, get_stack_dependencies, get_template_stack_dependencies, \
+    merge_stack_dependencies, reverse_stack_dependencies
+from stack_poller import StackPoller
+from stack_registry import STACK_REGISTRY, STACK_REGISTRY_KEYS, get_registry_dependencies, get_registry_templates, \
+    get_registry_stack_name, get_registry_stack_names, get_stack_deployed
+from stack_waiter import format_stack_failure
+from state_store import get_state_store
+
+
+def delete_registry_stack(cf, key, settings, stack_poller=None, registry=STACK_REGISTRY, state_store=None):
+    # Delete one registry stack and wait for it through the shared poller
+    # (describe_stacks by name fails once the stack is gone, the listing
+    # does not). Returns the stack name; raises RuntimeError describing
+    # the failing resource if the delete fails. The stack is removed from the
+    # state store.
+    if state_store is None:
+        state_store = get_state_store()
+    if stack_poller is None:
+        stack_poller = StackPoller(cf)
+    stack_name = get_registry_stack_name(key, settings['stack_prefix'], registry)
+    if get_stack_deployed(cf, stack_name):
+        cf.delete_stack(StackName=stack_name)
+        stack_wait_result = stack_poller.wait(stack_name, success_statuses=['DELETE_COMPLETE'],
+                                              missing_status='DELETE_COMPLETE')
+        if stack_wait_result['Failed']:
+            raise RuntimeError(format_stack_failure(stack_wait_result))
+        get_exports_resolver(cf, state_store, settings['ddi'], settings['region']).invalidate()
+    state_store.delete_stack(settings['ddi'], settings['region'], stack_name)
+    return stack_name
+
+
+def delete_ec2_key_pair(ec2, ec2_key_name):
+    # Returns True if the key pair existed
+    try:
+        ec2.describe_key_pairs(KeyNames=[ec2_key_name])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidKeyPair.NotFound':
+            return False
+        raise
+    ec2.delete_key_pair(KeyName=ec2_key_name)
+    return True
+
+
+def teardown_environment(settings, stack_keys=None, empty_bucket=False, delete_key_pair=False,
+                         registry=STACK_REGISTRY):
+    # Delete the environment's stacks (every registry stack, or stack_keys)
+    # in reverse dependency order - each stack once the stacks using it are
+    # gone, independent stacks at the same time. With empty_bucket, every
+    # template version under the environment's prefix is deleted, and the
+    # bucket too once nothing is left in it; with delete_key_pair, the key
+    # pair is deleted. Both only happen if every stack was deleted.
+    ddi = settings['ddi']
+    raw_account_name = settings['raw_account_name']
+    region = settings['region']
+    environment = settings['environment']
+    credentials = settings['credentials']
+    s3_bucket_name = set_s3_bucket_name(ddi, raw_account_name)
+    cf = set_cf_client(credentials)
+
+    if stack_keys is None:
+        stack_keys = list(registry)
+    stack_dependencies = reverse_stack_dependencies(merge_stack_dependencies(
+        get_stack_dependencies(), get_registry_dependencies(registry),
+        get_template_stack_dependencies(settings['cf_directory'], get_registry_templates(registry),
+                                        get_registry_stack_names(settings['stack_prefix'], registry))))
+
+    stack_poller = StackPoller(cf)
+
+    def get_delete_function(key):
+        def delete_stack(stack_results):
+            return delete_registry_stack(cf, key, settings, stack_poller, registry)
+        return delete_stack
+
+    with trace_phase('delete_stacks'):
+        stack_results, stack_failures = deploy_stack_graph(
+            dict([(key, get_delete_function(key)) for key in stack_keys]), stack_dependencies)
+
+    teardown_results = {'stack_results': stack_results, 'stack_failures': stack_failures,
+                        's3_bucket_name': s3_bucket_name, 'object_versions_deleted': None, 'bucket_deleted': False,
+                        'ec2_key_name': set_ec2_key_name(raw_account_name, environment, region),
+                        'key_pair_deleted': None}
+    if stack_failures:
+        return teardown_results
+
+    if empty_bucket:
+        s3 = set_s3_client(credentials)
+        with trace_phase('empty_template_bucket'):
+            teardown_results['object_versions_deleted'] = empty_template_bucket(s3, s3_bucket_name,
+                                                                                environment.lower() + '/')
+            teardown_results['bucket_deleted'] = delete_template_bucket(s3, s3_bucket_name)
+    if delete_key_pair:
+        with trace_phase('delete_ec2_key_pair'):
+            teardown_results['key_pair_deleted'] = delete_ec2_key_pair(set_ec2_client(credentials),
+                                                                       teardown_results['ec2_key_name'])
+    return teardown_results
+
+
+def print_teardown_results(teardown_results):
+    print('\nDeleted Stacks: ')
+    for key in STACK_REGISTRY_KEYS:
+        if key in teardown_results['stack_results']:
+            print(' ' + teardown_results['stack_results'][key])
+    for key in sorted(teardown_results['stack_failures']):
+        print('\n' + key + ' Failed: ' + teardown_results['stack_failures'][key])
+    if teardown_results['object_versions_deleted'] is not None:
+        print('\nDeleted ' + str(teardown_results['object_versions_deleted']) + ' template version(s) from ' +
+              teardown_results['s3_bucket_name'])
+        if teardown_results['bucket_deleted']:
+            print('Deleted S3 Bucket "' + teardown_results['s3_bucket_name'] + '"')
+    if teardown_results['key_pair_deleted'] is not None:
+        if teardown_results['key_pair_deleted']:
+            print('\nDeleted EC2 Key "' + teardown_results['ec2_key_name'] + '"')
+        else:
+            print('\nEC2 Key "' + teardown_results['ec2_key_name'] + '" does not exist.')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Delete the default stacks of one environment.')
+    add_run_spec_arguments(parser)
+    parser.add_argument('--stack', action='append', choices=STACK_REGISTRY_KEYS,
+                        help='Only delete this registry stack (repeatable); stacks using it must already be gone')
+    parser.add_argument('--empty-bucket', action='store_true',
+                        help='Delete every template version of the environment, and the bucket once it is empty')
+    parser.add_argument('--delete-key-pair', action='store_true', help='Delete the EC2 key pair')
+    parser.add_argument('--non-interactive', action='store_true',
+                        help='Never prompt; settings not given use their defaults')
+    parser.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+    args = parser.parse_args(argv)
+    interactive = not args.non_interactive
+    try:
+        run_settings = get_run_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if not interactive and not args.yes:
+        parser.error('--yes is required with --non-interactive')
+
+    # Record phase and API call timings when FAWS_TRACE_REPORT is set
+    trace_report_file = start_run_trace_from_environment()
+    settings = get_default_settings()
+
+    def prompt(setting, required=False):
+        try:
+            settings[setting] = prompt_setting(run_settings, setting, get_setting_prompt(setting, settings[setting]),
+                                               settings[setting], required, interactive)
+        except ValueError as e:
+            parser.error(str(e))
+
+    prompt('cf_directory')
+    prompt('ddi', True)
+    prompt('raw_account_name', True)
+    prompt('region')
+    prompt('environment')
+    prompt('stack_prefix')
+
+    # Set AWS Credentials
+    if run_settings.get('profile'):
+        settings['credentials'] = {'profile_name': run_settings['profile'], 'region_name': settings['region']}
+    elif not interactive and None in [os.environ.get(variable) for variable in
+                                      ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']]:
+        parser.error('--profile or the AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_SESSION_TOKEN '
+                     'environment variables are required')
+    else:
+        settings['credentials'] = set_credentials(settings['region'])
+
+    stack_keys = args.stack or list(STACK_REGISTRY_KEYS)
+    if not args.yes:
+        stack_names = [get_registry_stack_name(key, settings['stack_prefix']) for key in stack_keys]
+        print('\nThis deletes ' + ', '.join(stack_names) + ' in ' + settings['region'] + '.')
+        if input('Type the stack prefix to continue: ') != settings['stack_prefix']:
+            print('Nothing was deleted.')
+            return
+
+    teardown_results = teardown_environment(settings, stack_keys, args.empty_bucket, args.delete_key_pair)
+    print_teardown_results(teardown_results)
+    write_run_report(trace_report_file)
+    if teardown_results['stack_failures']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,225 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+if yaml is not None:
+    class CloudFormationLoader(yaml.SafeLoader):
+        # SafeLoader that understands the short-form intrinsic function tags
+        # (!Ref, !Sub, !GetAtt, !ImportValue, ...)
+        pass
+
+    def construct_cloudformation_tag(loader, tag_suffix, node):
+        if isinstance(node, yaml.ScalarNode):
+            value = loader.construct_scalar(node)
+        elif isinstance(node, yaml.SequenceNode):
+            value = loader.construct_sequence(node, deep=True)
+        else:
+            value = loader.construct_mapping(node, deep=True)
+
+        if tag_suffix in ['Ref', 'Condition']:
+            return {tag_suffix: value}
+        if tag_suffix == 'GetAtt' and isinstance(value, str):
+            # !GetAtt Resource.Attribute
+            value = value.split('.', 1)
+        return {'Fn::' + tag_suffix: value}
+
+    CloudFormationLoader.add_multi_constructor('!', construct_cloudformation_tag)
+    # CloudFormation reads unquoted dates (AWSTemplateFormatVersion:
+    # 2010-09-09) as strings, so they are not turned into datetime objects
+    CloudFormationLoader.yaml_implicit_resolvers = dict(
+        [(first, [(tag, regexp) for tag, regexp in resolvers if tag != 'tag:yaml.org,2002:timestamp'])
+         for first, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items()])
+
+
+def load_template(template_body):
+    # Parse a JSON or YAML CloudFormation template body into a dict. Raises
+    # ValueError if it is neither.
+    try:
+        template = json.loads(template_body)
+    except ValueError:
+        if yaml is None:
+            raise ValueError('Template is not JSON and PyYAML is not installed')
+        try:
+            template = yaml.load(template_body, Loader=CloudFormationLoader)
+        except yaml.YAMLError as e:
+            raise ValueError('Template is not valid JSON or YAML: ' + str(e))
+    if not isinstance(template, dict):
+        raise ValueError('Template is not a JSON or YAML object')
+    return template
+
+
+def get_intrinsic_values(node, function_name):
+    # Return every argument of function_name ('Fn::ImportValue') found
+    # anywhere in node
+    values = []
+    if isinstance(node, dict):
+        for key in node:
+            if key == function_name:
+                values.append(node[key])
+            else:
+                values.extend(get_intrinsic_values(node[key], function_name))
+    elif isinstance(node, list):
+        for element in node:
+            values.extend(get_intrinsic_values(element, function_name))
+    return values
+
+
+def get_name_pattern(value):
+    # Reduce an export/import name expression to a comparable string:
+    # literals stay as-is, Fn::Sub / Fn::Join / Ref become '${...}' patterns
+    if isinstance(value, dict):
+        if 'Fn::Sub' in value:
+            sub = value['Fn::Sub']
+            return sub[0] if isinstance(sub, list) else sub
+        if 'Fn::Join' in value:
+            delimiter, parts = value['Fn::Join']
+            return delimiter.join([get_name_pattern(part) for part in parts])
+        if 'Ref' in value:
+            return '${' + value['Ref'] + '}'
+        return '${?}'
+    return str(value)
+
+
+def get_name_key(value, substitutions=None):
+    # The name with every ${...} placeholder substitutions gives a value for
+    # replaced by it. Names only match when their keys are equal, e.g.
+    # '${AWS::StackName}-VPCID' of stack prod-BaseNetwork and
+    # '${NetworkStackName}-VPCID' with NetworkStackName = prod-BaseNetwork.
+    # Placeholders without a value are compared as written.
+    substitutions = substitutions or {}
+
+    def substitute(match):
+        value = substitutions.get(match.group(1))
+        return match.group(0) if value is None else value
+    return re.sub(r'\$\{([^}]*)\}', substitute, get_name_pattern(value))
+
+
+def analyze_template(template_body):
+    # Return the Parameters (type, default, allowed values), Outputs, Exports
+    # and Fn::ImportValue references of a template, without any API call
+    # Raises ValueError if the template cannot be read or its Parameters /
+    # Outputs are not objects.
+    template = load_template(template_body)
+    for section in ['Parameters', 'Outputs']:
+        if not isinstance(template.get(section) or {}, dict):
+            raise ValueError(section + ' is not an object')
+        for key, value in (template.get(section) or {}).items():
+            if not isinstance(value, dict):
+                raise ValueError(section + ' ' + str(key) + ' is not an object')
+
+    parameters = {}
+    for key, parameter in (template.get('Parameters') or {}).items():
+        parameters[key] = {'Type': parameter.get('Type'), 'Default': parameter.get('Default'),
+                           'AllowedValues': parameter.get('AllowedValues'),
+                           'Description': parameter.get('Description')}
+
+    outputs = {}
+    exports = []
+    for key, output in (template.get('Outputs') or {}).items():
+        export_name = None
+        if isinstance(output.get('Export'), dict):
+            export_name = output['Export'].get('Name')
+            exports.append(export_name)
+        outputs[key] = {'Value': output.get('Value'), 'Export': export_name}
+
+    imports = get_intrinsic_values(template.get('Resources') or {}, 'Fn::ImportValue') + \
+        get_intrinsic_values(template.get('Outputs') or {}, 'Fn::ImportValue')
+
+    return {'Parameters': parameters, 'Outputs': outputs, 'Exports': exports, 'Imports': imports}
+
+
+def analyze_template_file(template_path):
+    with open(template_path) as f:
+        return analyze_template(f.read())
+
+
+def analyze_template_directory(cf_directory, cf_templates_list=None, max_workers=10):
+    # Analyze every .template file (or just cf_templates_list) in parallel.
+    # Returns {template file: analysis}; templates that fail to parse map to
+    # None.
+    if cf_templates_list is None:
+        cf_templates_list = sorted([f for f in os.listdir(cf_directory) if f.endswith('.template')])
+
+    def analyze(cf_template):
+        try:
+            return analyze_template_file(os.path.join(cf_directory, cf_template))
+        except (IOError, ValueError):
+            return None
+
+    if not cf_templates_list:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(cf_templates_list)))
+    try:
+        return dict(zip(cf_templates_list, executor.map(analyze, cf_templates_list)))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def get_template_defaults_local(analysis):
+    # {parameter: default} in the same string form get_template_summary
+    # returns
+    template_defaults = {}
+    for key in analysis['Parameters']:
+        template_defaults[key] = get_parameter_value(analysis['Parameters'][key]['Default'])
+    return template_defaults
+
+
+def get_parameter_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, list):
+        return ','.join([get_parameter_value(element) for element in value])
+    return str(value)
+
+
+def get_template_substitutions(analysis, substitutions=None):
+    # {placeholder: value} for a template's names: its parameter defaults,
+    # overridden by substitutions (e.g. {'AWS::StackName': stack name})
+    template_substitutions = {}
+    for key in analysis['Parameters']:
+        default = get_parameter_value(analysis['Parameters'][key]['Default'])
+        if default:
+            template_substitutions[key] = default
+    template_substitutions.update(substitutions or {})
+    return template_substitutions
+
+
+def get_template_dependencies(template_analyses, template_substitutions=None):
+    # Return {template: set(templates it imports exports from)}, matching
+    # Fn::ImportValue names exactly against Export names once the
+    # placeholders are substituted. template_substitutions maps template ->
+    # {placeholder: value} declared by the caller, such as each stack's name.
+    template_substitutions = template_substitutions or {}
+    substitutions = {}
+    for cf_template in template_analyses:
+        analysis = template_analyses[cf_template]
+        if analysis is not None:
+            substitutions[cf_template] = get_template_substitutions(analysis,
+                                                                    template_substitutions.get(cf_template))
+
+    exporters = {}
+    for cf_template in template_analyses:
+        analysis = template_analyses[cf_template]
+        if analysis is not None:
+            for export_name in analysis['Exports']:
+                exporters.setdefault(get_name_key(export_name, substitutions[cf_template]), set()).add(cf_template)
+
+    template_dependencies = {}
+    for cf_template in template_analyses:
+        template_dependencies[cf_template] = set()
+        analysis = template_analyses[cf_template]
+        if analysis is not None:
+            for import_name in analysis['Imports']:
+                for exporter in exporters.get(get_name_key(import_name, substitutions[cf_template]), set()):
+                    if exporter != cf_template:
+                        template_dependencies[cf_template].add(exporter)
+    return template_dependencies
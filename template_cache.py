@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from template_analyzer import analyze_template, get_template_defaults_local
+
+
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'faws_default_stacks', 'templates')
+CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+cache_lock = threading.Lock()
+
+
+def get_template_hash(template_path):
+    # SHA-256 of the template file contents, the cache key
+    template_hash = hashlib.sha256()
+    with open(template_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            template_hash.update(chunk)
+    return template_hash.hexdigest()
+
+
+def parse_template_defaults(template_body):
+    # Read {parameter: default} straight from a JSON or YAML template body.
+    # Returns None if the body cannot be parsed locally.
+    try:
+        return get_template_defaults_local(analyze_template(template_body))
+    except ValueError:
+        return None
+
+
+def get_cached_template_defaults(template_hash, cache_directory=None):
+    if cache_directory is None:
+        cache_directory = CACHE_DIRECTORY
+    cache_file = os.path.join(cache_directory, template_hash + '.json')
+    try:
+        with open(cache_file) as f:
+            template_defaults = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    # Touch the entry so eviction drops the least recently used first
+    try:
+        os.utime(cache_file, None)
+    except OSError:
+        pass
+    return template_defaults
+
+
+def set_cached_template_defaults(template_hash, template_defaults, cache_directory=None,
+                                 max_bytes=CACHE_MAX_BYTES):
+    if cache_directory is None:
+        cache_directory = CACHE_DIRECTORY
+    with cache_lock:
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+        # Write to a temporary file first so readers never see a partial entry
+        temp_file = tempfile.NamedTemporaryFile('w', dir=cache_directory, suffix='.tmp', delete=False)
+        try:
+            with temp_file:
+                json.dump(template_defaults, temp_file)
+            os.rename(temp_file.name, os.path.join(cache_directory, template_hash + '.json'))
+        except Exception:
+            os.remove(temp_file.name)
+            raise
+        evict_template_cache(cache_directory, max_bytes)
+
+
+def evict_template_cache(cache_directory=None, max_bytes=CACHE_MAX_BYTES):
+    # Remove the least recently used entries until the cache fits max_bytes
+    if cache_directory is None:
+        cache_directory = CACHE_DIRECTORY
+    cache_entries = []
+    for cache_file in os.listdir(cache_directory):
+        if cache_file.endswith('.json'):
+            cache_stat = os.stat(os.path.join(cache_directory, cache_file))
+            cache_entries.append((cache_stat.st_mtime, cache_stat.st_size, cache_file))
+
+    cache_size = sum([entry[1] for entry in cache_entries])
+    for entry in sorted(cache_entries):
+        if cache_size <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_directory, entry[2]))
+        except OSError:
+            pass
+        cache_size -= entry[1]
+
+
+def get_template_file_defaults(template_path, get_remote_template_defaults=None, cache_directory=None):
+    # Return a template's parameter defaults from the cache (CACHE_DIRECTORY
+    # unless cache_directory is given), else from the local template body,
+    # else from get_remote_template_defaults (e.g. get_template_summary).
+    # Results are cached by template content hash.
+    template_hash = get_template_hash(template_path)
+    template_defaults = get_cached_template_defaults(template_hash, cache_directory)
+    if template_defaults is not None:
+        return template_defaults
+
+    with open(template_path) as f:
+        template_defaults = parse_template_defaults(f.read())
+    if template_defaults is None and get_remote_template_defaults is not None:
+        template_defaults = get_remote_template_defaults()
+    if template_defaults is not None:
+        set_cached_template_defaults(template_hash, template_defaults, cache_directory)
+    return template_defaults
+
+
+def get_templates_defaults(cf_directory, cf_templates_list, get_remote_template_defaults, max_workers=10,
+                           cache_directory=None):
+    # Return the parameter defaults of every template, in cf_templates_list
+    # order. get_remote_template_defaults(cf_template) is only called for
+    # templates that are neither cached nor parseable locally (or for all of
+    # them when cf_directory is None); those calls run in parallel.
+    def get_defaults(cf_template):
+        if cf_directory is None:
+            return get_remote_template_defaults(cf_template)
+        return get_template_file_defaults(os.path.join(cf_directory, cf_template),
+                                          lambda: get_remote_template_defaults(cf_template), cache_directory)
+
+    if not cf_templates_list:
+        return []
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(cf_templates_list)))
+    try:
+        return list(executor.map(get_defaults, cf_templates_list))
+    finally:
+        executor.shutdown(wait=True)
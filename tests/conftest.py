@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from botocore.awsrequest import AWSResponse
+
+# The scripts are flat top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aws_clients  # noqa: E402
+from api_governor import ApiGovernor, SERVICE_RATES  # noqa: E402
+import exports_resolver  # noqa: E402
+import run_journal  # noqa: E402
+import stack_waiter  # noqa: E402
+import state_store as state_store_module  # noqa: E402
+import template_cache  # noqa: E402
+from benchmark import write_benchmark_templates  # noqa: E402
+from fake_aws import FakeAWS  # noqa: E402
+from state_store import StateStore  # noqa: E402
+
+
+# Requests per second for every API behind the fake_aws fixture
+FAKE_AWS_RATE = 10000.0
+
+
+@pytest.fixture(autouse=True)
+def cache_paths(tmp_path, monkeypatch):
+    # The template cache, run journals and state store default to paths
+    # under tmp_path instead of the home directory
+    cache_directory = tmp_path / 'home' / '.cache' / 'faws_default_stacks'
+    monkeypatch.setattr(template_cache, 'CACHE_DIRECTORY', str(cache_directory / 'templates'))
+    monkeypatch.setattr(run_journal, 'JOURNAL_DIRECTORY', str(cache_directory / 'journals'))
+    monkeypatch.setattr(state_store_module, 'STATE_STORE_FILE', str(cache_directory / 'state.db'))
+    monkeypatch.setattr(state_store_module, 'state_stores', {})
+    return cache_directory
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    # A fast simulated AWS backend behind aws_clients, with short stack
+    # builds and poll intervals. Its clients go through a fresh API governor
+    # whose rates do not hold the tests back.
+    backend = FakeAWS(latency=0, stack_duration=0.05, seed=1)
+    monkeypatch.setattr(aws_clients, 'api_governor',
+                        ApiGovernor(dict([(service, FAKE_AWS_RATE) for service in SERVICE_RATES])))
+    aws_clients.set_client_factory(backend.client)
+    monkeypatch.setattr(stack_waiter, 'POLL_INITIAL_DELAY', 0.01)
+    monkeypatch.setattr(stack_waiter, 'POLL_MAX_DELAY', 0.05)
+    monkeypatch.setattr(exports_resolver, 'exports_resolvers', {})
+    yield backend
+    aws_clients.set_client_factory(None)
+
+
+@pytest.fixture
+def state_store(cache_paths, tmp_path):
+    # A fresh state store, also the one get_state_store() shares for both
+    # the default file and its own
+    state_file = str(tmp_path / 'state.db')
+    store = StateStore(state_file)
+    state_store_module.state_stores[state_store_module.STATE_STORE_FILE] = store
+    state_store_module.state_stores[state_file] = store
+    return store
+
+
+@pytest.fixture
+def fleet_paths(tmp_path, state_store):
+    # deploy_fleet / deploy_fleet_async arguments that keep the journals and
+    # the state store under tmp_path
+    return {'journal_directory': str(tmp_path / 'journals'), 'state_file': str(tmp_path / 'state.db')}
+
+
+@pytest.fixture
+def cf_directory(tmp_path):
+    # The benchmark's minimal default stack templates
+    cf_directory = tmp_path / 'templates'
+    cf_directory.mkdir()
+    write_benchmark_templates(str(cf_directory))
+    return str(cf_directory)
+
+
+GET_CALLER_IDENTITY_BODY = '<GetCallerIdentityResponse><GetCallerIdentityResult><Account>123456789012</Account>' \
+                           '<Arn>arn:aws:iam::123456789012:user/test</Arn><UserId>test</UserId>' \
+                           '</GetCallerIdentityResult></GetCallerIdentityResponse>'
+DESCRIBE_STACKS_BODY = '<DescribeStacksResponse><DescribeStacksResult><Stacks/></DescribeStacksResult>' \
+                       '</DescribeStacksResponse>'
+ERROR_BODY = '<ErrorResponse><Error><Type>Sender</Type><Code>{code}</Code><Message>{code}</Message></Error>' \
+             '</ErrorResponse>'
+
+
+class RawResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class FakeEndpoint(object):
+    # Answers the requests of real boto3 clients instead of AWS, recording
+    # when each action was sent. errors[action] lists the error codes the
+    # next attempts of action get.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.errors = {}
+
+    def before_send(self, request, event_name, **kwargs):
+        # event_name is before-send.<service>.<action>
+        action = event_name.split('.')[-1]
+        with self.lock:
+            self.sent.append((action, time.time()))
+            error_codes = self.errors.get(action)
+            error_code = error_codes.pop(0) if error_codes else None
+        status_code = 200
+        if error_code is not None:
+            status_code = 400
+            body = ERROR_BODY.format(code=error_code)
+        elif action == 'GetCallerIdentity':
+            body = GET_CALLER_IDENTITY_BODY
+        else:
+            body = DESCRIBE_STACKS_BODY
+        body = body.encode('utf-8')
+        return AWSResponse(request.url, status_code, {'content-length': str(len(body))}, RawResponse(body))
+
+    def get_sent(self, action):
+        with self.lock:
+            return [sent_time for sent_action, sent_time in self.sent if sent_action == action]
+
+
+@pytest.fixture
+def aws_endpoint(monkeypatch):
+    # Real boto3 clients from aws_clients.get_client, behind a fresh
+    # governor and answered by a FakeEndpoint
+    endpoint = FakeEndpoint()
+    monkeypatch.setattr(aws_clients, 'api_governor', ApiGovernor())
+    monkeypatch.setattr(aws_clients, 'client_factory', None)
+    monkeypatch.setattr(aws_clients, 'clients', {})
+    monkeypatch.setattr(aws_clients, 'sessions', {})
+    monkeypatch.setattr(aws_clients, 'account_ids', {})
+    get_session = aws_clients.get_session
+
+    def get_endpoint_session(credentials):
+        session = get_session(credentials)
+        # Last, so the governor's and tracer's before-send hooks run first
+        session.events.unregister('before-send', endpoint.before_send)
+        session.events.register_last('before-send', endpoint.before_send)
+        return session
+
+    monkeypatch.setattr(aws_clients, 'get_session', get_endpoint_session)
+    return endpoint
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import api_governor
+import aws_clients
+from api_governor import ApiGovernor
+from aws_clients import get_client
+
+
+ACCOUNT_ID = '123456789012'
+
+
+def get_credentials(access_key_id, region):
+    return {'aws_access_key_id': access_key_id, 'aws_secret_access_key': 'secret', 'aws_session_token': None,
+            'region_name': region}
+
+
+@pytest.fixture
+def governor(aws_endpoint, monkeypatch):
+    governor = ApiGovernor({'cloudformation': 20.0})
+    monkeypatch.setattr(aws_clients, 'api_governor', governor)
+    return governor
+
+
+def test_governor_buckets_per_account_and_region(governor, aws_endpoint):
+    for credentials in [get_credentials('first-key', 'us-east-1'), get_credentials('second-key', 'us-east-1'),
+                        get_credentials('first-key', 'us-west-2')]:
+        assert get_client('cloudformation', credentials).describe_stacks()['Stacks'] == []
+
+    # Both keys belong to one account, so they share its bucket
+    assert sorted([key for key in governor.get_rates() if key[-2] == 'cloudformation']) == [
+        (ACCOUNT_ID, 'us-east-1', 'cloudformation', 'DescribeStacks'),
+        (ACCOUNT_ID, 'us-west-2', 'cloudformation', 'DescribeStacks')]
+    # The account is looked up once per credential identity
+    assert len(aws_endpoint.get_sent('GetCallerIdentity')) == 2
+
+
+def test_governor_paces_concurrent_calls(governor, aws_endpoint):
+    call_count = 25
+    cfs = [get_client('cloudformation', get_credentials(access_key_id, 'us-east-1'))
+           for access_key_id in ['first-key', 'second-key']]
+    calls = list(range(call_count))
+
+    def call(cf):
+        while True:
+            try:
+                calls.pop()
+            except IndexError:
+                return
+            cf.describe_stacks()
+
+    threads = [threading.Thread(target=call, args=(cfs[position % 2],)) for position in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sent = sorted(aws_endpoint.get_sent('DescribeStacks'))
+    assert len(sent) == call_count
+    # One token to start, then at most the bucket's rate, which grows by
+    # RATE_INCREASE per success from 20 to under 25 requests per second
+    rate = governor.get_rates()[(ACCOUNT_ID, 'us-east-1', 'cloudformation', 'DescribeStacks')]
+    assert 20.0 < rate < 25.0
+    assert (call_count - 1) / 25.0 <= sent[-1] - sent[0] < (call_count - 1) / 20.0 + 1.0
+
+
+def test_governor_retries_fake_aws_throttles(fake_aws, monkeypatch):
+    # The simulated backend returns throttles to its clients, which the
+    # governor retries like a boto3 client's
+    monkeypatch.setattr(api_governor, 'THROTTLE_BASE_DELAY', 0.001)
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    fake_aws.throttle_rate = 0.3
+    for position in range(10):
+        assert cf.describe_stacks()['Stacks'] == []
+    assert fake_aws.throttle_count > 0
+    assert aws_clients.api_governor.throttles == fake_aws.throttle_count
+    assert fake_aws.call_counts['cloudformation:DescribeStacks'] == 10 + fake_aws.throttle_count
+
+    # Once the governor gives up, the throttle is raised to the caller
+    fake_aws.throttle_rate = 1.0
+    with pytest.raises(ClientError, match='Throttling'):
+        cf.describe_stacks()
+    assert fake_aws.call_counts['cloudformation:DescribeStacks'] == 10 + fake_aws.throttle_count
+    assert fake_aws.throttle_count == aws_clients.api_governor.throttles
@@ -0,0 +1,35 @@
+import pytest
+
+import api_governor
+import aws_clients
+import exports_resolver
+import stack_waiter
+from benchmark import run_script_benchmark
+from conftest import FAKE_AWS_RATE
+
+
+@pytest.fixture
+def script_benchmark(monkeypatch):
+    # Short poll intervals, retries and API rates; the benchmark's client
+    # factory and governor are undone afterwards
+    monkeypatch.setattr(stack_waiter, 'POLL_INITIAL_DELAY', 0.01)
+    monkeypatch.setattr(stack_waiter, 'POLL_MAX_DELAY', 0.05)
+    monkeypatch.setattr(api_governor, 'THROTTLE_BASE_DELAY', 0.001)
+    monkeypatch.setattr(api_governor, 'SERVICE_RATES',
+                        dict([(service, FAKE_AWS_RATE) for service in api_governor.SERVICE_RATES]))
+    monkeypatch.setattr(exports_resolver, 'exports_resolvers', {})
+    monkeypatch.setattr(aws_clients, 'api_governor', aws_clients.api_governor)
+    yield run_script_benchmark
+    aws_clients.set_client_factory(None)
+
+
+def test_script_benchmark_runs_the_deploy_scripts(script_benchmark):
+    script_results = script_benchmark(latency=0, stack_duration=0.05, throttle_rate=0.1, failure_rate=0, seed=1)
+
+    assert [script_result['script'] for script_result in script_results] == [
+        'deploy_defaults.py', 'deploy_base.py --action 1', 'deploy_base.py --action 3']
+    for script_result in script_results:
+        assert script_result['succeeded']
+        assert script_result['api_calls'] > 0
+    # Throttled calls reached the scripts' clients and were retried there
+    assert sum([script_result['throttles'] for script_result in script_results]) > 0
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from defaults_model import get_defaults_model, parse_condition, parse_defaults
+
+
+def test_defaults_file_values():
+    defaults_model = get_defaults_model()
+    # Lists of choices and operator examples take the script defaults
+    availability_zone_count = defaults_model.get_parameter('Base Network', 'AvailabilityZoneCount')
+    assert availability_zone_count.allowed_values == ['2', '3']
+    assert availability_zone_count.default == '2'
+    assert defaults_model.get_parameter('VPC', 'Region').default == 'us-east-1'
+    subscription_protocol = defaults_model.get_parameter('SNSTopicSubscriptions', 'SubscriptionProtocol1')
+    assert subscription_protocol.default == 'email'
+    assert 'email-json' in subscription_protocol.allowed_values
+    assert defaults_model.get_parameter('SNSTopicSubscriptions', 'SubscriptionEndpoint1').default == ''
+    # Quoted and bare values, and the 'Name: =' spelling
+    assert defaults_model.get_parameter('VPC Parameters', 'Environment').default == 'Production'
+    assert defaults_model.get_parameter('BaseNetwork', 'CIDRRange').default == '172.18.0.0/16'
+    assert defaults_model.get_parameter('Account', 'ddi').default is None
+
+
+def test_defaults_file_references_and_conditions():
+    defaults_model = get_defaults_model()
+    route_tables = defaults_model.get_parameter('S3VPCEndpoint', 'RouteTableIdsList')
+    assert route_tables.references == [('BaseNetwork', 'RouteTablePublic'), ('BaseNetwork', 'RouteTablePrivateAZ1'),
+                                       ('BaseNetwork', 'RouteTablePrivateAZ2'),
+                                       ('BaseNetwork', 'RouteTablePrivateAZ3')]
+    assert route_tables.condition == 'if applicable'
+    assert parse_condition(route_tables.condition) is None
+    export = defaults_model.get_section('Base Network').get_export('RouteTablePrivateAZ3')
+    assert parse_condition(export.condition) == ('AvailabilityZoneCount', '3')
+
+    assert [section.key for section in defaults_model.get_stacks()] == [
+        'BaseNetwork', 'SecurityGroup', 'S3VPCEndpoint', 'Route53InternalZone', 'SNSTopicSubscriptions']
+    assert defaults_model.get_stack_dependencies() == {
+        'BaseNetwork': set(), 'SecurityGroup': {'BaseNetwork'}, 'S3VPCEndpoint': {'BaseNetwork'},
+        'Route53InternalZone': {'BaseNetwork'}, 'SNSTopicSubscriptions': set()}
+
+
+@pytest.mark.parametrize('defaults_body, line_number', [
+    ('Account\n  ddi =\n', 1),
+    ('  ddi =\n', 1),
+    ('Account:\n  ddi =\n  accountname\n', 3),
+    ('Base Network:\n  Parameters:\n\n    AvailabilityZoneCount = [2, 3,]\n', 4)])
+def test_parse_defaults_malformed_line(defaults_body, line_number):
+    with pytest.raises(ValueError, match='defaults line ' + str(line_number) + ': '):
+        parse_defaults(defaults_body)
+
+
+def test_get_defaults_model_reparses_changed_file(tmp_path):
+    defaults_file = str(tmp_path / 'defaults')
+    with open(defaults_file, 'w') as f:
+        f.write('VPC Parameters:\n  Environment = "Production"\n')
+    defaults_model = get_defaults_model(defaults_file)
+    assert get_defaults_model(defaults_file) is defaults_model
+
+    with open(defaults_file, 'w') as f:
+        f.write('VPC Parameters:\n  Environment = "Staging"\n')
+    os.utime(defaults_file, (0, 0))
+    assert get_defaults_model(defaults_file).get_parameter('VPC', 'Environment').default == 'Staging'
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from aws_clients import get_client
+from deploy_async import AsyncAWS, AsyncStackPoller, deploy_fleet_async, get_async_stack_poller
+from deploy_fleet import deploy_fleet
+
+
+CREDENTIALS = {'profile_name': 'test', 'region_name': 'us-east-1'}
+# Every environment gets its own VPC range
+STACK_PREFIX_CIDRS = {'alpha': '10.0.0.0/16', 'beta': '10.1.0.0/16', 'gamma': '10.2.0.0/16'}
+
+
+def get_manifest(*stack_prefixes):
+    return [{'ddi': '123456', 'account_name': 'Test Account', 'region': 'us-east-1', 'profile': 'test',
+             'stack_prefix': stack_prefix, 'environment': stack_prefix, 'cidr': STACK_PREFIX_CIDRS[stack_prefix]}
+            for stack_prefix in stack_prefixes]
+
+
+def run_poller(function):
+    # Run function(poller) on a fresh event loop
+    async def run():
+        aws = AsyncAWS(4)
+        try:
+            return await function(AsyncStackPoller(aws, get_client('cloudformation', CREDENTIALS)))
+        finally:
+            aws.close()
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def fleet_directory(tmp_path, monkeypatch):
+    # Key files are written under tmp_path
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_async_fleet_matches_threaded_fleet(fake_aws, cf_directory, fleet_directory, fleet_paths):
+    async_results = asyncio.run(deploy_fleet_async(get_manifest('alpha', 'beta'), cf_directory, per_account=2,
+                                                   use_imports=True, **fleet_paths))
+    threaded_results = deploy_fleet(get_manifest('gamma'), cf_directory, use_imports=True, **fleet_paths)
+
+    for fleet_result in async_results + threaded_results:
+        assert fleet_result['error'] is None
+        assert fleet_result['results']['stack_failures'] == {}
+        assert sorted(fleet_result['results']['stack_results']) == ['BaseNetwork', 'Route53InternalZone',
+                                                                    'S3VPCEndpoint', 'SNSTopicSubscriptions']
+    # Both engines upload the Fn::ImportValue templates
+    for stack_prefix in ['alpha', 'gamma']:
+        stack = fake_aws.stacks[('test', 'us-east-1', stack_prefix + '-S3-VPC-Endpoint')]
+        assert 'VPCID' not in [parameter['ParameterKey'] for parameter in stack['Parameters']]
+
+
+def test_async_fleet_events_file(fake_aws, cf_directory, fleet_directory, fleet_paths):
+    with open(str(fleet_directory / 'events.jsonl'), 'a') as events_file:
+        fleet_results = asyncio.run(deploy_fleet_async(get_manifest('alpha'), cf_directory,
+                                                       events_file=events_file, **fleet_paths))
+    assert fleet_results[0]['error'] is None
+    with open(str(fleet_directory / 'events.jsonl')) as f:
+        assert 'alpha-BaseNetwork' in f.read()
+
+
+def test_async_poller_reports_missing_stack(fake_aws):
+    cf = get_client('cloudformation', CREDENTIALS)
+    cf.create_stack(StackName='prod-Gone', TemplateURL='https://bucket/s3_vpc.template')
+
+    async def wait(poller):
+        waiting = asyncio.ensure_future(poller.wait('prod-Gone', missing_status='DELETE_COMPLETE'))
+        await asyncio.sleep(0.02)
+        await poller.aws.call(cf.delete_stack, StackName='prod-Gone')
+        return await waiting
+
+    stack_wait_result = run_poller(wait)
+    assert stack_wait_result['StackStatus'] == 'DELETE_COMPLETE'
+    assert stack_wait_result['Failed']
+    assert not stack_wait_result['TimedOut']
+
+
+def test_async_poller_times_out(fake_aws):
+    cf = get_client('cloudformation', CREDENTIALS)
+    cf.create_stack(StackName='prod-Slow', TemplateURL='https://bucket/s3_vpc.template')
+    fake_aws.stacks[('test', 'us-east-1', 'prod-Slow')]['CompleteTime'] += 60
+
+    async def wait(poller):
+        return await poller.wait('prod-Slow', timeout=0.1)
+
+    stack_wait_result = run_poller(wait)
+    assert stack_wait_result['StackStatus'] == 'CREATE_IN_PROGRESS'
+    assert stack_wait_result['TimedOut']
+    assert stack_wait_result['Failed']
+
+
+def test_async_poller_shares_listing(fake_aws):
+    cf = get_client('cloudformation', CREDENTIALS)
+    for stack_name in ['prod-A', 'prod-B', 'prod-C']:
+        cf.create_stack(StackName=stack_name, TemplateURL='https://bucket/s3_vpc.template')
+
+    async def wait(poller):
+        stack_wait_results = await asyncio.gather(*[poller.wait(stack_name)
+                                                    for stack_name in ['prod-A', 'prod-B', 'prod-C']])
+        # Environments in the same account and region get the same poller
+        stack_pollers = {}
+        assert get_async_stack_poller(poller.aws, poller.cf, stack_pollers) is \
+            get_async_stack_poller(poller.aws, get_client('cloudformation', CREDENTIALS), stack_pollers)
+        return stack_wait_results, poller.poll_count
+
+    stack_wait_results, poll_count = run_poller(wait)
+    assert [stack_wait_result['StackStatus'] for stack_wait_result in stack_wait_results] == \
+        ['CREATE_COMPLETE'] * 3
+    # One listing per tick for all three stacks
+    assert fake_aws.call_counts['cloudformation:DescribeStacks'] == poll_count
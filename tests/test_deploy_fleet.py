@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+import deploy_fleet
+from deploy_fleet import deploy_fleet as run_fleet
+
+
+def get_manifest(entry_counts):
+    # entry_counts environments for each (ddi, profile), each with its own
+    # stack prefix and VPC range
+    manifest = []
+    for ddi, profile, entry_count in entry_counts:
+        for position in range(entry_count):
+            manifest.append({'ddi': ddi, 'account_name': 'Account ' + ddi, 'region': 'us-east-1',
+                             'profile': profile, 'stack_prefix': 'env' + str(position),
+                             'environment': 'env' + str(position), 'cidr': '10.' + str(position) + '.0.0/16'})
+    return manifest
+
+
+class ConcurrencyRecorder(object):
+    # Wraps deploy_environment, recording the peak number of environments
+    # running at once per account and per region
+
+    def __init__(self, deploy_environment):
+        self.deploy_environment = deploy_environment
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peaks = {}
+
+    def enter(self, keys, step):
+        with self.lock:
+            for key in keys:
+                self.running[key] = self.running.get(key, 0) + step
+                self.peaks[key] = max(self.peaks.get(key, 0), self.running[key])
+
+    def __call__(self, settings, journal=None, state_store=None):
+        keys = [('account', settings['ddi']), ('region', settings['region'])]
+        self.enter(keys, 1)
+        try:
+            return self.deploy_environment(settings, journal, state_store)
+        finally:
+            self.enter(keys, -1)
+
+
+@pytest.fixture
+def recorder(fake_aws, tmp_path, monkeypatch):
+    # Key files are written under tmp_path
+    monkeypatch.chdir(tmp_path)
+    recorder = ConcurrencyRecorder(deploy_fleet.deploy_environment)
+    monkeypatch.setattr(deploy_fleet, 'deploy_environment', recorder)
+    return recorder
+
+
+@pytest.mark.parametrize('per_account', [1, 2])
+def test_deploy_fleet_bounds_environments_per_account(recorder, cf_directory, fleet_paths, per_account):
+    manifest = get_manifest([('111111', 'first', 3), ('222222', 'second', 3)])
+    fleet_results = run_fleet(manifest, cf_directory, max_workers=6, per_account=per_account, per_region=6,
+                              **fleet_paths)
+
+    assert [fleet_result['error'] for fleet_result in fleet_results] == [None] * 6
+    assert recorder.peaks[('account', '111111')] == per_account
+    assert recorder.peaks[('account', '222222')] == per_account
+    # Both accounts ran side by side
+    assert recorder.peaks[('region', 'us-east-1')] == 2 * per_account
+
+
+def test_deploy_fleet_bounds_environments_per_region(recorder, cf_directory, fleet_paths):
+    manifest = get_manifest([('111111', 'first', 1), ('222222', 'second', 1), ('333333', 'third', 1)])
+    run_fleet(manifest, cf_directory, max_workers=6, per_account=1, per_region=2, **fleet_paths)
+    assert recorder.peaks[('region', 'us-east-1')] == 2
+
+
+def test_deploy_fleet_entry_error_does_not_stop_the_fleet(recorder, cf_directory, fleet_paths):
+    manifest = get_manifest([('111111', 'first', 2), ('222222', 'second', 1)])
+    manifest[0]['cidr'] = 'not a range'
+    fleet_results = run_fleet(manifest, cf_directory, max_workers=3, per_account=1, **fleet_paths)
+
+    assert [fleet_result['entry'] for fleet_result in fleet_results] == manifest
+    assert fleet_results[0]['results'] is None
+    assert 'not a range' in fleet_results[0]['error']
+    for fleet_result in fleet_results[1:]:
+        assert fleet_result['error'] is None
+        assert fleet_result['results']['stack_failures'] == {}
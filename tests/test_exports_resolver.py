@@ -0,0 +1,57 @@
+import json
+
+from exports_resolver import rewrite_template_imports
+
+
+S3_VPC_TEMPLATE = '''
+AWSTemplateFormatVersion: 2010-09-09
+Parameters:
+  VPCID:
+    Type: AWS::EC2::VPC::Id
+  RouteTableIdsList:
+    Type: CommaDelimitedList
+  Environment:
+    Type: String
+Resources:
+  VPCEndpoint:
+    Type: AWS::EC2::VPCEndpoint
+    Properties:
+      VpcId: !Ref VPCID
+      RouteTableIds: !Ref RouteTableIdsList
+      ServiceName: !Sub 'com.amazonaws.${AWS::Region}.s3'
+      Tags:
+        - Key: Name
+          Value: !Sub '${Environment}-${VPCID}-endpoint'
+        - Key: RouteTables
+          Value: !Sub '${RouteTableIdsList}'
+        - Key: Shadowed
+          Value: !Sub ['${VPCID}', {VPCID: local}]
+'''
+
+PARAMETER_EXPORTS = {'VPCID': 'prod-BaseNetwork-VPCID',
+                     'RouteTableIdsList': ['prod-BaseNetwork-RouteTablePublic',
+                                           'prod-BaseNetwork-RouteTablePrivateAZ1']}
+
+
+def test_rewrite_template_imports_yaml_template():
+    template = json.loads(rewrite_template_imports(S3_VPC_TEMPLATE, PARAMETER_EXPORTS))
+    # An unquoted YAML date stays a string
+    assert template['AWSTemplateFormatVersion'] == '2010-09-09'
+    assert list(template['Parameters']) == ['Environment']
+    properties = template['Resources']['VPCEndpoint']['Properties']
+    assert properties['VpcId'] == {'Fn::ImportValue': 'prod-BaseNetwork-VPCID'}
+    assert properties['RouteTableIds'] == [{'Fn::ImportValue': 'prod-BaseNetwork-RouteTablePublic'},
+                                           {'Fn::ImportValue': 'prod-BaseNetwork-RouteTablePrivateAZ1'}]
+    assert properties['ServiceName'] == {'Fn::Sub': 'com.amazonaws.${AWS::Region}.s3'}
+
+
+def test_rewrite_template_imports_sub_references():
+    template = json.loads(rewrite_template_imports(S3_VPC_TEMPLATE, PARAMETER_EXPORTS))
+    tags = template['Resources']['VPCEndpoint']['Properties']['Tags']
+    assert tags[0]['Value'] == {'Fn::Sub': ['${Environment}-${VPCID}-endpoint',
+                                            {'VPCID': {'Fn::ImportValue': 'prod-BaseNetwork-VPCID'}}]}
+    assert tags[1]['Value'] == {'Fn::Sub': ['${RouteTableIdsList}', {'RouteTableIdsList': {'Fn::Join': [',', [
+        {'Fn::ImportValue': 'prod-BaseNetwork-RouteTablePublic'},
+        {'Fn::ImportValue': 'prod-BaseNetwork-RouteTablePrivateAZ1'}]]}}]}
+    # A variable the Sub defines itself is not the parameter
+    assert tags[2]['Value'] == {'Fn::Sub': ['${VPCID}', {'VPCID': 'local'}]}
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import api_governor
+import instrumentation
+from aws_clients import get_client
+from instrumentation import RunTracer, trace_phase
+
+
+CREDENTIALS = {'aws_access_key_id': 'key', 'aws_secret_access_key': 'secret', 'aws_session_token': None,
+               'region_name': 'us-east-1'}
+
+
+@pytest.fixture
+def run_tracer(aws_endpoint, monkeypatch):
+    # An active run trace over real boto3 clients, with fast retries
+    run_tracer = RunTracer()
+    monkeypatch.setattr(instrumentation, 'run_tracer', run_tracer)
+    monkeypatch.setattr(api_governor, 'THROTTLE_BASE_DELAY', 0.001)
+    return run_tracer
+
+
+def test_run_tracer_records_calls(run_tracer, aws_endpoint, tmp_path):
+    aws_endpoint.errors['DescribeStacks'] = ['Throttling']
+    with trace_phase('deploy'):
+        cf = get_client('cloudformation', CREDENTIALS)
+        cf.describe_stacks()
+        cf.describe_stacks(StackName='prod-BaseNetwork')
+
+    calls = run_tracer.get_records()[1]
+    assert [(call['service'], call['operation']) for call in calls] == [('cloudformation', 'DescribeStacks')] * 2
+    # The first call was throttled once, then retried by the governor
+    assert [(call['attempts'], call['retries'], call['throttles']) for call in calls] == [(2, 1, 1), (1, 0, 0)]
+    for call in calls:
+        assert call['status_code'] == 200
+        assert call['error'] is None
+        assert call['bytes_sent'] > 0
+        assert call['bytes_received'] > 0
+
+    assert run_tracer.get_summary() == [{
+        'operation': 'cloudformation:DescribeStacks', 'count': 2,
+        'total_seconds': calls[0]['duration'] + calls[1]['duration'],
+        'max_seconds': max(calls[0]['duration'], calls[1]['duration']), 'retries': 1, 'throttles': 1, 'errors': 0,
+        'bytes_sent': calls[0]['bytes_sent'] + calls[1]['bytes_sent'],
+        'bytes_received': calls[0]['bytes_received'] + calls[1]['bytes_received']}]
+
+    report_file = str(tmp_path / 'report.json')
+    run_tracer.write_report(report_file)
+    with open(report_file) as f:
+        report = json.load(f)
+    assert [phase['name'] for phase in report['phases']] == ['deploy']
+    assert report['api_calls'] == run_tracer.get_summary()
+    trace_events = report['traceEvents']
+    assert [(trace_event['name'], trace_event['cat']) for trace_event in trace_events] == [
+        ('deploy', 'phase'), ('cloudformation:DescribeStacks', 'api'), ('cloudformation:DescribeStacks', 'api')]
+    phase_event = trace_events[0]
+    for trace_event in trace_events:
+        assert trace_event['ph'] == 'X'
+        assert trace_event['ts'] >= 0
+        # Every call falls inside the phase that made it
+        assert phase_event['ts'] <= trace_event['ts']
+        assert trace_event['ts'] + trace_event['dur'] <= phase_event['ts'] + phase_event['dur'] + 1
+    assert trace_events[1]['args']['retries'] == 1
@@ -0,0 +1,49 @@
+import json
+import os
+
+import pytest
+
+from deploy_settings import CF_TEMPLATES_LIST
+from parameter_files import create_parameters_files, get_parameter_settings
+
+
+def read_parameters(file_path):
+    with open(file_path) as f:
+        return dict([(parameter['ParameterKey'], parameter['ParameterValue']) for parameter in json.load(f)])
+
+
+def test_create_parameters_files_merges_settings(cf_directory, tmp_path):
+    settings = get_parameter_settings({'ddi': '123456', 'raw_account_name': 'Test Account', 'environment': 'Prod',
+                                       'cidr': '10.0.0.0/16', 'az_count': '3'})
+    output_directory = str(tmp_path / 'parameters')
+    parameters_files = create_parameters_files(cf_directory, CF_TEMPLATES_LIST, output_directory, settings,
+                                               ['json', 'overrides'])
+
+    assert parameters_files['failed'] == {}
+    assert len(parameters_files['written']) == 2 * len(CF_TEMPLATES_LIST)
+    base_network = read_parameters(os.path.join(output_directory, 'base_network.template.parameters'))
+    assert base_network['CIDRRange'] == '10.0.0.0/16'
+    assert base_network['PrivateSubnetAZ3'] == '10.0.48.0/21'
+    assert base_network['AvailabilityZoneCount'] == '3 AZs :: 6 Subnets'
+    # Upstream stack outputs are left to the template default
+    assert read_parameters(os.path.join(output_directory, 's3_vpc.template.parameters'))['VPCID'] == ''
+    with open(os.path.join(output_directory, 'sns_topic_subscriptions.template.overrides.json')) as f:
+        assert 'DisplayName=test-account' in json.load(f)
+
+
+def test_create_parameters_files_template_defaults(cf_directory, tmp_path):
+    parameters_files = create_parameters_files(cf_directory, ['s3_vpc.template'], str(tmp_path))
+    assert parameters_files['written'] == [str(tmp_path / 's3_vpc.template.parameters')]
+    assert read_parameters(parameters_files['written'][0]) == {'RouteTableIdsList': '', 'VPCID': ''}
+
+
+def test_create_parameters_files_failures(cf_directory, tmp_path):
+    with open(os.path.join(cf_directory, 'broken.template'), 'w') as f:
+        f.write('{not a template')
+    parameters_files = create_parameters_files(cf_directory, ['broken.template', 's3_vpc.template'], str(tmp_path))
+    assert list(parameters_files['failed']) == ['broken.template']
+    assert parameters_files['written'] == [str(tmp_path / 's3_vpc.template.parameters')]
+
+    with pytest.raises(ValueError):
+        create_parameters_files(cf_directory, ['s3_vpc.template'], str(tmp_path / 'other'), file_formats=['xml'])
+    assert not os.listdir(str(tmp_path / 'other'))
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+import preflight
+from aws_clients import get_client
+from deploy_fleet import get_fleet_settings
+from deploy_pipeline import deploy_environment
+from deploy_settings import set_ec2_key_name, set_s3_bucket_name
+from fake_aws import FakeCloudFormationClient, get_client_error
+from preflight import run_preflight
+
+
+ENTRY = {'ddi': '123456', 'account_name': 'Test Account', 'region': 'us-east-1', 'profile': 'test',
+         'stack_prefix': 'prod', 'environment': 'Prod', 'cidr': '10.0.0.0/16'}
+
+
+@pytest.fixture
+def settings(fake_aws, cf_directory):
+    return get_fleet_settings(ENTRY, cf_directory)
+
+
+def run_settings_preflight(settings):
+    return run_preflight(settings, set_s3_bucket_name(settings['ddi'], settings['raw_account_name']),
+                         set_ec2_key_name(settings['raw_account_name'], settings['environment'], settings['region']))
+
+
+def test_preflight_passes(settings, fake_aws):
+    # A missing bucket and key pair are created by the run, not reported
+    assert run_settings_preflight(settings) == {'errors': [], 'warnings': []}
+    assert fake_aws.buckets == {}
+    assert fake_aws.key_pairs == {}
+
+
+def test_preflight_existing_key_pair_is_a_warning(settings):
+    ec2_key_name = set_ec2_key_name(settings['raw_account_name'], settings['environment'], settings['region'])
+    get_client('ec2', settings['credentials']).create_key_pair(KeyName=ec2_key_name)
+    assert run_settings_preflight(settings) == {
+        'errors': [], 'warnings': ['EC2 key pair "' + ec2_key_name + '" already exists; no key file is written']}
+
+
+def test_preflight_bucket_of_another_account(settings):
+    s3_bucket_name = set_s3_bucket_name(settings['ddi'], settings['raw_account_name'])
+    get_client('s3', {'profile_name': 'other', 'region_name': 'us-east-1'}).create_bucket(Bucket=s3_bucket_name)
+    assert run_settings_preflight(settings)['errors'] == [
+        'S3 bucket "' + s3_bucket_name + '" exists but is not accessible with these credentials']
+
+
+def test_preflight_account_limits(settings, fake_aws, monkeypatch):
+    # Too few availability zones is a failed check; a check that cannot run,
+    # here because CloudFormation refuses the call, is an error too
+    fake_aws.availability_zones = ['a', 'b']
+
+    def describe_stacks(self, **kwargs):
+        def describe_stacks():
+            raise get_client_error('LimitExceededException', 'Account limit exceeded', 'DescribeStacks')
+        return self.call('cloudformation:DescribeStacks', describe_stacks)
+
+    monkeypatch.setattr(FakeCloudFormationClient, 'describe_stacks', describe_stacks)
+    preflight_results = run_settings_preflight(dict(settings, az_count='3'))
+    assert preflight_results['warnings'] == []
+    assert sorted(preflight_results['errors']) == [
+        'stacks check failed: An error occurred (LimitExceededException) when calling the DescribeStacks '
+        'operation: Account limit exceeded',
+        'us-east-1 has 2 available availability zones, 3 are needed']
+
+
+def test_preflight_runs_checks_in_parallel(settings, monkeypatch):
+    # Every check waits for all the others; run one at a time they would
+    # time out
+    checks = ['credentials', 'bucket', 'key pair', 'stacks']
+    barrier = threading.Barrier(len(checks), timeout=5)
+
+    def get_check(name):
+        def check(settings, context):
+            barrier.wait()
+            return [('warning', name)]
+        return check
+
+    monkeypatch.setattr(preflight, 'get_preflight_checks',
+                        lambda settings, stack_keys, ec2_key_name=None: [(name, get_check(name)) for name in checks])
+    assert run_settings_preflight(settings) == {'errors': [], 'warnings': checks}
+
+
+def test_preflight_failure_creates_nothing(settings, fake_aws, state_store, tmp_path, monkeypatch):
+    # Every problem is reported at once and the run stops before the bucket,
+    # templates, stacks or key pair are created
+    monkeypatch.chdir(tmp_path)
+    s3_bucket_name = set_s3_bucket_name(settings['ddi'], settings['raw_account_name'])
+    get_client('s3', {'profile_name': 'other', 'region_name': 'us-east-1'}).create_bucket(Bucket=s3_bucket_name)
+    fake_aws.availability_zones = ['a']
+    call_counts = dict(fake_aws.call_counts)
+    with pytest.raises(RuntimeError) as e:
+        deploy_environment(settings)
+    assert str(e.value) == 'Pre-flight checks failed: S3 bucket "' + s3_bucket_name + '" exists but is not ' \
+        'accessible with these credentials; us-east-1 has 1 available availability zones, 2 are needed'
+    assert [operation for operation in fake_aws.call_counts if fake_aws.call_counts[operation] !=
+            call_counts.get(operation) and operation.split(':')[1].startswith(('Create', 'Put', 'Upload'))] == []
+    assert fake_aws.stacks == {}
+    assert fake_aws.key_pairs == {}
@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from deploy_fleet import get_fleet_settings
+from deploy_pipeline import deploy_environment
+from run_journal import RunJournal, get_journal_file, get_journal_settings, get_latest_journal_file, run_step
+
+
+ENTRY = {'ddi': '123456', 'account_name': 'Test Account', 'region': 'us-east-1', 'profile': 'test',
+         'stack_prefix': 'prod', 'environment': 'Prod', 'cidr': '10.0.0.0/16'}
+
+
+def read_steps(journal_file):
+    with open(journal_file) as f:
+        return [json.loads(line)['step'] for line in f]
+
+
+def test_journal_resume_ignores_torn_line(tmp_path):
+    journal_file = str(tmp_path / 'journals' / 'run.jsonl')
+    journal = RunJournal(journal_file)
+    journal.record_step('settings', {'ddi': '123456'})
+    journal.record_step('create_s3_bucket', {'s3_bucket_name': 'bucket'})
+    with open(journal_file, 'a') as f:
+        f.write('{"step": "stack BaseNet')
+
+    resumed = RunJournal(journal_file, resume=True)
+    assert resumed.get_step('create_s3_bucket') == {'s3_bucket_name': 'bucket'}
+    assert not resumed.has_step('stack BaseNetwork')
+    assert not resumed.get_complete()
+    # Without resume the earlier run is discarded
+    assert not RunJournal(journal_file).has_step('settings')
+    with open(journal_file) as f:
+        assert f.read() == ''
+
+
+def test_run_step_skips_journaled_steps(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run.jsonl'))
+    calls = []
+
+    def step(value):
+        calls.append(value)
+        return {'value': value}
+
+    assert run_step(journal, 'step', step, 1) == {'value': 1}
+    assert run_step(journal, 'step', step, 2) == {'value': 1}
+    assert run_step(None, 'step', step, 3) == {'value': 3}
+    assert calls == [1, 3]
+    assert RunJournal(str(tmp_path / 'run.jsonl'), resume=True).get_step('step') == {'value': 1}
+
+
+def test_journal_default_directory(cache_paths):
+    # Without a journal_directory the JOURNAL_DIRECTORY of the moment is used
+    journal_file = get_journal_file(ENTRY)
+    assert journal_file == str(cache_paths / 'journals' / '123456-us-east-1-prod.jsonl')
+    assert get_latest_journal_file() is None
+    RunJournal(journal_file).record_step('settings', {'ddi': '123456'})
+    assert get_latest_journal_file() == journal_file
+
+
+def test_journal_settings():
+    journal_settings = get_journal_settings({'ddi': '123456', 'credentials': {'profile_name': 'test'},
+                                             'dry_run': False, 'tail_events': True, 'events_file': None,
+                                             'cf_templates_list': ('base_network.template',)})
+    assert journal_settings == {'ddi': '123456', 'profile': 'test', 'cf_templates_list': ['base_network.template']}
+
+
+def test_deploy_environment_resume(fake_aws, state_store, cf_directory, tmp_path, monkeypatch):
+    # A run that crashes after its stacks picks up at the key pair, and a
+    # completed run makes no AWS calls at all
+    monkeypatch.chdir(tmp_path)
+    settings = get_fleet_settings(ENTRY, cf_directory)
+    journal_file = str(tmp_path / 'journals' / 'prod.jsonl')
+
+    def crash(ec2, ec2_key_name):
+        raise RuntimeError('crashed')
+
+    with monkeypatch.context() as crash_monkeypatch:
+        crash_monkeypatch.setattr('deploy_pipeline.create_ec2_key_file', crash)
+        with pytest.raises(RuntimeError, match='crashed'):
+            deploy_environment(settings, RunJournal(journal_file))
+    assert 'stack SNSTopicSubscriptions' in read_steps(journal_file)
+    assert 'complete' not in read_steps(journal_file)
+
+    call_counts = dict(fake_aws.call_counts)
+    results = deploy_environment(settings, RunJournal(journal_file, resume=True))
+    assert results['stack_failures'] == {}
+    assert sorted(results['stack_results']) == ['BaseNetwork', 'Route53InternalZone', 'S3VPCEndpoint',
+                                                'SNSTopicSubscriptions']
+    resumed_calls = dict([(operation, fake_aws.call_counts[operation] - call_counts.get(operation, 0))
+                          for operation in fake_aws.call_counts
+                          if fake_aws.call_counts[operation] != call_counts.get(operation, 0)])
+    assert resumed_calls == {'ec2:CreateKeyPair': 1}
+    assert read_steps(journal_file)[-1] == 'complete'
+
+    call_counts = dict(fake_aws.call_counts)
+    resumed_results = deploy_environment(settings, RunJournal(journal_file, resume=True))
+    assert fake_aws.call_counts == call_counts
+    assert resumed_results['ec2_key'] == results['ec2_key']
+    assert resumed_results['stack_results'] == results['stack_results']
+
+
+def test_deploy_environment_resume_settings_mismatch(fake_aws, state_store, cf_directory, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal_file = str(tmp_path / 'prod.jsonl')
+    journal = RunJournal(journal_file)
+    journal.record_step('settings', get_journal_settings(get_fleet_settings(ENTRY, cf_directory)))
+
+    settings = get_fleet_settings(dict(ENTRY, cidr='10.1.0.0/16'), cf_directory)
+    with pytest.raises(RuntimeError, match='settings differ'):
+        deploy_environment(settings, RunJournal(journal_file, resume=True))
+    assert read_steps(journal_file) == ['settings']
+    # Only the API governor's account lookup; nothing was deployed
+    assert fake_aws.call_counts == {'sts:GetCallerIdentity': 1}
@@ -0,0 +1,63 @@
+import pytest
+
+import run_spec
+
+
+def patch_input(monkeypatch, answers):
+    prompts = []
+    answers = iter(answers)
+
+    def fake_input(prompt):
+        prompts.append(prompt)
+        return next(answers)
+    monkeypatch.setattr('builtins.input', fake_input)
+    return prompts
+
+
+def test_prompt_setting_reads_input(monkeypatch):
+    prompts = patch_input(monkeypatch, ['eu-west-1'])
+    assert run_spec.prompt_setting({}, 'region', 'Region (us-east-1): ', 'us-east-1') == 'eu-west-1'
+    assert prompts == ['Region (us-east-1): ']
+
+
+def test_prompt_setting_blank_keeps_default(monkeypatch):
+    patch_input(monkeypatch, [''])
+    assert run_spec.prompt_setting({}, 'region', 'Region (us-east-1): ', 'us-east-1') == 'us-east-1'
+
+
+def test_prompt_setting_asks_again_for_value_not_allowed(monkeypatch):
+    prompts = patch_input(monkeypatch, ['4', '3'])
+    assert run_spec.prompt_setting({}, 'az_count', 'Availability Zone Count (2): ', '2') == '3'
+    assert len(prompts) == 2
+
+
+def test_prompt_setting_run_settings_do_not_prompt(monkeypatch):
+    patch_input(monkeypatch, [])
+    assert run_spec.prompt_setting({'region': 'eu-west-1'}, 'region', 'Region: ', 'us-east-1') == 'eu-west-1'
+
+
+def test_prompt_setting_non_interactive(monkeypatch):
+    patch_input(monkeypatch, [])
+    assert run_spec.prompt_setting({}, 'region', 'Region: ', 'us-east-1', interactive=False) == 'us-east-1'
+    with pytest.raises(ValueError):
+        run_spec.prompt_setting({}, 'ddi', 'Account: ', '', required=True, interactive=False)
+    with pytest.raises(ValueError):
+        run_spec.prompt_setting({'az_count': '5'}, 'az_count', 'Availability Zone Count (2): ', '2')
+
+
+def test_get_spec_defaults_from_defaults_file():
+    spec_defaults = run_spec.get_spec_defaults()
+    assert spec_defaults['region'] == 'us-east-1'
+    assert spec_defaults['az_count'] == '2'
+    assert spec_defaults['sns_protocol_1'] == 'email'
+    assert spec_defaults['ddi'] == ''
+    # Example values in the defaults file are not defaults
+    assert spec_defaults['sns_endpoint_1'] == ''
+    assert spec_defaults['raw_sns_topic_name'] == ''
+
+
+def test_get_setting_sections_in_defaults_file_order():
+    setting_sections = run_spec.get_setting_sections()
+    assert [section_name for section_name, settings in setting_sections][:2] == ['Account', 'VPC Parameters']
+    assert dict(setting_sections)['Base Network'] == ['az_count', 'cidr']
+    assert run_spec.get_setting_prompt('region', 'us-east-1') == 'Region (us-east-1): '
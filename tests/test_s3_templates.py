@@ -0,0 +1,130 @@
+import hashlib
+
+import pytest
+from boto3.s3.transfer import TransferConfig
+
+import s3_templates
+from aws_clients import get_client
+from s3_templates import LIFECYCLE_RULE, get_file_etag, setup_template_bucket, upload_templates
+
+
+CREDENTIALS = {'profile_name': 'test', 'region_name': 'us-east-1'}
+
+
+def write_file(tmp_path, name, body):
+    path = tmp_path / name
+    path.write_bytes(body)
+    return str(path)
+
+
+def test_get_file_etag_single_part(tmp_path):
+    body = b'{"Resources": {}}'
+    assert get_file_etag(write_file(tmp_path, 'a.template', body)) == hashlib.md5(body).hexdigest()
+
+
+def test_get_file_etag_empty_file(tmp_path):
+    assert get_file_etag(write_file(tmp_path, 'empty.template', b'')) == hashlib.md5(b'').hexdigest()
+
+
+def test_get_file_etag_multipart(tmp_path):
+    # The MD5 of the part MD5s, then the part count
+    body = b'a' * 10 + b'b' * 10 + b'c' * 5
+    part_digests = b''.join([hashlib.md5(part).digest() for part in [b'a' * 10, b'b' * 10, b'c' * 5]])
+    assert get_file_etag(write_file(tmp_path, 'big.template', body), chunk_size=10, multipart_threshold=10) == \
+        hashlib.md5(part_digests).hexdigest() + '-3'
+
+
+@pytest.mark.parametrize('size, etag_parts', [(9, None), (10, 1), (11, 2)])
+def test_get_file_etag_at_multipart_threshold(tmp_path, size, etag_parts):
+    # s3transfer uploads a file of multipart_threshold bytes or more in
+    # parts, even when that is a single part
+    body = b'x' * size
+    etag = get_file_etag(write_file(tmp_path, 'a.template', body), chunk_size=10, multipart_threshold=10)
+    if etag_parts is None:
+        assert etag == hashlib.md5(body).hexdigest()
+    else:
+        parts = [body[position:position + 10] for position in range(0, size, 10)]
+        assert etag == hashlib.md5(b''.join([hashlib.md5(part).digest() for part in parts])).hexdigest() + \
+            '-' + str(etag_parts)
+
+
+def test_upload_templates_skips_unchanged_multipart_files(fake_aws, tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_templates, 'TRANSFER_CONFIG', TransferConfig(multipart_threshold=10,
+                                                                        multipart_chunksize=10))
+    s3 = get_client('s3', CREDENTIALS)
+    s3.create_bucket(Bucket='bucket')
+    write_file(tmp_path, 'threshold.template', b'x' * 10)
+    write_file(tmp_path, 'larger.template', b'x' * 11)
+    cf_templates_list = ['threshold.template', 'larger.template']
+    upload_templates(s3, 'bucket', 'cf', str(tmp_path), cf_templates_list)
+    assert upload_templates(s3, 'bucket', 'cf', str(tmp_path), cf_templates_list) == \
+        {'uploaded': [], 'skipped': cf_templates_list}
+
+
+def test_upload_templates_skips_unchanged_files(fake_aws, tmp_path):
+    s3 = get_client('s3', CREDENTIALS)
+    s3.create_bucket(Bucket='bucket')
+    write_file(tmp_path, 'a.template', b'a')
+    write_file(tmp_path, 'b.template', b'b')
+    assert upload_templates(s3, 'bucket', 'cf', str(tmp_path), ['a.template', 'b.template']) == \
+        {'uploaded': ['a.template', 'b.template'], 'skipped': []}
+
+    write_file(tmp_path, 'b.template', b'changed')
+    assert upload_templates(s3, 'bucket', 'cf', str(tmp_path), ['a.template', 'b.template']) == \
+        {'uploaded': ['b.template'], 'skipped': ['a.template']}
+    assert fake_aws.call_counts['s3:PutObject'] == 3
+
+
+def get_put_counts(fake_aws):
+    return dict([(operation, fake_aws.call_counts.get(operation, 0))
+                 for operation in ['s3:CreateBucket', 's3:PutBucketVersioning', 's3:PutBucketLifecycleConfiguration']])
+
+
+def test_setup_template_bucket_creates_and_configures(fake_aws):
+    s3 = get_client('s3', CREDENTIALS)
+    assert setup_template_bucket(s3, 'bucket', 'us-east-1') == \
+        ['create_bucket', 'put_bucket_versioning', 'put_bucket_lifecycle_configuration']
+    assert fake_aws.buckets['bucket']['versioning'] == 'Enabled'
+    assert fake_aws.buckets['bucket']['lifecycle'] == [LIFECYCLE_RULE]
+
+    # A bucket already set up is only read
+    assert setup_template_bucket(s3, 'bucket', 'us-east-1') == []
+    assert get_put_counts(fake_aws) == {'s3:CreateBucket': 1, 's3:PutBucketVersioning': 1,
+                                        's3:PutBucketLifecycleConfiguration': 1}
+
+
+def test_setup_template_bucket_applies_only_changed_settings(fake_aws):
+    s3 = get_client('s3', CREDENTIALS)
+    s3.create_bucket(Bucket='bucket')
+    s3.put_bucket_versioning(Bucket='bucket', VersioningConfiguration={'Status': 'Enabled'})
+    other_rule = {'ID': 'Other', 'Prefix': 'logs/', 'Status': 'Enabled', 'Expiration': {'Days': 30}}
+    s3.put_bucket_lifecycle_configuration(Bucket='bucket', LifecycleConfiguration={'Rules': [other_rule]})
+    put_counts = get_put_counts(fake_aws)
+
+    assert setup_template_bucket(s3, 'bucket', 'us-east-1') == ['put_bucket_lifecycle_configuration']
+    put_counts['s3:PutBucketLifecycleConfiguration'] += 1
+    assert get_put_counts(fake_aws) == put_counts
+    # The other rule is kept, moved to a Filter
+    assert fake_aws.buckets['bucket']['lifecycle'] == [
+        {'ID': 'Other', 'Filter': {'Prefix': 'logs/'}, 'Status': 'Enabled', 'Expiration': {'Days': 30}},
+        LIFECYCLE_RULE]
+
+
+def test_setup_template_bucket_dry_run(fake_aws):
+    s3 = get_client('s3', CREDENTIALS)
+    assert setup_template_bucket(s3, 'bucket', 'us-east-1', dry_run=True) == \
+        ['create_bucket', 'put_bucket_versioning', 'put_bucket_lifecycle_configuration']
+    assert 'bucket' not in fake_aws.buckets
+
+    s3.create_bucket(Bucket='bucket')
+    assert setup_template_bucket(s3, 'bucket', 'us-east-1', dry_run=True) == \
+        ['put_bucket_versioning', 'put_bucket_lifecycle_configuration']
+    assert get_put_counts(fake_aws) == {'s3:CreateBucket': 1, 's3:PutBucketVersioning': 0,
+                                        's3:PutBucketLifecycleConfiguration': 0}
+
+
+def test_setup_template_bucket_owned_by_another_account(fake_aws):
+    get_client('s3', {'profile_name': 'other', 'region_name': 'us-east-1'}).create_bucket(Bucket='bucket')
+    with pytest.raises(ValueError, match='not accessible'):
+        setup_template_bucket(get_client('s3', CREDENTIALS), 'bucket', 'us-east-1')
+    assert fake_aws.call_counts['s3:CreateBucket'] == 1
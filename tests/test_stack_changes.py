@@ -0,0 +1,85 @@
+import pytest
+
+import stack_changes
+from aws_clients import get_client
+from stack_changes import update_stack
+
+
+TEMPLATE_URL = 'https://bucket/sns_topic_subscriptions.template'
+
+
+def get_parameters(display_name):
+    return [{'ParameterKey': 'DisplayName', 'ParameterValue': display_name}]
+
+
+@pytest.fixture
+def cf(fake_aws):
+    # A finished stack to update
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    cf.create_stack(StackName='prod-Topic', TemplateURL=TEMPLATE_URL, Parameters=get_parameters('Topic'))
+    fake_aws.stacks[('test', 'us-east-1', 'prod-Topic')]['CompleteTime'] = 0
+    return cf
+
+
+def test_update_stack_executes_change_set(cf, fake_aws):
+    assert update_stack(cf, 'prod-Topic', TEMPLATE_URL, get_parameters('New Topic'))
+    stack = fake_aws.stacks[('test', 'us-east-1', 'prod-Topic')]
+    assert stack['StackStatus'] == 'UPDATE_IN_PROGRESS'
+    assert stack['Parameters'] == get_parameters('New Topic')
+    assert stack['ChangeSets'] == {}
+
+
+def test_update_stack_without_changes(cf, fake_aws):
+    # The empty change set is deleted and the stack left as it is
+    assert not update_stack(cf, 'prod-Topic', TEMPLATE_URL, get_parameters('Topic'))
+    stack = fake_aws.stacks[('test', 'us-east-1', 'prod-Topic')]
+    assert stack['StackStatus'] == 'CREATE_COMPLETE'
+    assert stack['ChangeSets'] == {}
+    assert fake_aws.call_counts['cloudformation:DeleteChangeSet'] == 1
+    assert 'cloudformation:ExecuteChangeSet' not in fake_aws.call_counts
+
+
+class ChangeSetClient(object):
+    # Every change set is described with status and status_reason
+
+    def __init__(self, status, status_reason=''):
+        self.status = status
+        self.status_reason = status_reason
+        self.calls = []
+
+    def create_change_set(self, **kwargs):
+        self.calls.append('create')
+
+    def describe_change_set(self, StackName, ChangeSetName):
+        self.calls.append('describe')
+        return {'Status': self.status, 'StatusReason': self.status_reason}
+
+    def delete_change_set(self, StackName, ChangeSetName):
+        self.calls.append('delete')
+
+    def execute_change_set(self, StackName, ChangeSetName):
+        self.calls.append('execute')
+
+
+def test_update_stack_change_set_failed():
+    cf = ChangeSetClient('FAILED', 'Parameter values specified for a template which does not require them.')
+    with pytest.raises(RuntimeError, match='prod-Topic change set failed: Parameter values'):
+        update_stack(cf, 'prod-Topic', TEMPLATE_URL, get_parameters('Topic'))
+    assert cf.calls == ['create', 'describe', 'delete']
+
+
+def test_update_stack_change_set_timeout(monkeypatch):
+    # A change set that is never computed is given up on and deleted
+    monkeypatch.setattr(stack_changes, 'CHANGE_SET_WAIT_TIMEOUT', 0)
+    cf = ChangeSetClient('CREATE_PENDING')
+    with pytest.raises(RuntimeError, match='prod-Topic change set was still CREATE_PENDING after 0 seconds'):
+        update_stack(cf, 'prod-Topic', TEMPLATE_URL, get_parameters('Topic'))
+    assert cf.calls == ['create', 'describe', 'delete']
+
+
+def test_wait_for_change_set_polls_until_timeout():
+    cf = ChangeSetClient('CREATE_IN_PROGRESS')
+    change_set = stack_changes.wait_for_change_set(cf, 'prod-Topic', 'change', initial_delay=0.01, max_delay=0.01,
+                                                   timeout=0.05)
+    assert change_set['Status'] == 'CREATE_IN_PROGRESS'
+    assert cf.calls.count('describe') > 1
@@ -0,0 +1,103 @@
+import json
+import threading
+
+from stack_events import StackEventTailer, get_stack_event_record
+
+
+class StackEventsClient(object):
+    # Keeps each stack's events newest first, as describe_stack_events
+    # returns them, in pages of page_size
+
+    def __init__(self, page_size=100):
+        self.page_size = page_size
+        self.stack_events = {}
+        self.lock = threading.Lock()
+
+    def add_event(self, stack_name, logical_resource_id, resource_status):
+        with self.lock:
+            stack_events = self.stack_events.setdefault(stack_name, [])
+            stack_events.insert(0, {'EventId': stack_name + '-' + str(len(stack_events)), 'StackName': stack_name,
+                                    'LogicalResourceId': logical_resource_id, 'ResourceStatus': resource_status,
+                                    'ResourceType': 'AWS::EC2::VPC', 'Timestamp': '2026-10-18 12:00:00+00:00'})
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        with self.lock:
+            start = int(NextToken or 0)
+            page = {'StackEvents': list(self.stack_events.get(StackName, [])[start:start + self.page_size])}
+            if start + self.page_size < len(self.stack_events.get(StackName, [])):
+                page['NextToken'] = str(start + self.page_size)
+            return page
+
+
+def read_lines(events_path):
+    with open(events_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_tailer_writes_each_event_once(tmp_path):
+    cf = StackEventsClient(page_size=2)
+    cf.add_event('prod-BaseNetwork', 'prod-BaseNetwork', 'UPDATE_COMPLETE')
+    events_path = str(tmp_path / 'events.jsonl')
+    with open(events_path, 'a') as events_file:
+        tailer = StackEventTailer(cf, console=False, json_file=events_file, label='alpha')
+        # Events from before follow are not written
+        with tailer.condition:
+            tailer.followed['prod-BaseNetwork'] = tailer.get_latest_event_id('prod-BaseNetwork')
+        assert tailer.read_stack('prod-BaseNetwork') == 0
+
+        # More new events than fit on a page are all read, oldest first, and
+        # a later poll only reads the events after them
+        for logical_resource_id in ['prod-BaseNetwork', 'VPC', 'VPC']:
+            cf.add_event('prod-BaseNetwork', logical_resource_id, 'UPDATE_IN_PROGRESS')
+        assert tailer.read_stack('prod-BaseNetwork') == 3
+        assert tailer.read_stack('prod-BaseNetwork') == 0
+        cf.add_event('prod-BaseNetwork', 'prod-BaseNetwork', 'UPDATE_COMPLETE')
+        tailer.unfollow('prod-BaseNetwork')
+        assert tailer.read_stack('prod-BaseNetwork') == 0
+
+    records = read_lines(events_path)
+    assert [record['EventId'] for record in records] == ['prod-BaseNetwork-1', 'prod-BaseNetwork-2',
+                                                         'prod-BaseNetwork-3', 'prod-BaseNetwork-4']
+    assert records[0] == {'EventId': 'prod-BaseNetwork-1', 'StackName': 'prod-BaseNetwork',
+                          'LogicalResourceId': 'prod-BaseNetwork', 'ResourceType': 'AWS::EC2::VPC',
+                          'ResourceStatus': 'UPDATE_IN_PROGRESS', 'Timestamp': '2026-10-18 12:00:00+00:00',
+                          'Label': 'alpha'}
+
+
+def test_stack_event_record_without_label():
+    event = {'EventId': '1', 'StackName': 'prod-BaseNetwork', 'LogicalResourceId': 'VPC',
+             'ResourceStatus': 'CREATE_FAILED', 'ResourceStatusReason': 'Limit exceeded', 'Timestamp': 0,
+             'ResourceProperties': '{}'}
+    assert get_stack_event_record(event) == {'EventId': '1', 'StackName': 'prod-BaseNetwork',
+                                             'LogicalResourceId': 'VPC', 'ResourceStatus': 'CREATE_FAILED',
+                                             'ResourceStatusReason': 'Limit exceeded', 'Timestamp': '0'}
+
+
+def test_tailers_share_an_events_file(tmp_path):
+    # deploy_fleet gives every worker's tailer the same file; output_lock
+    # keeps their lines whole
+    cf = StackEventsClient()
+    events_path = str(tmp_path / 'events.jsonl')
+    labels = ['account-' + str(position) for position in range(8)]
+    with open(events_path, 'a', buffering=1) as events_file:
+        def tail(label):
+            tailer = StackEventTailer(cf, console=False, json_file=events_file, label=label)
+            stack_name = label + '-BaseNetwork'
+            with tailer.condition:
+                tailer.followed[stack_name] = None
+            for position in range(50):
+                cf.add_event(stack_name, 'Resource' + str(position) + 'x' * 500, 'CREATE_IN_PROGRESS')
+                tailer.read_stack(stack_name)
+            tailer.unfollow(stack_name)
+
+        threads = [threading.Thread(target=tail, args=(label,)) for label in labels]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    records = read_lines(events_path)
+    assert len(records) == len(labels) * 50
+    for label in labels:
+        assert [record['LogicalResourceId'] for record in records if record['Label'] == label] == \
+            ['Resource' + str(position) + 'x' * 500 for position in range(50)]
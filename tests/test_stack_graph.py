@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import stack_graph
+from deploy_pipeline import EnvironmentPipeline, deploy_stacks
+from stack_registry import STACK_REGISTRY, get_registry_dependencies
+
+
+def test_get_stack_dependencies_from_defaults_file():
+    stack_dependencies = stack_graph.get_stack_dependencies()
+    assert stack_dependencies['S3VPCEndpoint'] == {'BaseNetwork'}
+    assert stack_dependencies['Route53InternalZone'] == {'BaseNetwork'}
+    assert not stack_dependencies.get('BaseNetwork')
+
+
+def test_get_stack_order_levels():
+    stack_order = stack_graph.get_stack_order(list(STACK_REGISTRY), get_registry_dependencies())
+    assert stack_order == [['BaseNetwork', 'SNSTopicSubscriptions'], ['Route53InternalZone', 'S3VPCEndpoint']]
+
+
+def test_get_stack_order_ignores_stacks_outside_the_run():
+    assert stack_graph.get_stack_order(['S3VPCEndpoint'], {'S3VPCEndpoint': {'BaseNetwork'}}) == [['S3VPCEndpoint']]
+
+
+def test_get_stack_order_circular_dependency():
+    with pytest.raises(ValueError, match='Circular stack dependency: A, B'):
+        stack_graph.get_stack_order(['A', 'B', 'C'], {'A': {'B'}, 'B': {'A'}})
+
+
+def test_deploy_stack_graph_runs_independent_stacks_together():
+    # A and B only finish once both have started
+    started = threading.Barrier(2, timeout=5)
+
+    def deploy_independent(stack_results):
+        started.wait()
+        return 'done'
+
+    stack_results, stack_failures = stack_graph.deploy_stack_graph(
+        {'A': deploy_independent, 'B': deploy_independent, 'C': lambda stack_results: sorted(stack_results)},
+        {'C': {'A', 'B'}})
+    assert stack_failures == {}
+    assert stack_results == {'A': 'done', 'B': 'done', 'C': ['A', 'B']}
+
+
+def test_deploy_stack_graph_skips_dependents_of_a_failure():
+    def deploy_failing(stack_results):
+        raise RuntimeError('A failed')
+
+    stack_results, stack_failures = stack_graph.deploy_stack_graph(
+        {'A': deploy_failing, 'B': lambda stack_results: 'B', 'C': lambda stack_results: 'C',
+         'D': lambda stack_results: 'D'},
+        {'B': {'A'}, 'C': {'B'}})
+    assert stack_results == {'D': 'D'}
+    assert stack_failures == {'A': 'A failed', 'B': 'Skipped, depends on failed stack A',
+                              'C': 'Skipped, depends on failed stack B'}
+
+
+def test_deploy_registry_stacks_against_fake_aws(fake_aws, state_store):
+    settings = {'ddi': '123456', 'raw_account_name': 'Test', 'region': 'us-east-1', 'stack_prefix': 'prod',
+                'environment': 'Production', 'credentials': {'profile_name': 'test', 'region_name': 'us-east-1'},
+                'az_count': '2', 'cidr': '172.18.0.0/16', 'internal_zone_name': 'prod',
+                'raw_sns_topic_name': 'Test Topic', 'sns_protocol_1': 'email', 'sns_endpoint_1': 'ops@example.com',
+                'sns_protocol_2': 'email', 'sns_endpoint_2': '', 'sns_protocol_3': 'email', 'sns_endpoint_3': '',
+                'cf_directory': ''}
+    pipeline = EnvironmentPipeline(settings)
+    pipeline.start_stacks()
+    stack_results, stack_failures = deploy_stacks(pipeline)
+    assert stack_failures == {}
+    assert sorted(stack_results) == sorted(STACK_REGISTRY)
+    # S3VPCEndpoint was given BaseNetwork's outputs, so it was created after it
+    base_network = fake_aws.stacks[('test', 'us-east-1', 'prod-BaseNetwork')]
+    s3_vpc = fake_aws.stacks[('test', 'us-east-1', 'prod-S3-VPC-Endpoint')]
+    assert s3_vpc['CreationTime'] >= base_network['CompleteTime']
+    parameters = dict([(parameter['ParameterKey'], parameter['ParameterValue'])
+                       for parameter in s3_vpc['Parameters']])
+    outputs = dict([(output['OutputKey'], output['OutputValue']) for output in base_network['Outputs']])
+    assert parameters['VPCID'] == outputs['VPCID']
+    assert len(parameters['RouteTableIdsList'].split(',')) == 3
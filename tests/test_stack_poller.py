@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+from aws_clients import get_client
+from fake_aws import get_client_error
+from stack_poller import StackPoller
+
+
+def create_stacks(cf, stack_names):
+    for stack_name in stack_names:
+        cf.create_stack(StackName=stack_name, TemplateURL='https://bucket/' + stack_name + '.template')
+
+
+def wait_all(stack_poller, stack_names, paged_cf=None):
+    # Wait for every stack on its own thread, return {stack name: result or
+    # exception}. paged_cf starts listing once every stack is watched.
+    results = {}
+
+    def wait(stack_name):
+        try:
+            results[stack_name] = stack_poller.wait(stack_name, timeout=10)
+        except Exception as e:
+            results[stack_name] = e
+
+    threads = [threading.Thread(target=wait, args=(stack_name,)) for stack_name in stack_names]
+    for thread in threads:
+        thread.start()
+    if paged_cf is not None:
+        while len(stack_poller.get_waiters()) < len(stack_names):
+            time.sleep(0.01)
+        paged_cf.ready.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class PagedClient(object):
+    # Wraps a fake CloudFormation client: describe_stacks pages hold one
+    # stack each, and page page of listing listing fails with
+    # errors[(listing, page)], when given
+
+    def __init__(self, cf, errors=None):
+        self.cf = cf
+        self.errors = errors or {}
+        self.listings = 0
+        self.ready = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.cf, name)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator(object):
+            def paginate(self):
+                client.listings += 1
+                for page, stack in enumerate(client.cf.describe_stacks()['Stacks']):
+                    error = client.errors.get((client.listings, page))
+                    if error is not None:
+                        raise error
+                    yield {'Stacks': [stack]}
+        return Paginator()
+
+
+class PagedStackPoller(StackPoller):
+    # Starts its first listing once the PagedClient is ready, so that
+    # listing covers every stack watched by then
+
+    def start_poll(self):
+        self.cf.ready.wait()
+        return StackPoller.start_poll(self)
+
+
+def test_stack_poller_batches_describe_stacks(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    stack_names = ['stack-' + str(number) for number in range(8)]
+    create_stacks(cf, stack_names)
+    stack_poller = StackPoller(cf)
+    results = wait_all(stack_poller, stack_names)
+    assert [results[stack_name]['StackStatus'] for stack_name in stack_names] == ['CREATE_COMPLETE'] * 8
+    # One listing per tick for all eight stacks
+    assert fake_aws.call_counts['cloudformation:DescribeStacks'] == stack_poller.poll_count
+
+
+def test_stack_poller_retries_transient_errors(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(cf, ['stack-a', 'stack-b'])
+    error = get_client_error('InternalError', 'Try again', 'DescribeStacks', 500)
+    paged_cf = PagedClient(cf, {(1, 0): error, (2, 0): error})
+    results = wait_all(PagedStackPoller(paged_cf), ['stack-a', 'stack-b'], paged_cf)
+    assert results['stack-a']['StackStatus'] == 'CREATE_COMPLETE'
+    assert results['stack-b']['StackStatus'] == 'CREATE_COMPLETE'
+
+
+def test_stack_poller_fails_only_the_stacks_the_failed_listing_covered(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(cf, ['stack-a', 'stack-b'])
+    fake_aws.stacks[('test', 'us-east-1', 'stack-a')]['CompleteTime'] = 0
+    # The first listing reads stack-a, then fails on stack-b's page
+    error = get_client_error('AccessDenied', 'Not allowed', 'DescribeStacks', 403)
+    paged_cf = PagedClient(cf, {(1, 1): error})
+    stack_poller = PagedStackPoller(paged_cf)
+    results = wait_all(stack_poller, ['stack-a', 'stack-b'], paged_cf)
+    assert results['stack-a']['StackStatus'] == 'CREATE_COMPLETE'
+    assert results['stack-b'] is error
+    # A stack watched after the failure is polled as usual
+    assert stack_poller.wait('stack-b', timeout=10)['StackStatus'] == 'CREATE_COMPLETE'
+
+
+def test_stack_poller_error_after_retries(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(cf, ['stack-a'])
+    error = get_client_error('InternalError', 'Still failing', 'DescribeStacks', 500)
+    paged_cf = PagedClient(cf, dict([((listing, 0), error) for listing in range(1, 4)]))
+    paged_cf.ready.set()
+    with pytest.raises(type(error)):
+        PagedStackPoller(paged_cf, max_attempts=3).wait('stack-a', timeout=10)
+
+
+class HeldClient(object):
+    # Wraps a fake CloudFormation client: the first describe_stacks listing
+    # takes its snapshot, sets listed and holds its pages until release
+
+    def __init__(self, cf):
+        self.cf = cf
+        self.listed = threading.Event()
+        self.release = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.cf, name)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator(object):
+            def paginate(self):
+                stacks = client.cf.describe_stacks()['Stacks']
+                if not client.listed.is_set():
+                    client.listed.set()
+                    client.release.wait()
+                yield {'Stacks': stacks}
+        return Paginator()
+
+
+def test_stack_poller_ignores_listing_started_before_watch(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(cf, ['stack-a', 'stack-b'])
+    fake_aws.stacks[('test', 'us-east-1', 'stack-b')]['CompleteTime'] = 0
+    held_cf = HeldClient(cf)
+    stack_poller = StackPoller(held_cf)
+    results = {}
+
+    def wait(stack_name):
+        results[stack_name] = stack_poller.wait(stack_name, timeout=10)
+
+    threads = [threading.Thread(target=wait, args=('stack-a',))]
+    threads[0].start()
+    # stack-b is updated and watched while a listing holding its
+    # CREATE_COMPLETE status is in flight
+    held_cf.listed.wait()
+    cf.create_change_set(StackName='stack-b', ChangeSetName='update',
+                         Parameters=[{'ParameterKey': 'Changed', 'ParameterValue': 'yes'}])
+    cf.execute_change_set(StackName='stack-b', ChangeSetName='update')
+    threads.append(threading.Thread(target=wait, args=('stack-b',)))
+    threads[1].start()
+    while 'stack-b' not in stack_poller.get_waiters():
+        time.sleep(0.01)
+    held_cf.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results['stack-a']['StackStatus'] == 'CREATE_COMPLETE'
+    assert results['stack-b']['StackStatus'] == 'UPDATE_COMPLETE'
+    assert not results['stack-b']['Failed']
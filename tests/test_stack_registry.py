@@ -0,0 +1,141 @@
+import pytest
+
+import stack_registry
+from aws_clients import get_client
+from deploy_pipeline import EnvironmentPipeline, deploy_stacks
+from stack_registry import get_stack_parameters, prepare_registry_stack, register_stack, submit_stack
+
+
+SETTINGS = {'stack_prefix': 'prod', 'az_count': '2', 'cidr': '10.0.0.0/16', 'environment': 'Production',
+            'internal_zone_name': 'prod.internal'}
+
+
+class OutputExportsResolver(object):
+    # Resolves an upstream output to '<stack name>.<output key>'
+
+    def resolve(self, stack_name, output_key):
+        return stack_name + '.' + output_key
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # An empty registry for register_stack to fill
+    monkeypatch.setattr(stack_registry, 'STACK_REGISTRY', {})
+    monkeypatch.setattr(stack_registry, 'STACK_REGISTRY_KEYS', [])
+    return stack_registry
+
+
+def get_computed_environment(settings, stack_results):
+    return settings['environment'].upper()
+
+
+def test_register_stack_merges_defaults_file_sources(registry):
+    # The defaults file gives InternalZoneName, Environment and VPCID; the
+    # entry replaces Environment and adds a parameter of its own
+    register_stack('BaseNetwork', 'BaseNetwork', 'base_network.template')
+    register_stack('Route53InternalZone', 'Zone', 'zone.template',
+                   [('Environment', get_computed_environment), ('Comment', 'stack_prefix')],
+                   depends_on=['SNSTopicSubscriptions'])
+    entry = registry.STACK_REGISTRY['Route53InternalZone']
+    assert (entry['stack_name'], entry['cf_template']) == ('Zone', 'zone.template')
+    assert entry['parameters'] == [('InternalZoneName', 'internal_zone_name'), ('VPCID', 'BaseNetwork:VPCID'),
+                                   ('Environment', get_computed_environment), ('Comment', 'stack_prefix')]
+    # Upstream outputs and depends_on are dependencies
+    assert entry['dependencies'] == {'BaseNetwork', 'SNSTopicSubscriptions'}
+
+    assert get_stack_parameters('Route53InternalZone', SETTINGS, {}, registry.STACK_REGISTRY,
+                                OutputExportsResolver()) == [
+        {'ParameterKey': 'InternalZoneName', 'ParameterValue': 'prod.internal'},
+        {'ParameterKey': 'VPCID', 'ParameterValue': 'prod-BaseNetwork.VPCID'},
+        {'ParameterKey': 'Environment', 'ParameterValue': 'PRODUCTION'},
+        {'ParameterKey': 'Comment', 'ParameterValue': 'prod'}]
+
+
+def test_register_stack_again_replaces_the_entry(registry):
+    register_stack('SNSTopicSubscriptions', 'Topic', 'topic.template')
+    register_stack('Custom', 'Custom', 'custom.template', [('VPCID', 'BaseNetwork:VPCID')])
+    register_stack('SNSTopicSubscriptions', 'Topic-2', 'topic.template', [('DisplayName', 'stack_prefix')])
+
+    assert registry.STACK_REGISTRY_KEYS == ['SNSTopicSubscriptions', 'Custom']
+    assert registry.STACK_REGISTRY['SNSTopicSubscriptions']['stack_name'] == 'Topic-2'
+    assert registry.STACK_REGISTRY['SNSTopicSubscriptions']['parameters'][-1] == ('DisplayName', 'stack_prefix')
+    # A stack the defaults file does not list only has its own sources
+    assert registry.STACK_REGISTRY['Custom']['parameters'] == [('VPCID', 'BaseNetwork:VPCID')]
+    assert registry.STACK_REGISTRY['Custom']['dependencies'] == {'BaseNetwork'}
+
+
+@pytest.mark.parametrize('az_count, route_tables', [
+    ('2', ['RouteTablePublic', 'RouteTablePrivateAZ1', 'RouteTablePrivateAZ2']),
+    ('3', ['RouteTablePublic', 'RouteTablePrivateAZ1', 'RouteTablePrivateAZ2', 'RouteTablePrivateAZ3'])])
+def test_stack_parameters_list_of_outputs(az_count, route_tables):
+    # The defaults file's route table list leaves out the third AZ's route
+    # table unless there are three AZs
+    parameters = get_stack_parameters('S3VPCEndpoint', dict(SETTINGS, az_count=az_count), {},
+                                      exports_resolver=OutputExportsResolver())
+    assert parameters == [
+        {'ParameterKey': 'VPCID', 'ParameterValue': 'prod-BaseNetwork.VPCID'},
+        {'ParameterKey': 'RouteTableIdsList',
+         'ParameterValue': ','.join(['prod-BaseNetwork.' + route_table for route_table in route_tables])}]
+
+    # Templates that import their upstream outputs are not given them
+    assert get_stack_parameters('S3VPCEndpoint', dict(SETTINGS, use_imports=True), {},
+                                exports_resolver=OutputExportsResolver()) == []
+
+
+def get_sns_settings(cf_directory, **kwargs):
+    settings = {'ddi': '123456', 'raw_account_name': 'Test', 'region': 'us-east-1', 'environment': 'Production',
+                'stack_prefix': 'prod', 'credentials': {'profile_name': 'test', 'region_name': 'us-east-1'},
+                'raw_sns_topic_name': 'Topic', 'sns_protocol_1': 'email', 'sns_endpoint_1': 'ops@example.com',
+                'sns_protocol_2': 'email', 'sns_endpoint_2': '', 'sns_protocol_3': 'email', 'sns_endpoint_3': '',
+                'cf_directory': cf_directory, 'incremental': True}
+    settings.update(kwargs)
+    return settings
+
+
+def test_prepare_registry_stack_skips_unchanged_deploy_hash(fake_aws, state_store, cf_directory):
+    settings = get_sns_settings(cf_directory)
+    pipeline = EnvironmentPipeline(settings, stack_keys=['SNSTopicSubscriptions'])
+    pipeline.start_stacks()
+    prepared_stack = prepare_registry_stack(pipeline.cf, pipeline.bucket_url, 'SNSTopicSubscriptions', settings, {})
+    assert prepared_stack['Skip'] is None
+    stack_results = deploy_stacks(pipeline)[0]
+
+    # The same template and parameters hash the same as the recorded stack
+    prepared_stack = prepare_registry_stack(pipeline.cf, pipeline.bucket_url, 'SNSTopicSubscriptions', settings, {})
+    assert prepared_stack['Skip'] == stack_results['SNSTopicSubscriptions']
+    call_counts = dict(fake_aws.call_counts)
+    assert deploy_stacks(pipeline) == (stack_results, {})
+    assert dict([(operation, count) for operation, count in fake_aws.call_counts.items()
+                 if operation.startswith('cloudformation:')]) == \
+        dict([(operation, count) for operation, count in call_counts.items()
+              if operation.startswith('cloudformation:')])
+
+    # A changed parameter, or a run that is not incremental, is not skipped
+    for changed_settings in [get_sns_settings(cf_directory, sns_endpoint_1='new@example.com'),
+                             get_sns_settings(cf_directory, incremental=False)]:
+        assert prepare_registry_stack(pipeline.cf, pipeline.bucket_url, 'SNSTopicSubscriptions', changed_settings,
+                                      {})['Skip'] is None
+
+
+def test_submit_stack_waits_on_stack_in_progress(fake_aws):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    parameters = [{'ParameterKey': 'DisplayName', 'ParameterValue': 'Topic'}]
+    assert submit_stack(cf, 'prod-Topic', 'https://bucket/sns_topic_subscriptions.template', parameters)
+    stack = fake_aws.stacks[('test', 'us-east-1', 'prod-Topic')]
+    stack['CompleteTime'] += 60
+
+    # A stack still being created (by an interrupted run) is only waited
+    # on, even when its parameters changed
+    changed_parameters = [{'ParameterKey': 'DisplayName', 'ParameterValue': 'New Topic'}]
+    assert submit_stack(cf, 'prod-Topic', 'https://bucket/sns_topic_subscriptions.template', changed_parameters,
+                        incremental=True)
+    assert fake_aws.call_counts['cloudformation:CreateStack'] == 1
+    assert 'cloudformation:CreateChangeSet' not in fake_aws.call_counts
+    assert stack['StackStatus'] == 'CREATE_IN_PROGRESS'
+
+    # Once it has finished it is left alone, or updated when incremental
+    stack['CompleteTime'] = 0
+    assert not submit_stack(cf, 'prod-Topic', 'https://bucket/sns_topic_subscriptions.template', changed_parameters)
+    assert submit_stack(cf, 'prod-Topic', 'https://bucket/sns_topic_subscriptions.template', changed_parameters,
+                        incremental=True)
+    assert stack['StackStatus'] == 'UPDATE_IN_PROGRESS'
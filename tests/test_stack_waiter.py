@@ -0,0 +1,88 @@
+import stack_waiter
+from aws_clients import get_client
+from deploy_pipeline import EnvironmentPipeline, deploy_stacks
+
+
+class FinishedBeforeEventsClient(object):
+    # describe_stacks still reports CREATE_IN_PROGRESS, but the stack has
+    # finished by the first describe_stack_events call; no event follows
+
+    def __init__(self, stack_name, final_status='CREATE_COMPLETE'):
+        self.stack_name = stack_name
+        self.final_status = final_status
+        self.event_calls = 0
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': 'CREATE_IN_PROGRESS'}]}
+
+    def describe_stack_events(self, StackName, **kwargs):
+        self.event_calls += 1
+        assert self.event_calls < 20, 'the waiter never noticed the stack finished'
+        events = [
+            {'EventId': '3', 'LogicalResourceId': self.stack_name, 'ResourceType': 'AWS::CloudFormation::Stack',
+             'ResourceStatus': self.final_status},
+            {'EventId': '2', 'LogicalResourceId': 'VPC', 'ResourceType': 'AWS::EC2::VPC',
+             'ResourceStatus': 'CREATE_COMPLETE'},
+            {'EventId': '1', 'LogicalResourceId': self.stack_name, 'ResourceType': 'AWS::CloudFormation::Stack',
+             'ResourceStatus': 'CREATE_IN_PROGRESS', 'ResourceStatusReason': 'User Initiated'}
+        ]
+        return {'StackEvents': events}
+
+
+def test_wait_for_stack_finished_before_first_events_call():
+    cf = FinishedBeforeEventsClient('prod-BaseNetwork')
+    result = stack_waiter.wait_for_stack(cf, 'prod-BaseNetwork', initial_delay=0.001, max_delay=0.001)
+    assert result['StackStatus'] == 'CREATE_COMPLETE'
+    assert not result['Failed']
+    assert cf.event_calls == 1
+
+
+def test_wait_for_stack_failed_before_first_events_call():
+    cf = FinishedBeforeEventsClient('prod-BaseNetwork', 'ROLLBACK_COMPLETE')
+    result = stack_waiter.wait_for_stack(cf, 'prod-BaseNetwork', initial_delay=0.001, max_delay=0.001)
+    assert result['StackStatus'] == 'ROLLBACK_COMPLETE'
+    assert result['Failed']
+
+
+class SilentEventsClient(object):
+    # The stack completes but its events never show it
+
+    def __init__(self):
+        self.describe_calls = 0
+
+    def describe_stacks(self, StackName):
+        self.describe_calls += 1
+        stack_status = 'CREATE_IN_PROGRESS' if self.describe_calls == 1 else 'CREATE_COMPLETE'
+        return {'Stacks': [{'StackName': StackName, 'StackStatus': stack_status}]}
+
+    def describe_stack_events(self, StackName, **kwargs):
+        return {'StackEvents': []}
+
+
+def test_wait_for_stack_falls_back_to_describe_stacks():
+    cf = SilentEventsClient()
+    result = stack_waiter.wait_for_stack(cf, 'prod-BaseNetwork', initial_delay=0.001, max_delay=0.001)
+    assert result['StackStatus'] == 'CREATE_COMPLETE'
+    assert cf.describe_calls == 2
+
+
+def test_untouched_update_rollback_complete_stack_is_stable(fake_aws, state_store):
+    # A rerun finds a stack whose last update rolled back; it is used as it
+    # is, and only an update this run starts can fail by rolling back
+    credentials = {'profile_name': 'test', 'region_name': 'us-east-1'}
+    cf = get_client('cloudformation', credentials)
+    cf.create_stack(StackName='prod-SNS-Topic-Subscriptions',
+                    TemplateURL='https://bucket/sns_topic_subscriptions.template')
+    fake_aws.stacks[('test', 'us-east-1', 'prod-SNS-Topic-Subscriptions')].update(
+        {'StackStatus': 'UPDATE_ROLLBACK_COMPLETE'})
+    settings = {'ddi': '123456', 'raw_account_name': 'Test', 'region': 'us-east-1', 'environment': 'Production',
+                'stack_prefix': 'prod', 'credentials': credentials, 'raw_sns_topic_name': 'Topic',
+                'sns_protocol_1': 'email', 'sns_endpoint_1': '', 'sns_protocol_2': 'email', 'sns_endpoint_2': '',
+                'sns_protocol_3': 'email', 'sns_endpoint_3': '', 'cf_directory': ''}
+    pipeline = EnvironmentPipeline(settings, stack_keys=['SNSTopicSubscriptions'])
+    pipeline.start_stacks()
+    stack_results, stack_failures = deploy_stacks(pipeline)
+    assert stack_failures == {}
+    stack_name, stack_resources = stack_results['SNSTopicSubscriptions']
+    assert stack_name == 'prod-SNS-Topic-Subscriptions'
+    assert 'MySNSTopic' in stack_resources
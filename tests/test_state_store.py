@@ -0,0 +1,53 @@
+from aws_clients import get_client
+from state_store import refresh_state
+
+
+def create_stacks(fake_aws, cf, templates):
+    # Create stacks from {stack name: template} that are already complete
+    for stack_name in templates:
+        cf.create_stack(StackName=stack_name, TemplateURL='https://bucket/' + templates[stack_name])
+        fake_aws.stacks[('test', 'us-east-1', stack_name)]['CompleteTime'] = 0
+
+
+def test_refresh_state_records_stacks(fake_aws, state_store):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(fake_aws, cf, {'prod-BaseNetwork': 'base_network.template',
+                                 'prod-SNS-Topic-Subscriptions': 'sns_topic_subscriptions.template'})
+    assert refresh_state(cf, state_store, '123456', 'us-east-1') == ['prod-BaseNetwork',
+                                                                     'prod-SNS-Topic-Subscriptions']
+    stack = state_store.get_stack('123456', 'us-east-1', 'prod-BaseNetwork')
+    assert stack['StackStatus'] == 'CREATE_COMPLETE'
+    assert stack['Outputs']['VPCID'] == stack['Resources']['VPCBase']
+
+
+def test_refresh_state_only_relists_changed_stacks(fake_aws, state_store):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(fake_aws, cf, {'prod-BaseNetwork': 'base_network.template',
+                                 'prod-SNS-Topic-Subscriptions': 'sns_topic_subscriptions.template'})
+    refresh_state(cf, state_store, '123456', 'us-east-1')
+    list_calls = fake_aws.call_counts['cloudformation:ListStackResources']
+
+    assert refresh_state(cf, state_store, '123456', 'us-east-1') == []
+    assert fake_aws.call_counts['cloudformation:ListStackResources'] == list_calls
+
+    fake_aws.stacks[('test', 'us-east-1', 'prod-BaseNetwork')].update({'StackStatus': 'UPDATE_COMPLETE',
+                                                                        'LastUpdatedTime': 1.0})
+    assert refresh_state(cf, state_store, '123456', 'us-east-1') == ['prod-BaseNetwork']
+    assert fake_aws.call_counts['cloudformation:ListStackResources'] == list_calls + 1
+    assert refresh_state(cf, state_store, '123456', 'us-east-1', full=True) == [
+        'prod-BaseNetwork', 'prod-SNS-Topic-Subscriptions']
+
+
+def test_refresh_state_full_removes_deleted_stacks(fake_aws, state_store):
+    cf = get_client('cloudformation', {'profile_name': 'test', 'region_name': 'us-east-1'})
+    create_stacks(fake_aws, cf, {'prod-BaseNetwork': 'base_network.template',
+                                 'prod-SNS-Topic-Subscriptions': 'sns_topic_subscriptions.template'})
+    refresh_state(cf, state_store, '123456', 'us-east-1')
+    fake_aws.stacks[('test', 'us-east-1', 'prod-SNS-Topic-Subscriptions')]['StackStatus'] = 'DELETE_COMPLETE'
+
+    # An incremental refresh leaves stacks it no longer sees alone
+    refresh_state(cf, state_store, '123456', 'us-east-1')
+    assert state_store.get_stack('123456', 'us-east-1', 'prod-SNS-Topic-Subscriptions') is not None
+    refresh_state(cf, state_store, '123456', 'us-east-1', full=True)
+    assert state_store.get_stack('123456', 'us-east-1', 'prod-SNS-Topic-Subscriptions') is None
+    assert [stack[2] for stack in state_store.list_stacks('123456', 'us-east-1')] == ['prod-BaseNetwork']
@@ -0,0 +1,51 @@
+import pytest
+
+from aws_clients import get_client
+from subnet_plan import get_subnet_plan, validate_subnet_plan
+
+
+def test_subnet_plan_layout():
+    assert get_subnet_plan('172.18.0.0/16') == {
+        'PublicSubnetAZ1': '172.18.0.0/22', 'PublicSubnetAZ2': '172.18.4.0/22', 'PublicSubnetAZ3': '172.18.8.0/22',
+        'PrivateSubnetAZ1': '172.18.32.0/21', 'PrivateSubnetAZ2': '172.18.40.0/21',
+        'PrivateSubnetAZ3': '172.18.48.0/21'}
+
+
+@pytest.mark.parametrize('cidr', ['10.0.0.0/16', '10.1.0.0/19', '10.2.0.0/22'])
+def test_subnet_plan_valid_prefix_lengths(cidr):
+    subnet_plan = get_subnet_plan(cidr)
+    assert len(subnet_plan) == 6
+    assert subnet_plan['PublicSubnetAZ1'].split('/')[0] == cidr.split('/')[0]
+
+
+@pytest.mark.parametrize('cidr', ['10.0.0.0/15', '10.0.0.0/23', '10.0.0.0/28', 'fd00::/56', '10.0.0.1/16',
+                                  'not a range'])
+def test_subnet_plan_invalid_ranges(cidr):
+    with pytest.raises(ValueError):
+        get_subnet_plan(cidr)
+
+
+@pytest.mark.parametrize('az_count', ['2', '3', 2, 3])
+def test_validate_subnet_plan_az_counts(az_count):
+    assert validate_subnet_plan('10.0.0.0/16', az_count) == get_subnet_plan('10.0.0.0/16')
+
+
+@pytest.mark.parametrize('az_count', ['1', '4', 'two'])
+def test_validate_subnet_plan_invalid_az_counts(az_count):
+    with pytest.raises(ValueError, match='Availability zone count'):
+        validate_subnet_plan('10.0.0.0/16', az_count)
+
+
+def test_validate_subnet_plan_existing_vpcs(fake_aws):
+    credentials = {'profile_name': 'test', 'region_name': 'us-east-1'}
+    cf = get_client('cloudformation', credentials)
+    ec2 = get_client('ec2', credentials)
+    cf.create_stack(StackName='prod-BaseNetwork', TemplateURL='https://bucket/base_network.template',
+                    Parameters=[{'ParameterKey': 'CIDRRange', 'ParameterValue': '10.0.0.0/16'}])
+
+    with pytest.raises(ValueError, match='overlaps'):
+        validate_subnet_plan('10.0.128.0/17', '2', ec2)
+    # The stack's own VPC is not a conflict, and other ranges are free
+    assert validate_subnet_plan('10.0.0.0/16', '3', ec2, 'prod-BaseNetwork')
+    assert validate_subnet_plan('10.1.0.0/16', '2', ec2)
+    assert fake_aws.call_counts['ec2:DescribeVpcs'] == 3
@@ -0,0 +1,76 @@
+from aws_clients import get_client
+from stack_registry import STACK_REGISTRY, get_registry_stack_name
+from teardown import teardown_environment
+
+
+CREDENTIALS = {'profile_name': 'test', 'region_name': 'us-east-1'}
+BUCKET = '123456-test-account-cf-templates'
+
+
+def get_teardown_settings(cf_directory):
+    return {'ddi': '123456', 'raw_account_name': 'Test Account', 'region': 'us-east-1', 'environment': 'Prod',
+            'stack_prefix': 'prod', 'cf_directory': cf_directory, 'credentials': CREDENTIALS}
+
+
+def create_environment(fake_aws, cf_directory):
+    # Every registry stack already complete, plus a template bucket and key pair
+    cf = get_client('cloudformation', CREDENTIALS)
+    for key in STACK_REGISTRY:
+        stack_name = get_registry_stack_name(key, 'prod')
+        cf.create_stack(StackName=stack_name, TemplateURL='https://bucket/' + STACK_REGISTRY[key]['cf_template'])
+        fake_aws.stacks[('test', 'us-east-1', stack_name)]['CompleteTime'] = 0
+    s3 = get_client('s3', CREDENTIALS)
+    s3.create_bucket(Bucket=BUCKET)
+    s3.upload_file(cf_directory + '/base_network.template', BUCKET, 'prod/base_network.template')
+    get_client('ec2', CREDENTIALS).create_key_pair(KeyName='us-east-1-prod-test-account')
+
+
+def get_stack_event_time(fake_aws, stack_name, status):
+    stack = fake_aws.stacks[('test', 'us-east-1', stack_name)]
+    return [event['Timestamp'] for event in stack['Events']
+            if event['LogicalResourceId'] == stack_name and event['ResourceStatus'] == status][0]
+
+
+def test_teardown_deletes_in_reverse_dependency_order(fake_aws, state_store, cf_directory):
+    create_environment(fake_aws, cf_directory)
+    teardown_results = teardown_environment(get_teardown_settings(cf_directory), empty_bucket=True,
+                                            delete_key_pair=True)
+
+    assert teardown_results['stack_failures'] == {}
+    assert sorted(teardown_results['stack_results'].values()) == sorted(
+        [get_registry_stack_name(key, 'prod') for key in STACK_REGISTRY])
+    for key in STACK_REGISTRY:
+        stack = fake_aws.stacks[('test', 'us-east-1', get_registry_stack_name(key, 'prod'))]
+        assert stack['StackStatus'] == 'DELETE_COMPLETE'
+    # The base network goes only once the stacks using its VPC are gone
+    base_network_deleted = get_stack_event_time(fake_aws, 'prod-BaseNetwork', 'DELETE_IN_PROGRESS')
+    for stack_name in ['prod-S3-VPC-Endpoint', 'prod-Route53-InternalZone']:
+        assert get_stack_event_time(fake_aws, stack_name, 'DELETE_COMPLETE') <= base_network_deleted
+
+    assert teardown_results['object_versions_deleted'] == 1
+    assert teardown_results['bucket_deleted']
+    assert teardown_results['key_pair_deleted']
+    assert state_store.list_stacks('123456', 'us-east-1') == []
+
+
+def test_teardown_failure_skips_dependencies_and_keeps_bucket(fake_aws, state_store, cf_directory):
+    create_environment(fake_aws, cf_directory)
+    fake_aws.stacks[('test', 'us-east-1', 'prod-S3-VPC-Endpoint')]['DeleteFails'] = True
+    teardown_results = teardown_environment(get_teardown_settings(cf_directory), empty_bucket=True,
+                                            delete_key_pair=True)
+
+    assert sorted(teardown_results['stack_failures']) == ['BaseNetwork', 'S3VPCEndpoint']
+    assert 'VPCEndpoint' in teardown_results['stack_failures']['S3VPCEndpoint']
+    assert fake_aws.stacks[('test', 'us-east-1', 'prod-BaseNetwork')]['StackStatus'] == 'CREATE_COMPLETE'
+    assert fake_aws.stacks[('test', 'us-east-1', 'prod-SNS-Topic-Subscriptions')]['StackStatus'] == \
+        'DELETE_COMPLETE'
+    assert teardown_results['object_versions_deleted'] is None
+    assert teardown_results['key_pair_deleted'] is None
+    assert ('test', 'us-east-1', 'us-east-1-prod-test-account') in fake_aws.key_pairs
+
+
+def test_teardown_missing_stacks(fake_aws, state_store, cf_directory):
+    # Stacks that were never deployed count as deleted
+    teardown_results = teardown_environment(get_teardown_settings(cf_directory), ['SNSTopicSubscriptions'])
+    assert teardown_results['stack_results'] == {'SNSTopicSubscriptions': 'prod-SNS-Topic-Subscriptions'}
+    assert fake_aws.call_counts.get('cloudformation:DeleteStack', 0) == 0
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from template_analyzer import analyze_template, analyze_template_directory, get_template_dependencies
+
+
+NETWORK_TEMPLATE = '''
+AWSTemplateFormatVersion: 2010-09-09
+Parameters:
+  CIDRRange:
+    Type: String
+    Default: 172.18.0.0/16
+Resources:
+  VPCBase:
+    Type: AWS::EC2::VPC
+Outputs:
+  VPCID:
+    Value: !Ref VPCBase
+    Export:
+      Name: !Sub '${AWS::StackName}-VPCID'
+'''
+
+
+def get_consumer_template(network_stack_default=None):
+    # A template importing the network stack's VPC ID through a parameter
+    parameter = {'Type': 'String'}
+    if network_stack_default is not None:
+        parameter['Default'] = network_stack_default
+    return json.dumps({'Parameters': {'NetworkStackName': parameter},
+                       'Resources': {'Zone': {'Type': 'AWS::Route53::HostedZone', 'Properties': {
+                           'VPCs': [{'VPCId': {'Fn::ImportValue': {'Fn::Sub': '${NetworkStackName}-VPCID'}}}]}}}})
+
+
+def test_analyze_template_yaml_short_form():
+    analysis = analyze_template(NETWORK_TEMPLATE)
+    assert analysis['Parameters']['CIDRRange']['Default'] == '172.18.0.0/16'
+    assert analysis['Outputs']['VPCID'] == {'Value': {'Ref': 'VPCBase'},
+                                            'Export': {'Fn::Sub': '${AWS::StackName}-VPCID'}}
+
+
+def test_analyze_template_parameter_not_an_object():
+    with pytest.raises(ValueError, match='Parameters Environment is not an object'):
+        analyze_template(json.dumps({'Parameters': {'Environment': 'Production'}}))
+
+
+def test_analyze_template_directory_reports_bad_templates(tmp_path):
+    (tmp_path / 'bad.template').write_text(json.dumps({'Parameters': ['Environment']}))
+    (tmp_path / 'good.template').write_text(NETWORK_TEMPLATE)
+    template_analyses = analyze_template_directory(str(tmp_path))
+    assert template_analyses['bad.template'] is None
+    assert template_analyses['good.template'] is not None
+
+
+def test_get_template_dependencies_with_declared_stack_names():
+    template_analyses = {'network.template': analyze_template(NETWORK_TEMPLATE),
+                         'zone.template': analyze_template(get_consumer_template('prod-BaseNetwork'))}
+    template_dependencies = get_template_dependencies(
+        template_analyses, {'network.template': {'AWS::StackName': 'prod-BaseNetwork'}})
+    assert template_dependencies == {'network.template': set(), 'zone.template': {'network.template'}}
+
+
+def test_get_template_dependencies_placeholders_are_not_wildcards():
+    # Neither the import's stack name nor the exporting stack's name is
+    # known, so the names cannot be matched
+    template_analyses = {'network.template': analyze_template(NETWORK_TEMPLATE),
+                         'other.template': analyze_template(NETWORK_TEMPLATE),
+                         'zone.template': analyze_template(get_consumer_template())}
+    template_dependencies = get_template_dependencies(template_analyses)
+    assert template_dependencies == {'network.template': set(), 'other.template': set(), 'zone.template': set()}
+
+
+def test_get_template_dependencies_only_the_matching_stack():
+    template_analyses = {'network.template': analyze_template(NETWORK_TEMPLATE),
+                         'other.template': analyze_template(NETWORK_TEMPLATE),
+                         'zone.template': analyze_template(get_consumer_template('prod-BaseNetwork'))}
+    template_dependencies = get_template_dependencies(
+        template_analyses, {'network.template': {'AWS::StackName': 'prod-BaseNetwork'},
+                            'other.template': {'AWS::StackName': 'prod-Other'}})
+    assert template_dependencies['zone.template'] == {'network.template'}
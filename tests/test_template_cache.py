@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+import template_cache
+from template_cache import get_cached_template_defaults, get_template_file_defaults, \
+    get_template_hash, set_cached_template_defaults
+
+
+TEMPLATE = {'Parameters': {'VPCID': {'Type': 'String', 'Default': 'vpc-1'}}, 'Resources': {}}
+
+
+def write_template(tmp_path, template):
+    template_path = str(tmp_path / 'a.template')
+    with open(template_path, 'w') as f:
+        if isinstance(template, dict):
+            json.dump(template, f)
+        else:
+            f.write(template)
+    return template_path
+
+
+def get_cache_files(cache_directory):
+    return sorted(os.listdir(cache_directory))
+
+
+def test_template_defaults_cached_by_hash(tmp_path, monkeypatch):
+    cache_directory = str(tmp_path / 'cache')
+    template_path = write_template(tmp_path, TEMPLATE)
+    assert get_template_file_defaults(template_path, cache_directory=cache_directory) == {'VPCID': 'vpc-1'}
+    assert get_cache_files(cache_directory) == [get_template_hash(template_path) + '.json']
+
+    # An unchanged template is answered from the cache without parsing it
+    parsed = []
+    parse_template_defaults = template_cache.parse_template_defaults
+    monkeypatch.setattr(template_cache, 'parse_template_defaults',
+                        lambda template_body: parsed.append(template_body) or parse_template_defaults(template_body))
+    assert get_template_file_defaults(template_path, cache_directory=cache_directory) == {'VPCID': 'vpc-1'}
+    assert parsed == []
+
+    # A changed template hashes differently and is parsed again
+    template_path = write_template(tmp_path, dict(TEMPLATE, Parameters={'VPCID': {'Default': 'vpc-2'}}))
+    assert get_template_file_defaults(template_path, cache_directory=cache_directory) == {'VPCID': 'vpc-2'}
+    assert len(parsed) == 1
+    assert len(get_cache_files(cache_directory)) == 2
+
+
+def test_remote_template_defaults_cached(tmp_path):
+    cache_directory = str(tmp_path / 'cache')
+    template_path = write_template(tmp_path, '{not a template')
+    remote_calls = []
+
+    def get_remote_template_defaults():
+        remote_calls.append(True)
+        return {'VPCID': ''}
+
+    for attempt in range(2):
+        assert get_template_file_defaults(template_path, get_remote_template_defaults, cache_directory) == \
+            {'VPCID': ''}
+    assert remote_calls == [True]
+
+
+def test_template_cache_evicts_least_recently_used(tmp_path):
+    cache_directory = str(tmp_path / 'cache')
+    for position, template_hash in enumerate(['a', 'b', 'c']):
+        set_cached_template_defaults(template_hash, {'Value': 'x' * 100}, cache_directory)
+        os.utime(os.path.join(cache_directory, template_hash + '.json'), (1000 + position, 1000 + position))
+    entry_size = os.path.getsize(os.path.join(cache_directory, 'a.json'))
+
+    # Reading 'a' makes it the most recently used, so 'b' goes first once
+    # the cache is over three entries' worth
+    assert get_cached_template_defaults('a', cache_directory) == {'Value': 'x' * 100}
+    assert os.path.getmtime(os.path.join(cache_directory, 'a.json')) > 1002
+    set_cached_template_defaults('d', {'Value': 'x' * 100}, cache_directory, max_bytes=3 * entry_size)
+    assert get_cache_files(cache_directory) == ['a.json', 'c.json', 'd.json']
+
+
+def test_template_cache_write_is_atomic(tmp_path, monkeypatch):
+    cache_directory = str(tmp_path / 'cache')
+    set_cached_template_defaults('a', {'VPCID': 'vpc-1'}, cache_directory)
+
+    def dump(template_defaults, f):
+        f.write('{"VPCID": ')
+        raise IOError('disk full')
+
+    with monkeypatch.context() as dump_monkeypatch:
+        dump_monkeypatch.setattr(template_cache.json, 'dump', dump)
+        with pytest.raises(IOError):
+            set_cached_template_defaults('a', {'VPCID': 'vpc-2'}, cache_directory)
+    # The earlier entry is intact and no partial file is left behind
+    assert get_cached_template_defaults('a', cache_directory) == {'VPCID': 'vpc-1'}
+    assert get_cache_files(cache_directory) == ['a.json']
+
+
+def test_template_cache_default_directory(tmp_path, cache_paths):
+    # Without a cache_directory the CACHE_DIRECTORY of the moment is used
+    template_path = write_template(tmp_path, TEMPLATE)
+    assert get_template_file_defaults(template_path) == {'VPCID': 'vpc-1'}
+    assert get_cache_files(str(cache_paths / 'templates')) == [get_template_hash(template_path) + '.json']